@@ -1,20 +1,24 @@
 # analytics.py — チェックイン可視化/分析用 API
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Tuple
 from fastapi import APIRouter, Depends, HTTPException, Query,Request
 from sqlmodel import Session, select, func
 
 from models import engine, Stamp
 from auth import require_research_role   # ★ 追加
-from sqlalchemy import Integer, and_, or_, case
-from fastapi.responses import StreamingResponse
+from sqlalchemy import String, and_, case
 from sqlmodel import col
-from models import engine, Stamp , User
-from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+from models import engine, Stamp , Place
+from rollups import refresh_rollups, checkin_facts, local_hours
+from places import place_refs_of_kind
+from heatmap import binned_cells, heat_tile
+from exports import iter_rows, csv_response, geojson_response, columnar_response, iso
+from fastapi.responses import JSONResponse, HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
+from assets import install_template_helpers
 
 router = APIRouter(prefix="/api", tags=["analytics"])
-templates = Jinja2Templates(directory="templates")
+templates = install_template_helpers(Jinja2Templates(directory="templates"))
 def get_session():
     with Session(engine) as s:
         yield s
@@ -34,7 +38,7 @@ async def checkins_summary_page(
 from datetime import datetime
 
 @router.get("/checkins/summary/data")
-async def api_checkins_summary(
+def api_checkins_summary(
     date_from: str | None = Query(None, description="ISO8601形式の開始日時"),
     date_to:   str | None = Query(None, description="ISO8601形式の終了日時"),
     kind:      str | None = Query(None, description="公園/公共施設 等"),
@@ -42,39 +46,9 @@ async def api_checkins_summary(
 ):
     """
     施設ごとのチェックイン数を集計して返すJSON API。
-    Stamp テーブルを集計対象とする。
+    Stamp の時間別ロールアップ（CheckinHourly）を集計対象とする。
     """
-    q = select(
-        Stamp.place_id,
-        Stamp.place_name,
-        Stamp.kind,
-        func.count(Stamp.id).label("count"),
-        func.min(Stamp.checked_at).label("first_ts"),
-        func.max(Stamp.checked_at).label("last_ts"),
-    )
-
-    # 日時フィルタ（checked_at を対象）
-    if date_from:
-        try:
-            dt_from = datetime.fromisoformat(date_from.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at >= dt_from)
-        except Exception:
-            pass
-    if date_to:
-        try:
-            dt_to = datetime.fromisoformat(date_to.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at <= dt_to)
-        except Exception:
-            pass
-
-    # 種別フィルタ
-    if kind:
-        q = q.where(Stamp.kind == kind)
-
-    q = q.group_by(Stamp.place_id, Stamp.place_name, Stamp.kind)
-    q = q.order_by(func.count(Stamp.id).desc())
-
-    rows = session.exec(q).all()
+    rows = session.exec(summary_query(parse_loose(date_from), parse_loose(date_to), kind)).all()
 
     total_count = sum(r.count for r in rows) if rows else 0
     facility_count = len(rows)
@@ -107,76 +81,25 @@ async def api_checkins_summary(
         "day_span": span_days,
     })
     
-import io
-import csv
-
 @router.get("/export/checkins_summary.csv")
-async def export_checkins_summary_csv(
+def export_checkins_summary_csv(
     date_from: str | None = Query(None),
     date_to:   str | None = Query(None),
     kind:      str | None = Query(None),
-    session: Session = Depends(get_session),
 ):
     """
     チェックイン集計結果を CSV としてダウンロードするエンドポイント。
-    集計対象は Stamp（チェックインログ）。
+    集計対象は Stamp（チェックインログ）の時間別ロールアップ。行は DB から少しずつ流す。
     """
-    q = select(
-        Stamp.place_id,
-        Stamp.place_name,
-        Stamp.kind,
-        func.count(Stamp.id).label("count"),
-        func.min(Stamp.checked_at).label("first_ts"),
-        func.max(Stamp.checked_at).label("last_ts"),
+    stmt = summary_query(parse_loose(date_from), parse_loose(date_to), kind)
+    return csv_response(
+        "checkins_summary.csv",
+        ["place_id", "place_name", "kind", "count", "first_ts", "last_ts"],
+        iter_rows(stmt),
+        lambda r: [r.place_id, r.place_name, r.kind, r.count, iso(r.first_ts), iso(r.last_ts)],
     )
 
-    if date_from:
-        try:
-            dt_from = datetime.fromisoformat(date_from.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at >= dt_from)
-        except Exception:
-            pass
-    if date_to:
-        try:
-            dt_to = datetime.fromisoformat(date_to.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at <= dt_to)
-        except Exception:
-            pass
-    if kind:
-        q = q.where(Stamp.kind == kind)
 
-    q = q.group_by(Stamp.place_id, Stamp.place_name, Stamp.kind)
-    q = q.order_by(func.count(Stamp.id).desc())
-
-    rows = session.exec(q).all()
-
-    bom = "\ufeff"  # ★ これが BOM
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(["place_id", "place_name", "kind", "count", "first_ts", "last_ts"])
-    for r in rows:
-        writer.writerow([
-            r.place_id,
-            r.place_name,
-            r.kind,
-            r.count,
-            r.first_ts.isoformat() if r.first_ts else "",
-            r.last_ts.isoformat()  if r.last_ts else "",
-        ])
-
-    buf.seek(0)
-    text = bom + buf.getvalue() 
-    
-    headers = {
-      "Content-Disposition": 'attachment; filename="checkins_summary.csv"'
-    }
-    return StreamingResponse(
-        iter([text]),
-        media_type="text/csv; charset=utf-8",
-        headers=headers,
-    )
-
-        
 def parse_iso(dt: Optional[str], default: Optional[datetime]) -> datetime:
     if dt:
         try:
@@ -187,6 +110,57 @@ def parse_iso(dt: Optional[str], default: Optional[datetime]) -> datetime:
         raise HTTPException(400, "datetime required")
     return default
 
+def parse_loose(dt: Optional[str]) -> Optional[datetime]:
+    """集計画面用: 読めない値は「指定なし」扱い。タイムゾーン付きは UTC（naive）にそろえる"""
+    if not dt:
+        return None
+    try:
+        v = datetime.fromisoformat(dt.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if v.tzinfo is not None:
+        v = v.astimezone(timezone.utc).replace(tzinfo=None)
+    return v
+
+def summary_query(
+    dt_from: Optional[datetime],
+    dt_to: Optional[datetime],
+    kind: Optional[str],
+    by_age: bool = False,
+    age_group: Optional[str] = None,
+):
+    """
+    施設（+年代）ごとの件数・最初/最後のチェックイン。期間は dt_from <= t <= dt_to。
+    列: place_id, place_name, kind, [age_group], count, first_ts, last_ts（件数の多い順）
+    """
+    refresh_rollups()
+    f = checkin_facts(dt_from, dt_to, to_inclusive=True)
+    # 整数の place_ref（+年代）で集計してから Place を引く
+    group = [f.c.place_ref] + ([f.c.age_group] if by_age else [])
+    agg = select(
+        *group,
+        func.sum(f.c.n).label("count"),
+        func.min(f.c.first_at).label("first_ts"),
+        func.max(f.c.last_at).label("last_ts"),
+    )
+    if kind:
+        agg = agg.where(f.c.place_ref.in_(place_refs_of_kind(kind)))
+    if age_group:
+        agg = agg.where(f.c.age_group == age_group)
+    agg = agg.group_by(*group).subquery("agg")
+
+    cols = [Place.place_id, Place.name.label("place_name"), Place.kind]
+    if by_age:
+        cols.append(agg.c.age_group)
+    q = (
+        select(*cols, agg.c.count, agg.c.first_ts, agg.c.last_ts)
+        .select_from(agg)
+        .join(Place, Place.id == agg.c.place_ref)
+        .order_by(agg.c.count.desc())
+    )
+    return q
+
+
 # ====== 1) ヒートマップ用のポイント ======
 @router.get("/stats/heatmap")
 def stats_heatmap(
@@ -200,25 +174,30 @@ def stats_heatmap(
     tod: Optional[str] = Query(None, description="morning/noon/evening/night/late"),
     hour_from: Optional[int] = None,
     hour_to:   Optional[int] = None,
+    # ★ mode=grid: サーバー側でマス目にまとめた重み付きの点を返す（points と同じ [lat, lon, 重み] 形式）
+    mode: str = Query("points", regex="^(points|grid)$"),
+    zoom: int = Query(10, ge=0, le=22, description="grid: 地図のズーム（マスの細かさ）"),
+    cell_px: int = Query(16, ge=4, le=64, description="grid: マス 1 辺の画面ピクセル数"),
+    bbox: Optional[str] = Query(None, description="grid: 南,西,北,東（表示範囲で切り出す）"),
     user = Depends(require_research_role),   # ★ 追加
 ):
     now = datetime.utcnow()
     dt_from = parse_iso(date_from, now - timedelta(days=30))
     dt_to   = parse_iso(date_to,   now)
 
+    if mode == "grid":
+        if not date_from:
+            dt_from = dt_from.replace(minute=0, second=0, microsecond=0)   # キャッシュが効くよう時単位に
+        return heatmap_grid(session, dt_from, dt_to if date_to else None, kind, tod, hour_from, hour_to, zoom, cell_px, bbox)
+
     q = select(Stamp.lat, Stamp.lon).where(Stamp.checked_at >= dt_from, Stamp.checked_at < dt_to)
     if kind:
-        q = q.where(Stamp.kind == kind)
+        q = q.where(Stamp.place_ref.in_(place_refs_of_kind(kind)))
 
     hr = resolve_hour_range(tod, hour_from, hour_to)
     if hr:
-        hcol = hour_extract_expr()
-        a, b = hr
-        if a <= b:
-            q = q.where(and_(hcol >= a, hcol < b))
-        else:
-            # 深夜など跨ぐケース (例: 23-5)
-            q = q.where(or_(hcol >= a, hcol < b))
+        # 現地時間の時で絞る（(local_hour, checked_at) のインデックスを時ごとに引く）
+        q = q.where(Stamp.local_hour.in_(local_hours(hr)))
 
     rows = session.exec(q.limit(max_points)).all()
     points = [[float(lat), float(lon), 1.0] for (lat, lon) in rows if lat is not None and lon is not None]
@@ -227,6 +206,77 @@ def stats_heatmap(
     return {"ok": True, "count": len(points), "points": points, **meta}
 
 
+def parse_bbox(bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    if not bbox:
+        return None
+    try:
+        south, west, north, east = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(400, "invalid bbox (south,west,north,east)")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise HTTPException(400, "invalid bbox (south,west,north,east)")
+    return south, west, north, east
+
+def heatmap_grid(session, dt_from, dt_to, kind, tod, hour_from, hour_to, zoom, cell_px, bbox):
+    """
+    stats_heatmap の mode=grid。施設ごとの件数をズームに合わせたマス目にまとめて返す。
+    dt_to が None（date_to 省略）なら現在まで（キャッシュのキーが毎回変わらないように）。
+    """
+    hr = resolve_hour_range(tod, hour_from, hour_to)
+    refresh_rollups()
+    cells, cached = binned_cells(
+        session, dt_from, dt_to, kind, local_hours(hr), zoom, cell_px, parse_bbox(bbox),
+    )
+    res = {
+        "ok": True, "mode": "grid", "zoom": zoom, "cell_px": cell_px,
+        "count": len(cells),
+        "total": sum(c[2] for c in cells),
+        "max": max((c[2] for c in cells), default=0),
+        "points": cells,
+        "cached": cached,
+        "from": dt_from.isoformat()+"Z",
+        "to": (dt_to or datetime.utcnow()).isoformat()+"Z",
+        "kind": kind or "all",
+    }
+    if hr: res["hour_range"] = hr
+    return res
+
+
+# ====== 1b) ヒートマップのタイル画像（PNG） ======
+@router.get("/stats/heatmap/tiles/{z}/{x}/{y}.png")
+def stats_heatmap_tile(
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    session: Session = Depends(get_session),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    kind: Optional[str] = None,
+    tod: Optional[str] = None, hour_from: Optional[int] = None, hour_to: Optional[int] = None,
+    radius: int = Query(12, ge=2, le=40, description="ぼかしの半径（px）"),
+    user = Depends(require_research_role),
+):
+    """
+    チェックイン密度をサーバー側で描いた 256px の PNG タイル（Leaflet の L.tileLayer 用）。
+    タイルは条件ごとにディスクへ保存し、チェックインが増えると描き直す。
+    """
+    if not (0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(400, "invalid tile")
+    now = datetime.utcnow()
+    # 省略時の期間はキャッシュが効くよう時単位に丸める（終わりは「現在まで」）
+    dt_from = parse_iso(date_from, (now - timedelta(days=30)).replace(minute=0, second=0, microsecond=0))
+    dt_to = parse_iso(date_to, now) if date_to else None
+    hr = resolve_hour_range(tod, hour_from, hour_to)
+
+    refresh_rollups()
+    png, etag = heat_tile(session, dt_from, dt_to, kind, local_hours(hr), z, x, y, radius)
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(png, media_type="image/png", headers=headers)
+
+
 # ====== 2) 時系列（時間/日/週） ======
 @router.get("/stats/timeseries")
 def stats_timeseries(
@@ -243,26 +293,21 @@ def stats_timeseries(
     dt_from = parse_iso(date_from, now - timedelta(days=30))
     dt_to   = parse_iso(date_to,   now)
 
-    ts_col = Stamp.checked_at
+    hr = resolve_hour_range(tod, hour_from, hour_to)
+    refresh_rollups()
+    f = checkin_facts(dt_from, dt_to, hours=local_hours(hr))
+    # バケットは現地時間（日本時間）の日付・時で切る
+    date_col, hour_col = f.c.local_date, f.c.local_hour
     if bucket == "hour":
-        key = func.strftime("%Y-%m-%d %H:00", ts_col) if engine.url.get_backend_name()=="sqlite" else func.to_char(ts_col, "YYYY-MM-DD HH24:00")
+        key = func.printf("%s %02d:00", date_col, hour_col) if engine.url.get_backend_name()=="sqlite" else func.concat(func.to_char(date_col, "YYYY-MM-DD"), " ", func.lpad(func.cast(hour_col, String), 2, "0"), ":00")
     elif bucket == "week":
-        key = func.strftime("%Y-W%W", ts_col) if engine.url.get_backend_name()=="sqlite" else func.to_char(ts_col, "IYYY-IW")
+        key = func.strftime("%Y-W%W", date_col) if engine.url.get_backend_name()=="sqlite" else func.to_char(date_col, "IYYY-IW")
     else:
-        key = func.strftime("%Y-%m-%d", ts_col) if engine.url.get_backend_name()=="sqlite" else func.to_char(ts_col, "YYYY-MM-DD")
+        key = func.strftime("%Y-%m-%d", date_col) if engine.url.get_backend_name()=="sqlite" else func.to_char(date_col, "YYYY-MM-DD")
 
-    q = select(key.label("k"), func.count().label("c")).where(ts_col >= dt_from, ts_col < dt_to)
+    q = select(key.label("k"), func.sum(f.c.n).label("c"))
     if kind:
-        q = q.where(Stamp.kind == kind)
-
-    hr = resolve_hour_range(tod, hour_from, hour_to)
-    if hr:
-        hcol = hour_extract_expr()
-        a,b = hr
-        if a <= b:
-            q = q.where(and_(hcol >= a, hcol < b))
-        else:
-            q = q.where(or_(hcol >= a, hcol < b))
+        q = q.where(f.c.place_ref.in_(place_refs_of_kind(kind)))
 
     q = q.group_by("k").order_by("k")
     rows = session.exec(q).all()
@@ -285,18 +330,16 @@ def stats_by_kind(
     dt_from = parse_iso(date_from, now - timedelta(days=30))
     dt_to   = parse_iso(date_to,   now)
 
-    q = select(Stamp.kind, func.count()).where(Stamp.checked_at >= dt_from, Stamp.checked_at < dt_to)
-
     hr = resolve_hour_range(tod, hour_from, hour_to)
-    if hr:
-        hcol = hour_extract_expr()
-        a,b = hr
-        if a <= b:
-            q = q.where(and_(hcol >= a, hcol < b))
-        else:
-            q = q.where(or_(hcol >= a, hcol < b))
-
-    q = q.group_by(Stamp.kind)
+    refresh_rollups()
+    f = checkin_facts(dt_from, dt_to, hours=local_hours(hr))
+    agg = select(f.c.place_ref, func.sum(f.c.n).label("n")).group_by(f.c.place_ref).subquery("agg")
+    q = (
+        select(Place.kind, func.sum(agg.c.n))
+        .select_from(agg)
+        .join(Place, Place.id == agg.c.place_ref)
+        .group_by(Place.kind)
+    )
     rows = session.exec(q).all()
     items = [{"kind": k or "不明", "count": int(c)} for (k, c) in rows]
     res = {"ok": True, "from": dt_from.isoformat()+"Z", "to": dt_to.isoformat()+"Z", "items": items}
@@ -304,7 +347,7 @@ def stats_by_kind(
     return res
 
 @router.get("/checkins/by-age")
-async def api_checkins_by_age(
+def api_checkins_by_age(
     date_from: str | None = Query(None, description="ISO8601形式の開始日時"),
     date_to:   str | None = Query(None, description="ISO8601形式の終了日時"),
     kind:      str | None = Query(None, description="公園/公共施設 等"),
@@ -312,48 +355,16 @@ async def api_checkins_by_age(
     session: Session = Depends(get_session),
 ):
     """
-    年代別（User.age_group）に施設ごとのチェックイン数を集計して返す。
+    年代別（チェックイン時点の年代 Stamp.age_group）に施設ごとのチェックイン数を集計して返す。
     """
     valid_age_groups = {"child", "adult", "senior"}
     if age_group and age_group not in valid_age_groups:
         raise HTTPException(400, "invalid age_group (child/adult/senior)")
 
-    q = select(
-        Stamp.place_id,
-        Stamp.place_name,
-        Stamp.kind,
-        func.coalesce(User.age_group, "unknown").label("age_group"),
-        func.count(Stamp.id).label("count"),
-        func.min(Stamp.checked_at).label("first_ts"),
-        func.max(Stamp.checked_at).label("last_ts"),
-    ).join(User, User.id == Stamp.user_id)
-
-    if date_from:
-        try:
-            dt_from = datetime.fromisoformat(date_from.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at >= dt_from)
-        except Exception:
-            pass
-    if date_to:
-        try:
-            dt_to = datetime.fromisoformat(date_to.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at <= dt_to)
-        except Exception:
-            pass
-
-    if kind:
-        q = q.where(Stamp.kind == kind)
-    if age_group:
-        q = q.where(User.age_group == age_group)
-
-    q = q.group_by(
-        Stamp.place_id,
-        Stamp.place_name,
-        Stamp.kind,
-        User.age_group,
-    ).order_by(func.count(Stamp.id).desc())
-
-    rows = session.exec(q).all()
+    rows = session.exec(summary_query(
+        parse_loose(date_from), parse_loose(date_to), kind,
+        by_age=True, age_group=age_group,
+    )).all()
 
     total_count = sum(r.count for r in rows) if rows else 0
     items = [
@@ -376,12 +387,11 @@ async def api_checkins_by_age(
     })
 
 @router.get("/export/checkins_by_age.csv")
-async def export_checkins_by_age_csv(
+def export_checkins_by_age_csv(
     date_from: str | None = Query(None),
     date_to:   str | None = Query(None),
     kind:      str | None = Query(None),
     age_group: str | None = Query(None),
-    session: Session = Depends(get_session),
 ):
     """
     年代別チェックイン集計を CSV としてダウンロードするエンドポイント。
@@ -390,74 +400,21 @@ async def export_checkins_by_age_csv(
     if age_group and age_group not in valid_age_groups:
         raise HTTPException(400, "invalid age_group (child/adult/senior)")
 
-    q = select(
-        Stamp.place_id,
-        Stamp.place_name,
-        Stamp.kind,
-        func.coalesce(User.age_group, "unknown").label("age_group"),
-        func.count(Stamp.id).label("count"),
-        func.min(Stamp.checked_at).label("first_ts"),
-        func.max(Stamp.checked_at).label("last_ts"),
-    ).join(User, User.id == Stamp.user_id)
-
-    if date_from:
-        try:
-            dt_from = datetime.fromisoformat(date_from.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at >= dt_from)
-        except Exception:
-            pass
-    if date_to:
-        try:
-            dt_to = datetime.fromisoformat(date_to.replace("Z", "+00:00"))
-            q = q.where(Stamp.checked_at <= dt_to)
-        except Exception:
-            pass
-    if kind:
-        q = q.where(Stamp.kind == kind)
-    if age_group:
-        q = q.where(User.age_group == age_group)
-
-    q = q.group_by(
-        Stamp.place_id,
-        Stamp.place_name,
-        Stamp.kind,
-        User.age_group,
-    ).order_by(func.count(Stamp.id).desc())
-
-    rows = session.exec(q).all()
-
-    bom = "\ufeff"
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(["place_id", "place_name", "kind", "age_group", "count", "first_ts", "last_ts"])
-    for r in rows:
-        writer.writerow([
-            r.place_id,
-            r.place_name,
-            r.kind,
-            r.age_group,
-            r.count,
-            r.first_ts.isoformat() if r.first_ts else "",
-            r.last_ts.isoformat()  if r.last_ts else "",
-        ])
-
-    buf.seek(0)
-    text = bom + buf.getvalue()
-    headers = {
-        "Content-Disposition": 'attachment; filename="checkins_by_age.csv"'
-    }
-    return StreamingResponse(
-        iter([text]),
-        media_type="text/csv; charset=utf-8",
-        headers=headers,
+    stmt = summary_query(
+        parse_loose(date_from), parse_loose(date_to), kind,
+        by_age=True, age_group=age_group,
+    )
+    return csv_response(
+        "checkins_by_age.csv",
+        ["place_id", "place_name", "kind", "age_group", "count", "first_ts", "last_ts"],
+        iter_rows(stmt),
+        lambda r: [r.place_id, r.place_name, r.kind, r.age_group, r.count, iso(r.first_ts), iso(r.last_ts)],
     )
-
 
 
 # ====== 4) GeoJSON エクスポート ======
 @router.get("/export/checkins.geojson")
 def export_geojson(
-    session: Session = Depends(get_session),
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     kind: Optional[str] = None,
@@ -468,27 +425,101 @@ def export_geojson(
     dt_from = parse_iso(date_from, now - timedelta(days=90))
     dt_to   = parse_iso(date_to,   now)
 
-    q = select(Stamp).where(Stamp.checked_at >= dt_from, Stamp.checked_at < dt_to).order_by(Stamp.checked_at.desc()).limit(limit)
+    q = (
+        select(
+            Stamp.lat, Stamp.lon, Stamp.checked_at,
+            Place.place_id, Place.name.label("place_name"), Place.kind,
+        )
+        .join(Place, Place.id == Stamp.place_ref)
+        .where(Stamp.checked_at >= dt_from, Stamp.checked_at < dt_to)
+        .order_by(Stamp.checked_at.desc())
+        .limit(limit)
+    )
     if kind:
-        q = q.where(Stamp.kind == kind)
-    rows = session.exec(q).all()
+        q = q.where(Place.kind == kind)
 
-    feats = []
-    for st in rows:
-        if st.lat is None or st.lon is None: 
-            continue
-        feats.append({
+    def feature(st):
+        if st.lat is None or st.lon is None:
+            return None
+        return {
             "type": "Feature",
             "geometry": {"type": "Point", "coordinates": [float(st.lon), float(st.lat)]},
             "properties": {
                 "place_id": st.place_id, "place_name": st.place_name, "kind": st.kind,
                 "checked_at": st.checked_at.isoformat()+"Z"
             }
-        })
-    return {"type": "FeatureCollection", "features": feats}
+        }
+    return geojson_response(feature(st) for st in iter_rows(q))
+
+
+# ====== 4b) 列形式（Parquet / Arrow IPC）エクスポート ======
+# pandas / polars で型付きのまま読めるように。施設・種別・年代は辞書エンコード（category）
+CHECKIN_COLUMNS = [
+    ("checked_at", "timestamp"), ("local_date", "date"), ("local_hour", "int"),
+    ("place_id", "dict"), ("place_name", "dict"), ("kind", "dict"), ("age_group", "dict"),
+    ("lat", "float"), ("lon", "float"),
+]
+BY_AGE_COLUMNS = [
+    ("place_id", "dict"), ("place_name", "dict"), ("kind", "dict"), ("age_group", "dict"),
+    ("count", "int"), ("first_ts", "timestamp"), ("last_ts", "timestamp"),
+]
+
+
+@router.get("/export/checkins_by_age.{fmt}")
+def export_checkins_by_age_columnar(
+    fmt: str,
+    date_from: str | None = Query(None),
+    date_to:   str | None = Query(None),
+    kind:      str | None = Query(None),
+    age_group: str | None = Query(None),
+):
+    """年代別チェックイン集計を Parquet / Arrow で（条件は CSV 版と同じ）"""
+    if age_group and age_group not in {"child", "adult", "senior"}:
+        raise HTTPException(400, "invalid age_group (child/adult/senior)")
+
+    stmt = summary_query(
+        parse_loose(date_from), parse_loose(date_to), kind,
+        by_age=True, age_group=age_group,
+    )
+    return columnar_response(
+        fmt, "checkins_by_age", BY_AGE_COLUMNS, iter_rows(stmt),
+        lambda r: [r.place_id, r.place_name, r.kind, r.age_group, r.count, r.first_ts, r.last_ts],
+    )
+
+
+@router.get("/export/checkins.{fmt}")
+def export_checkins_columnar(
+    fmt: str,
+    date_from: str | None = Query(None),
+    date_to:   str | None = Query(None),
+    kind:      str | None = Query(None),
+    user = Depends(require_research_role),
+):
+    """
+    チェックイン 1 件 = 1 行の生データを Parquet / Arrow で（研究者向け）。
+    利用者を特定できる列（user_id）は出さない。行は DB から少しずつ流す。
+    """
+    dt_from, dt_to = parse_loose(date_from), parse_loose(date_to)
+    q = (
+        select(
+            Stamp.checked_at, Stamp.local_date, Stamp.local_hour,
+            Place.place_id, Place.name.label("place_name"), Place.kind,
+            func.coalesce(Stamp.age_group, "unknown").label("age_group"),
+            Stamp.lat, Stamp.lon,
+        )
+        .join(Place, Place.id == Stamp.place_ref)
+        .order_by(Stamp.checked_at)
+    )
+    if dt_from:
+        q = q.where(Stamp.checked_at >= dt_from)
+    if dt_to:
+        q = q.where(Stamp.checked_at <= dt_to)
+    if kind:
+        q = q.where(Stamp.place_ref.in_(place_refs_of_kind(kind)))
+    return columnar_response(fmt, "checkins", CHECKIN_COLUMNS, iter_rows(q), tuple)
 
 # 追加インポート
-from sqlalchemy import Integer, and_, or_
+from sqlalchemy import and_
 from sqlmodel import col
 
 # 共通: 時間帯パラメータ解釈
@@ -510,12 +541,46 @@ def resolve_hour_range(tod: Optional[str], hour_from: Optional[int], hour_to: Op
         return (hour_from, hour_to)
     return None  # フィルタなし
 
-def hour_extract_expr():
-    # SQLite と Postgres の両対応
-    if engine.url.get_backend_name() == "sqlite":
-        return func.cast(func.strftime("%H", Stamp.checked_at), Integer)  # 0..23
-    else:
-        return func.extract("hour", Stamp.checked_at)  # 0..23 (float扱いなのでCASTしてもOK)
+def facility_query(
+    dt_from: datetime,
+    dt_to: datetime,
+    place_id: Optional[str],
+    min_total: int,
+    limit: int,
+):
+    """施設ごとの (place_id, place_name, band_0_8, band_8_16, band_16_24, total)。total の多い順"""
+    refresh_rollups()
+    f = checkin_facts(dt_from, dt_to)
+    hcol = f.c.local_hour   # 現地時間の時
+
+    # 時間帯ごとの CASE 集計（ロールアップの行は 1 時間分なので件数 n ごと足す）
+    def band(a, b, name):
+        return func.sum(case((and_(hcol >= a, hcol < b), f.c.n), else_=0)).label(name)
+
+    total = func.sum(f.c.n).label("total")
+    agg = select(
+        f.c.place_ref,
+        band(0, 8, "band_0_8"),
+        band(8, 16, "band_8_16"),
+        band(16, 24, "band_16_24"),
+        total,
+    )
+    if place_id:
+        agg = agg.where(f.c.place_ref.in_(select(Place.id).where(Place.place_id == place_id)))
+
+    agg = agg.group_by(f.c.place_ref)
+    # total の多い順に上位施設から
+    agg = agg.having(total >= min_total).order_by(total.desc()).limit(limit).subquery("agg")
+    q = (
+        select(
+            Place.place_id, Place.name,
+            agg.c.band_0_8, agg.c.band_8_16, agg.c.band_16_24, agg.c.total,
+        )
+        .select_from(agg)
+        .join(Place, Place.id == agg.c.place_ref)
+        .order_by(agg.c.total.desc())
+    )
+    return q
 
 # ====== 5) 施設別チェックイン集計（時間帯ごと） ======
 @router.get("/stats/facility-checkins")
@@ -528,7 +593,7 @@ def stats_facility_checkins(
     limit: int = Query(5000, ge=1, le=50000),
 ):
     """
-    施設ごとのチェックイン数（期間内）を、時間帯別に集計して返す。
+    施設ごとのチェックイン数（期間内）を、時間帯別（日本時間）に集計して返す。
       - band_0_8   : 0〜8時
       - band_8_16  : 8〜16時
       - band_16_24 : 16〜24時
@@ -538,53 +603,7 @@ def stats_facility_checkins(
     dt_from = parse_iso(date_from, now - timedelta(days=30))
     dt_to   = parse_iso(date_to,   now)
 
-    ts_col = Stamp.checked_at
-    hcol = hour_extract_expr()
-
-    # 時間帯ごとの CASE 集計
-    band_0_8 = func.sum(
-        case(
-            (and_(hcol >= 0,  hcol < 8), 1),
-            else_=0,
-        )
-    ).label("band_0_8")
-
-    band_8_16 = func.sum(
-        case(
-            (and_(hcol >= 8,  hcol < 16), 1),
-            else_=0,
-        )
-    ).label("band_8_16")
-
-    band_16_24 = func.sum(
-        case(
-            (and_(hcol >= 16, hcol < 24), 1),
-            else_=0,
-        )
-    ).label("band_16_24")
-
-    total = func.count().label("total")
-
-    q = (
-        select(
-            Stamp.place_id,
-            Stamp.place_name,
-            band_0_8,
-            band_8_16,
-            band_16_24,
-            total,
-        )
-        .where(ts_col >= dt_from, ts_col < dt_to)
-    )
-
-    if place_id:
-        q = q.where(Stamp.place_id == place_id)
-
-    q = q.group_by(Stamp.place_id, Stamp.place_name)
-    # total の多い順に上位施設から
-    q = q.having(total >= min_total).order_by(total.desc()).limit(limit)
-
-    rows = session.exec(q).all()
+    rows = session.exec(facility_query(dt_from, dt_to, place_id, min_total, limit)).all()
 
     items = []
     for r in rows:
@@ -609,7 +628,6 @@ def stats_facility_checkins(
 # ====== 6) 施設別チェックイン集計 CSV エクスポート ======
 @router.get("/export/facility_checkins.csv")
 def export_facility_checkins_csv(
-    session: Session = Depends(get_session),
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     place_id: Optional[str] = None,
@@ -625,84 +643,10 @@ def export_facility_checkins_csv(
     dt_from = parse_iso(date_from, now - timedelta(days=30))
     dt_to   = parse_iso(date_to,   now)
 
-    ts_col = Stamp.checked_at
-    hcol = hour_extract_expr()
-
-    band_0_8 = func.sum(
-        case(
-            (and_(hcol >= 0,  hcol < 8), 1),
-            else_=0,
-        )
-    ).label("band_0_8")
-
-    band_8_16 = func.sum(
-        case(
-            (and_(hcol >= 8,  hcol < 16), 1),
-            else_=0,
-        )
-    ).label("band_8_16")
-
-    band_16_24 = func.sum(
-        case(
-            (and_(hcol >= 16, hcol < 24), 1),
-            else_=0,
-        )
-    ).label("band_16_24")
-
-    total = func.count().label("total")
-
-    q = (
-        select(
-            Stamp.place_id,
-            Stamp.place_name,
-            band_0_8,
-            band_8_16,
-            band_16_24,
-            total,
-        )
-        .where(ts_col >= dt_from, ts_col < dt_to)
+    stmt = facility_query(dt_from, dt_to, place_id, min_total, limit)
+    return csv_response(
+        f"facility_checkins_{dt_from.date()}_{dt_to.date()}.csv",
+        ["place_id", "place_name", "band_0_8", "band_8_16", "band_16_24", "total"],
+        iter_rows(stmt),
+        lambda r: [r[0], r[1], int(r[2] or 0), int(r[3] or 0), int(r[4] or 0), int(r[5] or 0)],
     )
-
-    if place_id:
-        q = q.where(Stamp.place_id == place_id)
-
-    q = q.group_by(Stamp.place_id, Stamp.place_name)
-    q = q.having(total >= min_total).order_by(total.desc()).limit(limit)
-
-    rows = list(session.exec(q).all())
-    bom = "\ufeff"
-    from io import StringIO
-    buf = StringIO()
-    
-    def generate():
-        import csv
-        from io import StringIO
-
-        header = ["place_id", "place_name", "band_0_8", "band_8_16", "band_16_24", "total"]
-        sio = StringIO()
-        writer = csv.writer(sio)
-        writer.writerow(header)
-        yield sio.getvalue()
-        sio.seek(0); sio.truncate(0)
-
-        for r in rows:
-            pid, name, c0_8, c8_16, c16_24, tot = r
-            writer.writerow([
-                pid,
-                name,
-                int(c0_8 or 0),
-                int(c8_16 or 0),
-                int(c16_24 or 0),
-                int(tot or 0),
-            ])
-            yield sio.getvalue()
-            sio.seek(0); sio.truncate(0)
-    text = bom + buf.getvalue()
-    filename = f"facility_checkins_{dt_from.date()}_{dt_to.date()}.csv"
-    return StreamingResponse(
-        iter([text]),
-        media_type="text/csv; charset=utf-8",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-    )
-
-
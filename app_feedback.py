@@ -7,13 +7,15 @@ from fastapi.responses import HTMLResponse
 from pydantic import BaseModel, Field
 from sqlmodel import Session, select
 from fastapi.templating import Jinja2Templates
+from assets import install_template_helpers
 
 from models import engine, AppFeedback, User
 from auth import get_current_user, login_required  # login_requiredはPOSTだけで使う
+from ratelimit import RateLimiter, enforce, client_ip
 
 router = APIRouter(tags=["app-feedback"])
 
-templates = Jinja2Templates(directory="templates")
+templates = install_template_helpers(Jinja2Templates(directory="templates"))
 
 
 def get_session():
@@ -21,6 +23,10 @@ def get_session():
         yield s
 
 
+# 連投防止: 3 件までは続けて送れて、以降は 1 分に 1 件
+FEEDBACK_LIMIT = RateLimiter("feedback", rate=1 / 60, burst=3)
+
+
 class AppFeedbackIn(BaseModel):
     rating: int = Field(..., ge=1, le=4)
     comment: str = Field(..., min_length=1, max_length=1000)
@@ -38,6 +44,8 @@ def create_app_feedback(
     ログイン必須（ゲストもOK）。user_id があれば保存。
     """
     user = login_required(user, allow_guest=True)
+    enforce(FEEDBACK_LIMIT, getattr(user, "id", None) or client_ip(request),
+            "フィードバックの送信が続いています。少し時間をおいてください")
 
     fb = AppFeedback(
         user_id=getattr(user, "id", None),
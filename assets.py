@@ -0,0 +1,97 @@
+# assets.py — build_assets.py が作るマニフェストを読んで配信用 URL を返す
+#
+# マニフェストが無い（ビルド前）・載っていない画像は元の URL をそのまま返すので、
+# ビルドしなくても今まで通り動く。
+import json
+import os
+from typing import Optional
+
+from config import BASE_DIR
+
+SPRITE_MANIFEST_PATH = BASE_DIR / "static" / "build" / "sprites.json"
+STAMP_ATLAS_PATH = BASE_DIR / "static" / "build" / "stamp_atlas.json"
+STATIC_MANIFEST_PATH = BASE_DIR / "static" / "build" / "static.json"
+DEFAULT_SPRITE_SIZE = 256
+DEFAULT_SPRITE_FMT = "webp"
+DEFAULT_ATLAS_SIZE = 128
+
+_json_cache: dict = {}   # path -> (mtime, data)
+
+
+def _load_json(path) -> dict:
+    """JSON を読む。ファイルが更新されていれば読み直し、無ければ {}"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        _json_cache.pop(path, None)
+        return {}
+    cached = _json_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print("[assets] manifest load error:", path, repr(e))
+        data = {}
+    _json_cache[path] = (mtime, data)
+    return data
+
+
+def load_sprite_manifest() -> dict:
+    return _load_json(SPRITE_MANIFEST_PATH)
+
+
+def static_url(path: str) -> str:
+    """
+    static/ からの相対パス（"app.js", "bgm/challenge.mp3" 等）→ 配信用 URL。
+    build_assets.py 済みならハッシュ付き URL（永久キャッシュ）、未ビルドなら /static/<path>。
+    """
+    path = path.lstrip("/").removeprefix("static/")
+    return _load_json(STATIC_MANIFEST_PATH).get(path) or f"/static/{path}"
+
+
+def install_template_helpers(templates):
+    """Jinja2Templates に {{ asset_url('app.js') }} を登録する"""
+    templates.env.globals["asset_url"] = static_url
+    return templates
+
+
+def stamp_atlas(keys, size: int = DEFAULT_ATLAS_SIZE) -> Optional[dict]:
+    """
+    スタンプピッカー用アトラスの情報を、keys（使えるスタンプ）のコマだけに絞って返す。
+    アトラス未ビルドなら None。
+    """
+    atlas = _load_json(STAMP_ATLAS_PATH).get(str(size))
+    if not atlas:
+        return None
+    cells = atlas.get("cells", {})
+    return {
+        **{k: v for k, v in atlas.items() if k != "cells"},
+        "cells": {k: cells[k] for k in keys if k in cells},
+    }
+
+
+def _sprite_key(url: str) -> str:
+    # "/static/stamp/2.png" → "stamp/2.png"
+    return url.split("?", 1)[0].lstrip("/").removeprefix("static/")
+
+
+def sprite_variants(url: Optional[str]) -> list:
+    if not url:
+        return []
+    entry = load_sprite_manifest().get(_sprite_key(url))
+    return entry["variants"] if entry else []
+
+
+def sprite_url(url: Optional[str], size: int = DEFAULT_SPRITE_SIZE, fmt: str = DEFAULT_SPRITE_FMT) -> Optional[str]:
+    """元画像 URL（/static/stamp/2.png 等）→ 縮小版の URL。無ければ元の URL"""
+    for v in sprite_variants(url):
+        if v["size"] == size and v["fmt"] == fmt:
+            return v["url"]
+    return url
+
+
+def stamp_key_url(key: str, size: int = DEFAULT_SPRITE_SIZE) -> str:
+    """クイズのスタンプキー（"2.png" 等のファイル名）→ 配信用 URL"""
+    return sprite_url(f"/static/stamp/{key}", size=size)
@@ -11,6 +11,7 @@ from sqlmodel import Session, select
 from authlib.integrations.starlette_client import OAuth
 import secrets
 from fastapi.templating import Jinja2Templates
+from assets import install_template_helpers
 
 from config import (
     JWT_SECRET, JWT_ALG, JWT_EXPIRE_MIN, AUTH_COOKIE, MIN_PW, MAX_PW,
@@ -20,7 +21,7 @@ from models import User, OAuthAccount, engine, Character, UserCharacter
 
 router = APIRouter()
 
-templates = Jinja2Templates(directory="templates")
+templates = install_template_helpers(Jinja2Templates(directory="templates"))
 
 pwd_ctx = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
@@ -141,6 +142,11 @@ def login_page(request: Request):
 
 from fastapi import Body, Form, Request
 from urllib.parse import parse_qs
+from ratelimit import RateLimiter, enforce, client_ip
+
+LOGIN_IP_LIMIT = RateLimiter("login_ip", rate=1 / 6, burst=20)        # 1 IP: 20 回まで、以降 6 秒に 1 回
+LOGIN_EMAIL_LIMIT = RateLimiter("login_email", rate=1 / 30, burst=5)  # 1 アカウント × 1 IP: 5 回まで、以降 30 秒に 1 回
+
 @router.post("/auth/login")
 async def login(
     request: Request,
@@ -165,10 +171,20 @@ async def login(
     if not email or not password:
         raise HTTPException(422, "email/password を指定してください")
 
+    # 総当たり対策（IP ごと・メールアドレス × IP ごと）。DB とパスワード照合の前に弾く。
+    # 先にトークンを取り、ログインできたら返す（失敗した試行だけが数えられる）。
+    # メールアドレスだけをキーにすると、他人が失敗を重ねて本人を締め出せるので IP と組にする。
+    ip = client_ip(request)
+    attempt_key = f"{email.strip().lower()}|{ip}"
+    enforce(LOGIN_IP_LIMIT, ip, "ログインの試行が多すぎます。しばらく待ってから試してください")
+    enforce(LOGIN_EMAIL_LIMIT, attempt_key, "ログインの試行が多すぎます。しばらく待ってから試してください")
+
     with Session(engine) as s:
         u = s.exec(select(User).where(User.email == email)).first()
         if not u or not verify_pw(password, u.password_hash):
             raise HTTPException(401, "メールまたはパスワードが違います")
+        LOGIN_IP_LIMIT.refund(ip)
+        LOGIN_EMAIL_LIMIT.refund(attempt_key)
 
         # ★ ここでリダイレクト先を決める
         target = "/home"
@@ -267,6 +283,9 @@ def name_update(
         s.add(dbu)
         s.commit()
 
+    from comments import invalidate_user_profile
+    invalidate_user_profile(u.id)  # コメントの表示名キャッシュを更新
+
     # 変更後、/home に戻る
     return RedirectResponse(url="/home", status_code=303)
 
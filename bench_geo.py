@@ -0,0 +1,55 @@
+# bench_geo.py — geo.py の距離計算マイクロベンチマーク
+#   python bench_geo.py [N]
+# スカラー版（Python ループ）とベクトル版の throughput と、正距円筒近似の誤差を表示する。
+import sys
+import time
+
+import numpy as np
+
+from geo import haversine_m, haversine_many, haversine_matrix, equirect_many
+
+
+def _bench(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(n: int = 100_000):
+    rng = np.random.default_rng(0)
+    # 石川県あたりの範囲にランダムな点をばらまく
+    lats = rng.uniform(36.0, 37.6, n)
+    lons = rng.uniform(136.2, 137.4, n)
+    lat0, lon0 = 36.56, 136.65  # 金沢駅付近
+    lat_list, lon_list = lats.tolist(), lons.tolist()
+
+    t_scalar = _bench(lambda: [haversine_m(lat0, lon0, a, b) for a, b in zip(lat_list, lon_list)], repeat=3)
+    t_vec = _bench(lambda: haversine_many(lat0, lon0, lats, lons))
+    t_eq = _bench(lambda: equirect_many(lat0, lon0, lats, lons))
+
+    print(f"1 vs N (N={n:,})")
+    print(f"  scalar haversine : {t_scalar * 1e3:8.2f} ms  {n / t_scalar / 1e6:8.2f} M pts/s")
+    print(f"  numpy haversine  : {t_vec * 1e3:8.2f} ms  {n / t_vec / 1e6:8.2f} M pts/s  (x{t_scalar / t_vec:.0f})")
+    print(f"  numpy equirect   : {t_eq * 1e3:8.2f} ms  {n / t_eq / 1e6:8.2f} M pts/s  (x{t_scalar / t_eq:.0f})")
+
+    m = 1000
+    k = min(n, 1000)
+    t_mat = _bench(lambda: haversine_matrix(lats[:k], lons[:k], lats[:m], lons[:m]))
+    print(f"N x M ({k} x {m})")
+    print(f"  numpy matrix     : {t_mat * 1e3:8.2f} ms  {k * m / t_mat / 1e6:8.2f} M pairs/s")
+
+    # 正距円筒近似の誤差
+    exact = haversine_many(lat0, lon0, lats, lons)
+    approx = equirect_many(lat0, lon0, lats, lons)
+    rel = np.abs(approx - exact) / np.maximum(exact, 1.0)
+    print("equirect error vs haversine")
+    print(f"  max distance     : {exact.max() / 1000:8.1f} km")
+    print(f"  max rel. error   : {rel.max() * 100:8.4f} %")
+    print(f"  max abs. error   : {np.abs(approx - exact).max():8.1f} m")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,94 @@
+# bench_templates.py — 主要ページの TemplateResponse 描画ベンチマーク
+#   python bench_templates.py [N] [git-ref]
+# home / map / quiz / 集計ページを N 回ずつ描画し、1 回あたりの時間と HTML の大きさ（生 / gzip）を表示する。
+# git-ref（例: インライン CSS/JS を static/pages/ に出す前のコミット）を渡すと、
+# その時点の templates/ も同じ条件で描画して並べる。
+import gzip
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemLoader, FunctionLoader
+from starlette.requests import Request
+
+from assets import install_template_helpers
+
+USER = SimpleNamespace(
+    id=1, email="bench@example.com", display_name="ベンチ", role="admin", is_guest=False, age_group="adult",
+)
+
+# (ラベル, テンプレート, コンテキスト)
+PAGES = [
+    ("home", "home.html", {"user": USER}),
+    ("map", "index.html", {"user": USER}),
+    ("quiz (challenge-select)", "quiz.html", {"mode": "challenge-select", "code": "", "user": USER, "is_random": False}),
+    ("quiz (play)", "quiz.html", {"mode": "play", "code": "ABCD", "user": USER, "is_random": False, "challenge_level": "king"}),
+    ("checkins summary", "checkins_summary.html", {}),
+]
+
+
+def _request() -> Request:
+    return Request({
+        "type": "http", "method": "GET", "path": "/", "root_path": "", "scheme": "https",
+        "server": ("bench", 443), "headers": [], "query_string": b"",
+    })
+
+
+def _templates(ref: str = None) -> Jinja2Templates:
+    if ref is None:
+        loader = FileSystemLoader("templates")
+    else:
+        def load(name):
+            out = subprocess.run(["git", "show", f"{ref}:templates/{name}"], capture_output=True)
+            return out.stdout.decode("utf-8") if out.returncode == 0 else None
+        loader = FunctionLoader(load)
+    return install_template_helpers(Jinja2Templates(env=Environment(loader=loader, autoescape=True)))
+
+
+def _bench(fn, n: int) -> float:
+    fn()  # テンプレートのコンパイルは 1 回目だけなので外す
+    best = float("inf")
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / n)
+    return best
+
+
+def run(templates: Jinja2Templates, n: int) -> dict:
+    out = {}
+    for label, name, ctx in PAGES:
+        render = lambda: templates.TemplateResponse(name, {"request": _request(), **ctx})
+        t = _bench(render, n)
+        body = render().body
+        out[label] = (t, len(body), len(gzip.compress(body, 6)))
+    return out
+
+
+def main(n: int = 200, ref: str = None):
+    results = [("current", run(_templates(), n))]
+    if ref:
+        results.insert(0, (ref, run(_templates(ref), n)))
+
+    print(f"TemplateResponse render (N={n}, best of 5)")
+    for tag, res in results:
+        print(f"[{tag}]")
+        for label, (t, size, gz) in res.items():
+            print(f"  {label:24s}: {t * 1e3:7.3f} ms  {size / 1024:7.1f} KB  gzip {gz / 1024:6.1f} KB")
+    if ref:
+        (_, before), (_, after) = results
+        print("current vs", ref)
+        for label in after:
+            tb, sb, _ = before[label]
+            ta, sa, _ = after[label]
+            print(f"  {label:24s}: time x{tb / ta:5.2f}  size {sa / sb * 100:5.1f} %")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        sys.argv[2] if len(sys.argv) > 2 else None,
+    )
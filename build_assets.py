@@ -0,0 +1,254 @@
+# build_assets.py — スタンプ/キャラ画像の軽量版を作るビルドスクリプト
+#   python build_assets.py
+#
+# static/stamp/*.png と static/characters/*.png（元は 1024〜2048px, 数 MB）を
+# 表示サイズ（256px など）の WebP / AVIF に縮小して static/build/sprites/ に書き出し、
+# static/build/sprites.json（マニフェスト）を作る。ファイル名には内容ハッシュを入れる。
+# さらにクイズのスタンプピッカー用に、static/stamp を 1 枚にまとめたアトラス画像
+# （static/build/atlas/）とフレーム表 static/build/stamp_atlas.json も作る。
+# static/ 以下の全ファイル（JS/CSS/BGM/画像）は内容ハッシュ入りの名前で static/build/static/ に
+# コピーし（JS/CSS は gzip / brotli の圧縮済みファイルも作る）、static/build/static.json に対応表を書く。
+# 実行時は assets.py がマニフェストを読み、無ければ元画像の URL をそのまま使う。
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+from pathlib import Path
+
+from PIL import Image, features
+
+try:
+    import brotli
+except ImportError:  # brotli 無しなら .br は作らない
+    brotli = None
+
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static"
+SPRITE_SRC_DIRS = ("stamp", "characters")
+SPRITE_SIZES = (128, 256)
+OUT_DIR = STATIC_DIR / "build" / "sprites"
+MANIFEST_PATH = STATIC_DIR / "build" / "sprites.json"
+
+STATIC_OUT_DIR = STATIC_DIR / "build" / "static"
+STATIC_MANIFEST_PATH = STATIC_DIR / "build" / "static.json"
+STATIC_SKIP_DIRS = ("build",)
+# 中の "/static/..." 参照をハッシュ付き URL に書き換えるファイル
+STATIC_REWRITE_EXTS = {".js", ".css"}
+# 圧縮済みファイルを用意する拡張子（mp3/png 等は圧縮しても縮まないので対象外）
+STATIC_COMPRESS_EXTS = {".js", ".css", ".svg", ".json", ".html", ".txt"}
+
+ATLAS_SRC_DIR = STATIC_DIR / "stamp"
+ATLAS_SIZES = (64, 128)        # 1コマの辺（px）
+ATLAS_OUT_DIR = STATIC_DIR / "build" / "atlas"
+ATLAS_INDEX_PATH = STATIC_DIR / "build" / "stamp_atlas.json"
+
+FORMATS = {"webp": {"quality": 82, "method": 6}}
+if features.check("avif"):
+    FORMATS["avif"] = {"quality": 60}
+
+
+def _encode(im: Image.Image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    im.save(buf, format=fmt.upper(), **FORMATS[fmt])
+    return buf.getvalue()
+
+
+def build_sprite(src: Path) -> tuple[str, dict]:
+    """1枚分の variants を書き出して (マニフェストのキー, エントリ) を返す"""
+    key = src.relative_to(STATIC_DIR).as_posix()          # 例: "stamp/2.png"
+    entry = {
+        "src": f"/static/{key}",
+        "bytes": src.stat().st_size,
+        "variants": [],
+    }
+    with Image.open(src) as im:
+        im = im.convert("RGBA")
+        for size in SPRITE_SIZES:
+            frame = im.copy()
+            frame.thumbnail((size, size), Image.LANCZOS)
+            for fmt in FORMATS:
+                data = _encode(frame, fmt)
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                name = f"{src.parent.name}-{src.stem}.{size}.{digest}.{fmt}"
+                out = OUT_DIR / name
+                if not out.exists():
+                    out.write_bytes(data)
+                entry["variants"].append({
+                    "fmt": fmt,
+                    "size": size,
+                    "width": frame.width,
+                    "height": frame.height,
+                    "bytes": len(data),
+                    "hash": digest,
+                    "url": f"/static/build/sprites/{name}",
+                })
+    return key, entry
+
+
+def build_stamp_atlas(size: int) -> dict:
+    """
+    static/stamp/*.png を size×size のコマに縮小して 1 枚の WebP に並べる。
+    フレーム表のキー名は Character と同じ（frames = コマ数, frame_w/frame_h = 1コマの大きさ）。
+    cells は スタンプキー（ファイル名）→ コマ位置。
+    """
+    srcs = sorted(ATLAS_SRC_DIR.glob("*.png"))
+    cols = max(1, math.ceil(math.sqrt(len(srcs))))
+    rows = max(1, math.ceil(len(srcs) / cols))
+    atlas = Image.new("RGBA", (cols * size, rows * size), (0, 0, 0, 0))
+    cells = {}
+    for i, src in enumerate(srcs):
+        col, row = i % cols, i // cols
+        with Image.open(src) as im:
+            frame = im.convert("RGBA")
+            frame.thumbnail((size, size), Image.LANCZOS)
+        # 正方形でない画像はコマの中央に置く
+        x = col * size + (size - frame.width) // 2
+        y = row * size + (size - frame.height) // 2
+        atlas.paste(frame, (x, y))
+        cells[src.name] = {"col": col, "row": row, "x": col * size, "y": row * size}
+
+    data = _encode(atlas, "webp")
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    name = f"stamps.{size}.{digest}.webp"
+    out = ATLAS_OUT_DIR / name
+    if not out.exists():
+        out.write_bytes(data)
+    return {
+        "url": f"/static/build/atlas/{name}",
+        "hash": digest,
+        "bytes": len(data),
+        "width": atlas.width,
+        "height": atlas.height,
+        "cols": cols,
+        "rows": rows,
+        "frames": len(cells),
+        "frame_w": size,
+        "frame_h": size,
+        "cells": cells,
+    }
+
+
+def build_stamp_atlases() -> dict:
+    ATLAS_OUT_DIR.mkdir(parents=True, exist_ok=True)
+    index = {str(size): build_stamp_atlas(size) for size in ATLAS_SIZES}
+
+    used = {Path(a["url"]).name for a in index.values()}
+    for f in ATLAS_OUT_DIR.iterdir():
+        if f.name not in used:
+            f.unlink()
+
+    tmp = ATLAS_INDEX_PATH.with_suffix(".json.part")
+    tmp.write_text(json.dumps(index, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, ATLAS_INDEX_PATH)
+    return index
+
+
+def _hashed_name(rel: str, data: bytes) -> str:
+    # "bgm/challenge.mp3" → "bgm/challenge.<hash>.mp3"
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _write_if_missing(path: Path, data: bytes):
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _precompress(path: Path, data: bytes):
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        _write_if_missing(path.with_name(path.name + ".gz"), gz)
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            _write_if_missing(path.with_name(path.name + ".br"), br)
+
+
+def build_static() -> dict:
+    """
+    static/ 以下（build/ を除く）を内容ハッシュ付きの名前でコピーし、
+    {"app.js": "/static/build/static/app.<hash>.js", ...} を返す。
+    JS/CSS は先に他のファイルを処理してから、中の "/static/<path>" を書き換えてハッシュする。
+    """
+    files = []
+    for root, dirs, names in os.walk(STATIC_DIR):
+        rel_root = Path(root).relative_to(STATIC_DIR)
+        if rel_root.parts and rel_root.parts[0] in STATIC_SKIP_DIRS:
+            dirs[:] = []
+            continue
+        for n in names:
+            files.append((rel_root / n).as_posix())
+    files.sort(key=lambda r: (os.path.splitext(r)[1].lower() in STATIC_REWRITE_EXTS, r))
+
+    manifest = {}
+    for rel in files:
+        data = (STATIC_DIR / rel).read_bytes()
+        ext = os.path.splitext(rel)[1].lower()
+        if ext in STATIC_REWRITE_EXTS:
+            text = data.decode("utf-8")
+            # 長いパスから置換（"/static/a.png" が "/static/a.png.map" を壊さないように）
+            for src in sorted(manifest, key=len, reverse=True):
+                text = text.replace(f'"/static/{src}"', f'"{manifest[src]}"')
+                text = text.replace(f"'/static/{src}'", f"'{manifest[src]}'")
+            data = text.encode("utf-8")
+        hashed = _hashed_name(rel, data)
+        out = STATIC_OUT_DIR / hashed
+        _write_if_missing(out, data)
+        if ext in STATIC_COMPRESS_EXTS:
+            _precompress(out, data)
+        manifest[rel] = f"/static/build/static/{hashed}"
+
+    used = {m.removeprefix("/static/build/static/") for m in manifest.values()}
+    for root, _, names in os.walk(STATIC_OUT_DIR):
+        for n in names:
+            p = Path(root) / n
+            rel = p.relative_to(STATIC_OUT_DIR).as_posix()
+            base = rel.removesuffix(".gz").removesuffix(".br")
+            if base not in used:
+                p.unlink()
+
+    tmp = STATIC_MANIFEST_PATH.with_suffix(".json.part")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, STATIC_MANIFEST_PATH)
+    return manifest
+
+
+def main():
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = {}
+    for d in SPRITE_SRC_DIRS:
+        for src in sorted((STATIC_DIR / d).glob("*.png")):
+            key, entry = build_sprite(src)
+            manifest[key] = entry
+
+    # マニフェストから参照されなくなった古いファイルを掃除
+    used = {Path(v["url"]).name for e in manifest.values() for v in e["variants"]}
+    for f in OUT_DIR.iterdir():
+        if f.name not in used:
+            f.unlink()
+
+    tmp = MANIFEST_PATH.with_suffix(".json.part")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, MANIFEST_PATH)
+
+    src_total = sum(e["bytes"] for e in manifest.values())
+    out_total = sum(v["bytes"] for e in manifest.values() for v in e["variants"] if v["fmt"] == "webp" and v["size"] == 256)
+    print(f"[build_assets] {len(manifest)} sprites, formats={list(FORMATS)}")
+    print(f"[build_assets] original {src_total / 1e6:.1f} MB -> webp@256 {out_total / 1e6:.2f} MB")
+
+    atlases = build_stamp_atlases()
+    for size, a in atlases.items():
+        print(f"[build_assets] stamp atlas {size}px: {a['frames']} frames, {a['width']}x{a['height']}, {a['bytes'] / 1e3:.0f} KB")
+
+    static_manifest = build_static()
+    print(f"[build_assets] {len(static_manifest)} static files fingerprinted (brotli={'yes' if brotli else 'no'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
 # comments.py
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, Path
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import datetime, timedelta
+import asyncio
+import threading
+from datetime import datetime
 from sqlmodel import Session, select
+from sqlalchemy import and_, or_, func
 
 from models import engine, Comment, User
-from auth import get_current_user, login_required
+from auth import get_current_user, login_required, require_research_role
+from cache import LRUCache
+from ratelimit import RateLimiter, enforce
+from pubsub import Hub
+from moderation import CONTENT_FILTER
 
 
 router = APIRouter(prefix="/api/comments", tags=["comments"])
@@ -20,54 +28,315 @@ class CommentIn(BaseModel):
     content: str = Field(..., min_length=1, max_length=500)
     parent_id: Optional[int] = None
 
+THREADS_PAGE_DEFAULT = 20
+THREADS_PAGE_MAX = 100
+
+# ===== キャッシュ =====
+# コメント一覧は「地点を開くたびに同じ結果」なことが多いので、ページ単位でメモリに持つ。
+#   - キーは (place_id, ページの種類, ...)。投稿・削除でその地点の分をまとめて捨てる
+#   - ページには user_id だけ入れておき、表示名は応答時にユーザープロフィールキャッシュから付ける
+#     （User との JOIN が要らず、名前変更も invalidate_user_profile だけで反映される）
+COMMENT_CACHE_PAGES = 2048
+PROFILE_CACHE_USERS = 5000
+
+_page_cache = LRUCache("comment_pages", COMMENT_CACHE_PAGES)
+_profile_cache = LRUCache("user_profiles", PROFILE_CACHE_USERS)
+# 書き込みのたびに増やす世代番号。読み込み中に書き込みがあったページはキャッシュしない
+_place_gen: dict = {}
+_gen_lock = threading.Lock()
+
+def invalidate_place_comments(place_id: str):
+    with _gen_lock:
+        _place_gen[place_id] = _place_gen.get(place_id, 0) + 1
+        _page_cache.pop_matching(lambda k: k[0] == place_id)
+
+def invalidate_user_profile(user_id: int):
+    """表示名などを変えたときに呼ぶ（auth.name_update）"""
+    _profile_cache.pop(user_id)
+
+def _cached_page(key: tuple, build):
+    page = _page_cache.get(key)
+    if page is not None:
+        return page
+    gen = _place_gen.get(key[0], 0)
+    page = build()
+    with _gen_lock:
+        if _place_gen.get(key[0], 0) == gen:
+            _page_cache.set(key, page)
+    return page
+
+def _profiles(session: Session, user_ids) -> dict:
+    """{user_id: {"id", "email", "display_name"}}。キャッシュに無い分だけ 1 回の IN クエリで読む"""
+    out = {}
+    missing = []
+    for uid in set(user_ids):
+        prof = _profile_cache.get(uid)
+        if prof is None:
+            missing.append(uid)
+        else:
+            out[uid] = prof
+    if missing:
+        rows = session.exec(
+            select(User.id, User.email, User.display_name).where(User.id.in_(missing))
+        ).all()
+        for uid, email, display_name in rows:
+            prof = {"id": uid, "email": email, "display_name": display_name}
+            _profile_cache.set(uid, prof)
+            out[uid] = prof
+    return out
+
+def _comment_row(c: Comment) -> dict:
+    # キャッシュに入れる形（表示名は入れない）
+    return {
+        "id": c.id,
+        "place_id": c.place_id,
+        "parent_id": c.parent_id,
+        "content": c.content,
+        "created_at": c.created_at.isoformat() + "Z",
+        "user_id": c.user_id,
+    }
+
+def _collect_user_ids(rows: list, out: set) -> set:
+    for r in rows:
+        out.add(r["user_id"])
+        _collect_user_ids(r.get("replies", ()), out)
+    return out
+
+def _with_user(row: dict, profiles: dict) -> dict:
+    # キャッシュの dict は書き換えずに、表示用の dict を新しく作る
+    it = {k: v for k, v in row.items() if k not in ("user_id", "replies")}
+    u = profiles.get(row["user_id"]) or {"id": row["user_id"], "email": None, "display_name": None}
+    # ★ 表示に使う名前をここで決める
+    display = u["display_name"] or (u["email"].split("@")[0] if u["email"] else "匿名ユーザー")
+    it["user"] = dict(u)
+    it["user_name"] = display  # ★ 表示用
+    if "replies" in row:
+        it["replies"] = [_with_user(r, profiles) for r in row["replies"]]
+    return it
+
+def _render_items(session: Session, rows: list) -> list:
+    profiles = _profiles(session, _collect_user_ids(rows, set()))
+    return [_with_user(r, profiles) for r in rows]
+
 @router.get("")
 def list_comments(
     place_id: str = Query(..., min_length=1, max_length=128),
     session: Session = Depends(get_session)
 ):
-    rows = session.exec(
-        select(Comment, User)
-        .where(Comment.place_id == place_id)
-        .join(User, User.id == Comment.user_id)
-        .order_by(Comment.created_at.desc())
+    rows = _cached_page(
+        (place_id, "flat"),
+        lambda: [
+            _comment_row(c) for c in session.exec(
+                select(Comment)
+                .where(Comment.place_id == place_id)
+                .order_by(Comment.created_at.desc())
+            ).all()
+        ],
+    )
+    items = _render_items(session, rows)
+    return {"ok": True, "count": len(items), "items": items}
+
+
+def _comment_cursor(c: Comment) -> str:
+    return f"{c.created_at.isoformat()}_{c.id}"
+
+def _parse_comment_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        ts, cid = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(ts), int(cid)
+    except ValueError:
+        raise HTTPException(400, "cursor が不正です")
+
+def _load_replies(session: Session, root_ids: List[int]) -> list:
+    """
+    root_ids 以下の返信を（孫以降も含めて）再帰 CTE 1 回で取る。
+    戻り値は Comment の古い順リスト。
+    """
+    tree = (
+        select(Comment.id)
+        .where(Comment.parent_id.in_(root_ids))
+        .cte("reply_tree", recursive=True)
+    )
+    tree = tree.union_all(select(Comment.id).where(Comment.parent_id == tree.c.id))
+    return session.exec(
+        select(Comment)
+        .where(Comment.id.in_(select(tree.c.id)))
+        .order_by(Comment.created_at, Comment.id)
     ).all()
 
+def _build_thread_page(session: Session, place_id: str, limit: int, cursor: Optional[str]) -> dict:
+    stmt = select(Comment).where(Comment.place_id == place_id, Comment.parent_id == None)  # noqa: E711
+    if cursor:
+        c_at, c_id = _parse_comment_cursor(cursor)
+        stmt = stmt.where(or_(Comment.created_at < c_at, and_(Comment.created_at == c_at, Comment.id < c_id)))
+    roots = session.exec(
+        stmt.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(limit + 1)
+    ).all()
+    has_more = len(roots) > limit
+    roots = roots[:limit]
+
     items = []
-    for c, u in rows:
-        # ★ 表示に使う名前をここで決める
-        display = u.display_name or (u.email.split("@")[0] if u.email else "匿名ユーザー")
+    by_id = {}
+    for c in roots:
+        it = {**_comment_row(c), "replies": []}
+        by_id[c.id] = it
+        items.append(it)
+    if by_id:
+        # 親は必ず子より先に作られるので、古い順に並べれば親→子の順でつなげられる
+        for c in _load_replies(session, list(by_id)):
+            parent = by_id.get(c.parent_id)
+            if parent is None:
+                continue
+            it = {**_comment_row(c), "replies": []}
+            by_id[c.id] = it
+            parent["replies"].append(it)
 
-        items.append({
-            "id": c.id,
-            "place_id": c.place_id,
-            "content": c.content,
-            "created_at": c.created_at.isoformat() + "Z",
-            "user": {
-                "id": u.id,
-                "email": u.email,
-                "display_name": u.display_name,
-            },
-            "user_name": display,  # ★ 表示用
-        })
+    total = session.exec(select(func.count(Comment.id)).where(Comment.place_id == place_id)).one()
+    return {
+        "total": total,
+        "has_more": has_more,
+        "next_cursor": _comment_cursor(roots[-1]) if has_more else None,
+        "items": items,
+    }
 
-    return {"ok": True, "count": len(items), "items": items}
+@router.get("/threads")
+def list_comment_threads(
+    place_id: str = Query(..., min_length=1, max_length=128),
+    limit: int = Query(THREADS_PAGE_DEFAULT, ge=1, le=THREADS_PAGE_MAX),
+    cursor: Optional[str] = Query(None, description="前回レスポンスの next_cursor。これより古いスレッドを返す"),
+    session: Session = Depends(get_session)
+):
+    """
+    トップレベルのコメントを新しい順に limit 件ずつ、返信ツリー（replies, 古い順）付きで返す。
+    クエリは「トップレベル 1 回 + 返信ツリー 1 回 + 総数 1 回」で、スレッド数に比例して増えない。
+    """
+    page = _cached_page(
+        (place_id, "threads", cursor, limit),
+        lambda: _build_thread_page(session, place_id, limit, cursor),
+    )
+    items = _render_items(session, page["items"])
+    return {
+        "ok": True,
+        "count": len(items),
+        "total": page["total"],
+        "has_more": page["has_more"],
+        "next_cursor": page["next_cursor"],
+        "items": items,
+    }
+
+COUNTS_GET_MAX = 500        # GET ?place_ids=a,b,c の上限（URL 長の都合）
+COUNTS_POST_MAX = 5000      # POST 本文の上限（マップ全体のマーカー分）
+COUNTS_SQL_CHUNK = 900      # 1クエリの IN に入れる数（古い SQLite の変数上限 999 未満）
+
+class CommentCountsIn(BaseModel):
+    place_ids: List[str] = Field(..., max_length=COUNTS_POST_MAX)
+
+def _comment_counts(session: Session, place_ids: List[str]) -> dict:
+    """
+    {place_id: {"count": 件数（返信も含む）, "latest_at": 最新コメント時刻 or None}}。
+    (place_id, ...) のインデックスを使う GROUP BY 1 回（IN が長いときだけ分割）で数える。
+    """
+    ids = list(dict.fromkeys(p for p in place_ids if p))
+    out = {pid: {"count": 0, "latest_at": None} for pid in ids}
+    for i in range(0, len(ids), COUNTS_SQL_CHUNK):
+        rows = session.exec(
+            select(Comment.place_id, func.count(Comment.id), func.max(Comment.created_at))
+            .where(Comment.place_id.in_(ids[i:i + COUNTS_SQL_CHUNK]))
+            .group_by(Comment.place_id)
+        ).all()
+        for pid, n, latest in rows:
+            out[pid] = {"count": n, "latest_at": latest.isoformat() + "Z" if latest else None}
+    return out
+
+@router.get("/counts")
+def comment_counts(
+    place_ids: str = Query(..., min_length=1, description="カンマ区切りの place_id"),
+    session: Session = Depends(get_session)
+):
+    ids = [x.strip() for x in place_ids.split(",") if x.strip()]
+    if len(ids) > COUNTS_GET_MAX:
+        raise HTTPException(400, f"place_ids は {COUNTS_GET_MAX} 件までです（多いときは POST を使ってください）")
+    return {"ok": True, "counts": _comment_counts(session, ids)}
 
+@router.post("/counts")
+def comment_counts_post(payload: CommentCountsIn, session: Session = Depends(get_session)):
+    """マップのマーカー全部など、URL に載らない長さの place_id 一覧用"""
+    return {"ok": True, "counts": _comment_counts(session, payload.place_ids)}
+
+@router.get("/cache_stats")
+def comment_cache_stats(user = Depends(require_research_role)):
+    """コメントページ／ユーザープロフィールキャッシュのヒット・ミス数、ライブ配信の購読状況、NG ワード照合の統計"""
+    return {
+        "ok": True,
+        "caches": [_page_cache.stats(), _profile_cache.stats()],
+        "stream": COMMENT_HUB.stats(),
+        "moderation": CONTENT_FILTER.stats(),
+    }
+
+
+COMMENT_PLACE_LIMIT = RateLimiter("comment_place", rate=1 / 10, burst=1)   # 同じ地点へは 10 秒に 1 回
+COMMENT_USER_LIMIT = RateLimiter("comment_user", rate=1 / 6, burst=10)     # 全体で 10 連投まで、以降 6 秒に 1 回
+
+# ===== ライブ配信（SSE） =====
+# GET /api/comments/stream?place_id=... を EventSource で開いておくと、
+#   event: comment → 新しいコメント（/threads の 1 件と同じ形。replies は無し）
+#   event: delete  → {"id": 削除されたコメント ID}
+# が届く。: ping はプロキシに切られないための空行。
+COMMENT_HUB = Hub("comments")
+STREAM_PING_SEC = 25
+
+@router.get("/stream")
+async def stream_comments(
+    request: Request,
+    place_id: str = Query(..., min_length=1, max_length=128),
+):
+    async def events():
+        try:
+            async with COMMENT_HUB.subscribe(place_id) as q:
+                yield b"retry: 5000\n\n"
+                while True:
+                    try:
+                        frame = await asyncio.wait_for(q.get(), timeout=STREAM_PING_SEC)
+                    except asyncio.TimeoutError:
+                        if await request.is_disconnected():
+                            return
+                        frame = b": ping\n\n"
+                    if frame is None:  # 受信が遅すぎて切られた
+                        return
+                    yield frame
+        except OverflowError:
+            yield b"retry: 30000\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.post("")
 def create_comment(payload: CommentIn, request: Request, session: Session = Depends(get_session)):
     user = get_current_user(request)
     login_required(user)
 
-    # 簡易レート制限（同ユーザーが同じ場所に連投 10 秒は不可）
-    ten_sec_ago = datetime.utcnow() - timedelta(seconds=10)
-    recent = session.exec(
-        select(Comment).where(Comment.user_id == user.id, Comment.place_id == payload.place_id, Comment.created_at >= ten_sec_ago)
-    ).first()
-    if recent:
-        raise HTTPException(429, "連続投稿は少し時間をおいてください（10秒）")
+    # NG ワードを含むコメントは保存しない（表示されっぱなしになるので伏せ字ではなく拒否）
+    if CONTENT_FILTER.contains(payload.content):
+        raise HTTPException(400, "不適切な表現が含まれています。内容を見直してください")
+
+    if payload.parent_id is not None:
+        parent = session.get(Comment, payload.parent_id)
+        if not parent or parent.place_id != payload.place_id:
+            raise HTTPException(400, "返信先のコメントが見つかりません")
+
+    # レート制限（同ユーザーが同じ場所に連投 10 秒は不可 + 地点をまたいだ連投の上限）。
+    # 弾かれた投稿（NG ワード・返信先なし）は数えないよう、保存する直前に取る
+    enforce(COMMENT_PLACE_LIMIT, (user.id, payload.place_id), "連続投稿は少し時間をおいてください（10秒）")
+    enforce(COMMENT_USER_LIMIT, user.id, "短時間に投稿しすぎです。少し時間をおいてください")
 
     c = Comment(user_id=user.id, place_id=payload.place_id, content=payload.content.strip(), parent_id=payload.parent_id)
     session.add(c); session.commit(); session.refresh(c)
+    invalidate_place_comments(c.place_id)
+    # 地点を開いている人へライブ配信（購読者が居なければ何もしない）
+    COMMENT_HUB.publish(c.place_id, "comment", _render_items(session, [_comment_row(c)])[0])
     return {
             "ok": True,
             "id": c.id,
@@ -94,8 +363,11 @@ def delete_comment(
     if c.user_id != user.id:
         raise HTTPException(status_code=403, detail="このコメントを削除する権限がありません")
 
+    place_id = c.place_id
     session.delete(c)
     session.commit()
+    invalidate_place_comments(place_id)
+    COMMENT_HUB.publish(place_id, "delete", {"id": comment_id})
 
     return {"ok": True}
 
@@ -33,12 +33,24 @@ NAGANO_PARK_CSV = str(BASE_DIR / "data" / "202142_public_park.csv")
 UPLOAD_DIR = (os.getenv("UPLOAD_DIR", "uploads") or "").strip()
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# ヒートマップタイル（PNG）のディスクキャッシュ
+TILE_CACHE_DIR = (os.getenv("TILE_CACHE_DIR", "") or "").strip() or str(BASE_DIR / "cache" / "heat_tiles")
+
+# コメント・クイズチャットの NG ワード一覧（1行1語。更新すると数秒で反映）
+NG_WORDS_PATH = (os.getenv("NG_WORDS_PATH", "") or "").strip() or str(BASE_DIR / "data" / "ng_words.txt")
+
+# 集計（時間帯・日別）に使う現地時間の UTC からのずれ（日本時間 = 9）
+LOCAL_UTC_OFFSET_HOURS = int((os.getenv("LOCAL_UTC_OFFSET_HOURS", "9") or "9").strip())
+
 # パスワード長
 MIN_PW = 8
 MAX_PW = 256
 
 AUTH_COOKIE = "nonoji_session"
 
+# レート制限の共有バックエンド（複数ワーカー時。例: redis://localhost:6379/0）。空ならプロセス内メモリ
+RATE_LIMIT_REDIS_URL = (os.getenv("RATE_LIMIT_REDIS_URL", "") or "").strip()
+
 # config.py の末尾あたりに追加（お好み）
 if JWT_SECRET == "CHANGE_ME":
     raise RuntimeError("JWT_SECRET が設定されていません (.env で設定してください)")
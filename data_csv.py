@@ -4,6 +4,10 @@ from fastapi import APIRouter, HTTPException, Query
 from config import LOCAL_CSV_PATH, NAGANO_FAC_CSV, NAGANO_PARK_CSV
 from functools import lru_cache
 
+import numpy as np
+
+from geo import within_radius
+
 router = APIRouter()
 
 def _pick(d: dict, keys: List[str]):
@@ -178,6 +182,41 @@ def api_local_place(id: str = Query(..., min_length=1)):
             return {"ok": True, "item": x}
     raise HTTPException(404, "not found")
 
+@lru_cache(maxsize=1)
+def _main_csv_coords():
+    """_load_main_csv() の緯度経度を numpy 配列で保持（距離計算用）"""
+    items = _load_main_csv()
+    lats = np.fromiter((x["lat"] for x in items), dtype=np.float64, count=len(items))
+    lons = np.fromiter((x["lon"] for x in items), dtype=np.float64, count=len(items))
+    return lats, lons
+
+@router.get("/api/local/nearby")
+def api_local_nearby(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_m: float = Query(1000, gt=0, le=50000),
+    kind: Optional[str] = Query(None, description="'park' / 'facility'（省略時は両方）"),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """現在地から radius_m 以内の施設を近い順に返す（全件との距離を一括計算）"""
+    if kind not in (None, "park", "facility"):
+        raise HTTPException(400, "kind は 'park' か 'facility'")
+    items = _load_main_csv()
+    lats, lons = _main_csv_coords()
+    idx, dists = within_radius(lat, lon, lats, lons, radius_m)
+
+    out = []
+    for i, d in zip(idx, dists):
+        x = items[i]
+        if kind == "park" and x["kind"] != "公園":
+            continue
+        if kind == "facility" and x["kind"] == "公園":
+            continue
+        out.append({**x, "distance_m": round(float(d), 1)})
+        if len(out) >= limit:
+            break
+    return {"count": len(out), "items": out}
+
 @router.get("/api/nagano/places")
 def api_nagano_places(kind: str = "facility"):
     items = _load_nagano_csv(NAGANO_FAC_CSV, "公共施設") if kind == "facility" else _load_nagano_csv(NAGANO_PARK_CSV, "公園")
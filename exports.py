@@ -0,0 +1,209 @@
+# exports.py — CSV / GeoJSON エクスポートをストリーミングで返す共通処理
+#
+#   stmt = select(...)                                   # 条件はエンドポイント側で組む
+#   return csv_response("x.csv", ["a", "b"], iter_rows(stmt), lambda r: [r.a, r.b])
+#
+#   - iter_rows: yield_per で EXPORT_BATCH_ROWS 行ずつ DB から取り出す（全件を list にしない）
+#   - csv_stream: csv.writer（クォート・エスケープ込み）で書き、EXPORT_CHUNK_ROWS 行ごとに送る
+#   - geojson_stream: FeatureCollection を feature ごとに組み立てて送る
+#   - columnar_response: Parquet / Arrow IPC（pyarrow があるときだけ）。行グループ単位で書いて送る
+# どのサイズのエクスポートでもメモリは 1 チャンク（列形式は 1 行グループ）分で頭打ちになる。
+# セッションはジェネレータの中で開く（レスポンス送信中はリクエストの get_session が閉じているため）。
+import csv
+import io
+import json
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+
+from models import engine
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 無し（Parquet / Arrow だけ使えない）
+    pa = None
+    pq = None
+
+EXPORT_BATCH_ROWS = 2000    # DB から 1 回に取り出す行数
+EXPORT_CHUNK_ROWS = 500     # 1 回に送る行数
+BOM = "\ufeff"              # Excel で文字化けしないように
+EXPORT_ROW_GROUP_ROWS = 50000   # Parquet の行グループ / Arrow のバッチ 1 つの行数
+
+# 列形式の出力: fmt → (拡張子, media type)
+COLUMNAR_FORMATS = {
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.stream"),
+}
+
+
+def iter_rows(stmt, batch: int = EXPORT_BATCH_ROWS) -> Iterator:
+    """stmt の結果を batch 行ずつ取り出しながら 1 行ずつ返す"""
+    with Session(engine) as s:
+        result = s.execute(stmt.execution_options(yield_per=batch))
+        for part in result.partitions():
+            yield from part
+
+
+def csv_stream(
+    header: List[str],
+    rows: Iterable,
+    to_row: Callable = list,
+    bom: bool = True,
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if bom:
+        buf.write(BOM)
+    writer.writerow(header)
+    n = 0
+    for r in rows:
+        writer.writerow(to_row(r))
+        n += 1
+        if n % chunk_rows == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate(0)
+    yield buf.getvalue().encode("utf-8")
+
+
+def geojson_stream(features: Iterable[Optional[dict]], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """features（None は飛ばす）→ FeatureCollection の JSON"""
+    parts = ['{"type":"FeatureCollection","features":[']
+    first = True
+    for feat in features:
+        if feat is None:
+            continue
+        parts.append(("" if first else ",") + json.dumps(feat, ensure_ascii=False, separators=(",", ":")))
+        first = False
+        if len(parts) >= chunk_rows:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+    parts.append("]}")
+    yield "".join(parts).encode("utf-8")
+
+
+def csv_response(filename: str, header: List[str], rows: Iterable, to_row: Callable = list) -> StreamingResponse:
+    return StreamingResponse(
+        csv_stream(header, rows, to_row),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def geojson_response(features: Iterable[Optional[dict]], filename: Optional[str] = None) -> StreamingResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'} if filename else {}
+    return StreamingResponse(geojson_stream(features), media_type="application/json", headers=headers)
+
+
+def iso(dt) -> str:
+    return dt.isoformat() if dt else ""
+
+
+# ---------------------------
+# 列形式（Parquet / Arrow IPC）
+# ---------------------------
+# 列の型は名前で指定する（pyarrow が無くても呼び出し側で列定義を書けるように）。
+#   "dict": 辞書エンコードした文字列（施設名・種別など値の種類が少ない列。pandas では category になる）
+#   "str" / "int" / "float" / "date" / "timestamp"（UTC）
+Columns = Sequence[Tuple[str, str]]
+
+
+def _arrow_type(kind: str):
+    return {
+        "dict": pa.dictionary(pa.int32(), pa.string()),
+        "str": pa.string(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }[kind]
+
+
+def _arrow_batch(schema, columns: Columns, values: List[list]):
+    arrays = []
+    for (name, kind), vals in zip(columns, values):
+        if kind == "dict":
+            arrays.append(pa.array(vals, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(vals, _arrow_type(kind)))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """pyarrow の書き込み先。書かれたバイト列を溜めておき、drain() で取り出す"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks = []
+        return out
+
+
+def columnar_stream(
+    fmt: str,
+    columns: Columns,
+    rows: Iterable,
+    to_row: Callable = list,
+    group_rows: int = EXPORT_ROW_GROUP_ROWS,
+) -> Iterator[bytes]:
+    """rows を group_rows 行ずつ 1 行グループ（Arrow は 1 バッチ）にして書き、書けた分から送る"""
+    schema = pa.schema([(name, _arrow_type(kind)) for name, kind in columns])
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        dict_cols = [name for name, kind in columns if kind == "dict"]
+        writer = pq.ParquetWriter(sink, schema, use_dictionary=dict_cols, compression="zstd")
+
+        def write(batch):
+            writer.write_table(pa.Table.from_batches([batch]), row_group_size=group_rows)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+
+    values: List[list] = [[] for _ in columns]
+    n = 0
+    for r in rows:
+        for col, v in zip(values, to_row(r)):
+            col.append(v)
+        n += 1
+        if n == group_rows:
+            write(_arrow_batch(schema, columns, values))
+            values = [[] for _ in columns]
+            n = 0
+            yield sink.drain()
+    if n:
+        write(_arrow_batch(schema, columns, values))
+    writer.close()
+    yield sink.drain()
+
+
+def columnar_response(fmt: str, stem: str, columns: Columns, rows: Iterable, to_row: Callable = list) -> StreamingResponse:
+    if fmt not in COLUMNAR_FORMATS:
+        raise HTTPException(404, "対応していない形式です（parquet / arrow）")
+    if pa is None:
+        raise HTTPException(503, "pyarrow が入っていないため Parquet / Arrow 形式では出力できません")
+    ext, media_type = COLUMNAR_FORMATS[fmt]
+    return StreamingResponse(
+        columnar_stream(fmt, columns, rows, to_row),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{stem}{ext}"'},
+    )
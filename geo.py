@@ -0,0 +1,81 @@
+# geo.py — 距離計算（haversine）の共通ユーティリティ
+#
+# stamps.py / media.py にあったスカラー版 haversine_m をここに集約し、
+# 1点 vs N点・N点 vs M点をまとめて計算できる numpy ベクトル版も用意する。
+from math import radians, sin, cos, asin, sqrt
+from typing import Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+# ---------------------------
+# スカラー版（1組だけ）
+# ---------------------------
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """2点間の大円距離（メートル）。"""
+    phi1, phi2 = radians(lat1), radians(lat2)
+    dphi = radians(lat2 - lat1)
+    dl = radians(lon2 - lon1)
+    a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * asin(min(1.0, sqrt(a)))
+
+
+# ---------------------------
+# ベクトル版
+# ---------------------------
+def _hav(phi1, lam1, phi2, lam2) -> np.ndarray:
+    # 引数はラジアン。ブロードキャスト可能な形なら何でもよい
+    a = np.sin((phi2 - phi1) * 0.5) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_many(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float]) -> np.ndarray:
+    """1点 (lat, lon) から N 点までの距離（メートル, shape=(N,)）。"""
+    phi2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lam2 = np.radians(np.asarray(lons, dtype=np.float64))
+    return _hav(radians(lat), radians(lon), phi2, lam2)
+
+
+def haversine_pairs(lats1: Sequence[float], lons1: Sequence[float],
+                    lats2: Sequence[float], lons2: Sequence[float]) -> np.ndarray:
+    """i 番目同士の距離（メートル, shape=(N,)）。一括チェックインの検証などに使う。"""
+    return _hav(
+        np.radians(np.asarray(lats1, dtype=np.float64)), np.radians(np.asarray(lons1, dtype=np.float64)),
+        np.radians(np.asarray(lats2, dtype=np.float64)), np.radians(np.asarray(lons2, dtype=np.float64)),
+    )
+
+
+def haversine_matrix(lats1: Sequence[float], lons1: Sequence[float],
+                     lats2: Sequence[float], lons2: Sequence[float]) -> np.ndarray:
+    """N 点 × M 点の距離行列（メートル, shape=(N, M)）。"""
+    phi1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, None]
+    lam1 = np.radians(np.asarray(lons1, dtype=np.float64))[:, None]
+    phi2 = np.radians(np.asarray(lats2, dtype=np.float64))[None, :]
+    lam2 = np.radians(np.asarray(lons2, dtype=np.float64))[None, :]
+    return _hav(phi1, lam1, phi2, lam2)
+
+
+def equirect_many(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float]) -> np.ndarray:
+    """
+    正距円筒近似による 1点 vs N点 の距離（メートル）。arcsin/sqrt を使わない軽量版。
+
+    誤差の目安: 石川県全域（〜150 km）の範囲なら haversine との差は相対 0.01% 未満
+    （数 m 程度, bench_geo.py で確認できる）。数百 km を超える距離には使わないこと。
+    """
+    phi2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lam2 = np.radians(np.asarray(lons, dtype=np.float64))
+    phi1, lam1 = radians(lat), radians(lon)
+    x = (lam2 - lam1) * np.cos((phi1 + phi2) * 0.5)
+    y = phi2 - phi1
+    return EARTH_RADIUS_M * np.hypot(x, y)
+
+
+def within_radius(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float],
+                  radius_m: float) -> Tuple[np.ndarray, np.ndarray]:
+    """半径 radius_m 以内にある点の (インデックス, 距離) を近い順に返す。"""
+    d = haversine_many(lat, lon, lats, lons)
+    idx = np.nonzero(d <= radius_m)[0]
+    idx = idx[np.argsort(d[idx], kind="stable")]
+    return idx, d[idx]
@@ -0,0 +1,338 @@
+# heatmap.py — ヒートマップ用のサーバー側ビニング
+#
+# チェックインの座標は施設（Place）の座標なので、生の点を返す代わりに
+#   1) checkin_facts（ロールアップ + 端の時間の Stamp）を place_ref ごとに合計 → 施設ごとの重み
+#   2) Web メルカトルのピクセル座標（ズーム z）で cell_px 四方のマス目に numpy でまとめる
+# として「マスごとの重み付き点」にする。行数は期間内にチェックインのあった施設数で頭打ちになる。
+#
+# 結果は (ロールアップのウォーターマーク, 期間, 種別, 時間帯, ズーム, マスの大きさ) ごとにキャッシュする。
+# チェックインが増えるとウォーターマークが進むので自然に別キーになる（古いものは LRU で消える）。
+# 表示範囲（bbox）での切り出しはキャッシュの後で行う（地図を動かしてもキャッシュが効く）。
+#
+# タイル（render_tile / heat_tile）: 同じ施設ごとの重みを 256px タイルに numpy で描き、
+# ガウスぼかし → カラーマップ → PNG にする。PNG はフィルタ条件ごとのディレクトリに
+#   TILE_CACHE_DIR/<条件のハッシュ>/<ウォーターマーク>/<z>/<x>/<y>.png
+# で保存し、ウォーターマークが進んだら（チェックインが増えたら）古いディレクトリごと捨てる。
+# 既定の期間は毎時ずれて条件のハッシュが変わるので、条件ディレクトリ自体も
+# タイルを書くついでに TILE_GC_INTERVAL_SEC ごとに掃除する（TTL 切れ + 新しい順に TILE_CACHE_MAX_KEYS 個まで）。
+import hashlib
+import json
+import math
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from sqlmodel import Session, func, select
+
+from cache import LRUCache
+from config import TILE_CACHE_DIR
+from models import Place
+from places import place_refs_of_kind
+from rollups import checkin_facts, rollup_watermark
+
+TILE_SIZE = 256
+MAX_LAT = 85.05112878
+
+TILE_TTL_SEC = 7 * 24 * 3600   # これより使われていない条件のタイルは消す
+TILE_CACHE_MAX_KEYS = 64        # 残しておく条件ディレクトリの数（最近使った順）
+TILE_GC_INTERVAL_SEC = 600
+
+_bins_cache = LRUCache("heatmap_bins", 128)
+_weights_cache = LRUCache("heatmap_weights", 32)
+
+
+def project(lat: np.ndarray, lon: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """緯度経度 → ズーム zoom での全体ピクセル座標（Web メルカトル。タイル (x, y) の左上が (x*256, y*256)）"""
+    scale = TILE_SIZE * (2 ** zoom)
+    x = (lon + 180.0) / 360.0 * scale
+    s = np.sin(np.radians(np.clip(lat, -MAX_LAT, MAX_LAT)))
+    y = (0.5 - np.log((1 + s) / (1 - s)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def unproject(x: np.ndarray, y: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    scale = TILE_SIZE * (2 ** zoom)
+    lon = x / scale * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * y / scale))))
+    return lat, lon
+
+
+def place_weights(
+    session: Session,
+    dt_from: Optional[datetime],
+    dt_to: Optional[datetime],
+    kind: Optional[str],
+    hours: Optional[Sequence[int]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """期間内の施設ごとのチェックイン数 → (lat, lon, 件数) の配列"""
+    f = checkin_facts(dt_from, dt_to, hours=hours)
+    agg = select(f.c.place_ref, func.sum(f.c.n).label("n"))
+    if kind:
+        agg = agg.where(f.c.place_ref.in_(place_refs_of_kind(kind)))
+    agg = agg.group_by(f.c.place_ref).subquery("agg")
+    rows = session.exec(
+        select(Place.lat, Place.lon, agg.c.n)
+        .select_from(agg)
+        .join(Place, Place.id == agg.c.place_ref)
+        .where(Place.lat.is_not(None), Place.lon.is_not(None))
+    ).all()
+    if not rows:
+        empty = np.zeros(0, dtype=np.float64)
+        return empty, empty, empty
+    arr = np.asarray(rows, dtype=np.float64)
+    return arr[:, 0], arr[:, 1], arr[:, 2]
+
+
+def _bin(lat, lon, w, zoom: int, cell_px: int):
+    """マス目ごとに重みを合計し、重心（重み付き）の緯度経度を返す"""
+    if not len(w):
+        return lat, lon, w
+    x, y = project(lat, lon, zoom)
+    cx = np.floor(x / cell_px).astype(np.int64)
+    cy = np.floor(y / cell_px).astype(np.int64)
+    keys = cx * (1 << 32) + cy
+    uniq, inv = np.unique(keys, return_inverse=True)
+    weight = np.bincount(inv, weights=w, minlength=len(uniq))
+    mx = np.bincount(inv, weights=w * x, minlength=len(uniq)) / weight
+    my = np.bincount(inv, weights=w * y, minlength=len(uniq)) / weight
+    clat, clon = unproject(mx, my, zoom)
+    return clat, clon, weight
+
+
+def binned_cells(
+    session: Session,
+    dt_from: Optional[datetime],
+    dt_to: Optional[datetime],
+    kind: Optional[str],
+    hours: Optional[Sequence[int]],
+    zoom: int,
+    cell_px: int,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+) -> Tuple[list, bool]:
+    """
+    [[lat, lon, 重み], ...]（重みの大きい順）と、キャッシュに当たったかどうか。
+    bbox は (南, 西, 北, 東)。呼ぶ前に refresh_rollups() を済ませておくこと。
+    """
+    key = (
+        rollup_watermark(session), dt_from, dt_to, kind,
+        tuple(hours) if hours is not None else None, zoom, cell_px,
+    )
+    cells = _bins_cache.get(key)
+    hit = cells is not None
+    if not hit:
+        cells = _bin(*place_weights(session, dt_from, dt_to, kind, hours), zoom, cell_px)
+        _bins_cache.set(key, cells)
+    lat, lon, w = cells
+    if bbox is not None and len(w):
+        south, west, north, east = bbox
+        m = (lat >= south) & (lat <= north)
+        m &= ((lon >= west) & (lon <= east)) if west <= east else ((lon >= west) | (lon <= east))
+        lat, lon, w = lat[m], lon[m], w[m]
+    order = np.argsort(-w, kind="stable")
+    out = [[round(float(lat[i]), 5), round(float(lon[i]), 5), float(w[i])] for i in order]
+    return out, hit
+
+
+def cache_stats() -> dict:
+    return {"bins": _bins_cache.stats(), "weights": _weights_cache.stats()}
+
+
+# ===== タイル =====
+
+def _colormap() -> np.ndarray:
+    """0..255 → RGBA（透明 → 青 → 水色 → 緑 → 黄 → 赤）"""
+    stops = [
+        (0.00, (0, 0, 255, 0)),
+        (0.15, (0, 0, 255, 120)),
+        (0.35, (0, 255, 255, 170)),
+        (0.55, (0, 255, 0, 200)),
+        (0.75, (255, 255, 0, 220)),
+        (1.00, (255, 0, 0, 235)),
+    ]
+    t = np.linspace(0, 1, 256)
+    pos = [p for p, _ in stops]
+    lut = np.stack([np.interp(t, pos, [c[i] for _, c in stops]) for i in range(4)], axis=1)
+    return lut.round().astype(np.uint8)
+
+
+_LUT = _colormap()
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """(高さ, 幅, 4) の uint8 → PNG（zlib だけで書く。Pillow 不要）"""
+    h, w, _ = rgba.shape
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)   # 各行の先頭はフィルタ種別（0 = なし）
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+EMPTY_TILE_PNG = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def _blur_matrix(n: int, sigma: float) -> np.ndarray:
+    """n×n のガウスぼかし行列（中心の重み 1。K @ H @ K.T で縦横にかける）"""
+    d = np.arange(n)
+    return np.exp(-((d[:, None] - d[None, :]) ** 2) / (2 * sigma * sigma))
+
+
+def _weights(session: Session, filters: tuple):
+    """条件ごとの施設の重み（と、ズームごとの正規化用の最大値）。ウォーターマーク込みでキャッシュ"""
+    entry = _weights_cache.get(filters)
+    if entry is None:
+        wm, dt_from, dt_to, kind, hours = filters
+        entry = {"points": place_weights(session, dt_from, dt_to, kind, hours), "norm": {}}
+        _weights_cache.set(filters, entry)
+    return entry
+
+
+def render_tile(entry: dict, z: int, x: int, y: int, radius_px: int) -> bytes:
+    lat, lon, w = entry["points"]
+    if not len(w):
+        return EMPTY_TILE_PNG
+    sigma = radius_px / 3.0
+    margin = radius_px
+    size = TILE_SIZE + 2 * margin
+    px, py = project(lat, lon, z)
+    px = px - (x * TILE_SIZE - margin)
+    py = py - (y * TILE_SIZE - margin)
+    sel = (px >= 0) & (px < size) & (py >= 0) & (py < size)
+    if not sel.any():
+        return EMPTY_TILE_PNG
+
+    grid = np.zeros((size, size), dtype=np.float64)
+    np.add.at(grid, (py[sel].astype(np.int64), px[sel].astype(np.int64)), w[sel])
+    k = _blur_matrix(size, sigma)
+    heat = (k @ grid @ k.T)[margin:margin + TILE_SIZE, margin:margin + TILE_SIZE]
+
+    # どのタイルでも同じ尺度にする: このズームで 1 ピクセルに集まる重みの最大値を 1 とする（対数目盛り）
+    norm = entry["norm"].get(z)
+    if norm is None:
+        norm = float(_bin(lat, lon, w, z, 1)[2].max())
+        entry["norm"][z] = norm
+    v = np.clip(np.log1p(heat) / math.log1p(norm), 0.0, 1.0)
+    rgba = _LUT[(v * 255).astype(np.uint8)]
+    rgba[heat < 0.02, 3] = 0
+    return encode_png(rgba)
+
+
+def _filter_key(dt_from, dt_to, kind, hours, radius_px) -> str:
+    spec = json.dumps(
+        [dt_from and dt_from.isoformat(), dt_to and dt_to.isoformat(), kind,
+         list(hours) if hours is not None else None, radius_px],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(spec.encode("utf-8")).hexdigest()[:16]
+
+
+def heat_tile(
+    session: Session,
+    dt_from: Optional[datetime],
+    dt_to: Optional[datetime],
+    kind: Optional[str],
+    hours: Optional[Sequence[int]],
+    z: int, x: int, y: int,
+    radius_px: int,
+) -> Tuple[bytes, str]:
+    """(PNG, ETag)。ディスクにあればそれを返す。呼ぶ前に refresh_rollups() を済ませておくこと"""
+    wm = rollup_watermark(session)
+    fkey = _filter_key(dt_from, dt_to, kind, hours, radius_px)
+    etag = f'"{fkey}-{wm}-{z}-{x}-{y}"'
+    base = os.path.join(TILE_CACHE_DIR, fkey)
+    path = os.path.join(base, str(wm), str(z), str(x), f"{y}.png")
+    try:
+        with open(path, "rb") as fh:
+            png = fh.read()
+        _touch(base)
+        return png, etag
+    except FileNotFoundError:
+        pass
+
+    hours = tuple(hours) if hours is not None else None
+    png = render_tile(_weights(session, (wm, dt_from, dt_to, kind, hours)), z, x, y, radius_px)
+
+    wm_dir = os.path.join(base, str(wm))
+    if not os.path.isdir(wm_dir) and os.path.isdir(base):
+        # ウォーターマークが進んだ: 同じ条件の古いタイルを捨てる
+        for name in os.listdir(base):
+            if name != str(wm):
+                shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(png)
+        os.replace(tmp, path)
+        _touch(base)
+    except OSError as e:
+        # 掃除と重なってディレクトリが消えた等。タイル自体は返せるのでキャッシュだけ諦める
+        print("[heatmap] tile cache write error:", repr(e))
+    _maybe_gc_tiles()
+    return png, etag
+
+
+def _touch(path: str):
+    """条件ディレクトリの mtime を「最後に使った時刻」にする（GC の並び順用）"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+_tile_gc_lock = threading.Lock()
+_last_tile_gc = time.monotonic()
+
+
+def _maybe_gc_tiles():
+    global _last_tile_gc
+    if time.monotonic() - _last_tile_gc < TILE_GC_INTERVAL_SEC:
+        return
+    if not _tile_gc_lock.acquire(blocking=False):
+        return
+    try:
+        _last_tile_gc = time.monotonic()
+        gc_tile_cache()
+    except Exception as e:
+        print("[heatmap] tile cache gc error:", repr(e))
+    finally:
+        _tile_gc_lock.release()
+
+
+def gc_tile_cache(max_keys: int = TILE_CACHE_MAX_KEYS) -> int:
+    """
+    条件ごとのタイルディレクトリのうち、TILE_TTL_SEC より使われていないものと、
+    最近使った順で max_keys 個より後ろのものを消す。消した数を返す
+    """
+    if not os.path.isdir(TILE_CACHE_DIR):
+        return 0
+    cutoff = time.time() - TILE_TTL_SEC
+    dirs = []
+    for name in os.listdir(TILE_CACHE_DIR):
+        path = os.path.join(TILE_CACHE_DIR, name)
+        try:
+            dirs.append((os.path.getmtime(path), path))
+        except OSError:
+            pass
+    dirs.sort(reverse=True)
+    removed = 0
+    for i, (mtime, path) in enumerate(dirs):
+        if mtime < cutoff or i >= max_keys:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    if removed:
+        print(f"[heatmap] removed {removed} tile cache dir(s)")
+    return removed
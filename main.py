@@ -2,6 +2,7 @@ from fastapi import FastAPI, Request, Depends
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from assets import install_template_helpers
 
 from config import SESSION_SECRET, UPLOAD_DIR, BASE_URL, ARRIVAL_RADIUS_M
 from starlette.middleware.sessions import SessionMiddleware
@@ -9,7 +10,10 @@ from starlette.middleware.sessions import SessionMiddleware
 from models import on_startup  # ensure tables
 from auth import router as auth_router
 from data_csv import router as data_router
-from media import router as media_router
+from media import router as media_router, gc_stale_uploads, resubmit_missing_derivatives
+from rollups import refresh_rollups
+from places import sync_places
+from heatmap import gc_tile_cache
 import os
 # main.py に追記
 from stamps import router as stamps_router
@@ -21,19 +25,37 @@ from recognition import router as recognition_router
 from admin_roles import router as admin_roles_router
 from auth import get_current_user, _SimpleUser, login_required  # ★まとめてimport
 from app_feedback import router as app_feedback_router
+from thumbnails import shutdown_pool as shutdown_thumbnail_pool
+from static_files import ImmutableStaticFiles
 
 app = FastAPI(title="Ishikawa Facilities & Parks")
 app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET, same_site="lax", https_only=True)
 
 # Mount static & uploads
+# build_assets.py の出力はファイル名に内容ハッシュが入っているので永久キャッシュ可
+os.makedirs(os.path.join("static", "build"), exist_ok=True)
+app.mount("/static/build", ImmutableStaticFiles(directory=os.path.join("static", "build")), name="static_build")
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# 内容アドレス（sha256）の写真は永久キャッシュ可。/uploads より先に mount すること
+os.makedirs(os.path.join(UPLOAD_DIR, "blobs"), exist_ok=True)
+app.mount("/uploads/blobs", ImmutableStaticFiles(directory=os.path.join(UPLOAD_DIR, "blobs")), name="upload_blobs")
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
-templates = Jinja2Templates(directory="templates")
+templates = install_template_helpers(Jinja2Templates(directory="templates"))
 
 
 @app.on_event("startup")
 def _startup():
     on_startup()
+    gc_stale_uploads()  # 放置された再開可能アップロードの掃除
+    resubmit_missing_derivatives()  # 縮小版が作られていない写真
+    sync_places()       # 施設カタログ → Place
+    gc_tile_cache()     # 古いヒートマップタイル
+    refresh_rollups()   # チェックイン集計のロールアップを追いつかせる（初回は全履歴）
+
+
+@app.on_event("shutdown")
+def _shutdown():
+    shutdown_thumbnail_pool()
 
 
 # =========================
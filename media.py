@@ -1,24 +1,22 @@
-import os, uuid
+import os, tempfile, hashlib, asyncio, secrets, time
+from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form, Query
+from starlette.concurrency import run_in_threadpool
+from fastapi import APIRouter, HTTPException, Request, UploadFile, Form, Query
 from fastapi.responses import JSONResponse
+from starlette.requests import ClientDisconnect
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from sqlmodel import Session, select
+from sqlalchemy import and_, or_, func
+from sqlalchemy.exc import IntegrityError
 
 from config import UPLOAD_DIR, ARRIVAL_RADIUS_M
-from models import engine, Photo, Stamp
+from models import engine, Photo, PhotoVariant, PhotoBlob, PhotoUpload, MediaBlob, Stamp
+from thumbnails import submit_derivatives, variants_map, can_submit
 from auth import get_current_user, login_required
 
 router = APIRouter()
 
-# ===== Utilities =====
-def haversine_m(lat1, lon1, lat2, lon2) -> float:
-    R = 6371000.0
-    import math as m
-    phi1, phi2 = m.radians(lat1), m.radians(lat2)
-    dphi = m.radians(lat2 - lat1); dl = m.radians(lon2 - lon1)
-    a = m.sin(dphi/2)**2 + m.cos(phi1)*m.cos(phi2)*m.sin(dl/2)**2
-    return 2*R*m.asin(m.sqrt(a))
-
 # ===== Stamps =====
 @router.get("/api/stamps")
 def api_stamps(request: Request):
@@ -31,55 +29,523 @@ def api_stamps(request: Request):
 # ===== Photos =====
 ALLOWED_EXT = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
 MAX_BYTES = 8 * 1024 * 1024  # 8MB
+MULTIPART_OVERHEAD_BYTES = 16 * 1024  # multipart の境界・パートヘッダ・place_id の分（Content-Length の上限 = MAX_BYTES + これ）
+
+CHUNK_BYTES = 256 * 1024  # 1回に読む量（同時アップロード数 × これ がメモリ上限の目安）
+
+BLOB_DIR = "blobs"        # UPLOAD_DIR/blobs/ab/cd/<sha256><ext>
+DERIV_RESUBMIT_BATCH = 200  # 縮小版の作り直しを 1 回の掃除で投げる上限
+EXT_ALIASES = {".jpeg": ".jpg"}
+
+def _write_chunk(out, h, chunk: bytes):
+    h.update(chunk)
+    out.write(chunk)
+
+async def _spool_upload(file: UploadFile) -> tuple[str, int, str]:
+    """
+    UploadFile をチャンクごとに UPLOAD_DIR 内の一時ファイルへ書き出しつつ SHA-256 を計算する。
+      - MAX_BYTES を超えた時点で中断して 400
+      - ディスク I/O とハッシュ計算はスレッドプールで行い、イベントループ（クイズの WebSocket 等）を止めない
+    失敗時は一時ファイルを消す。戻り値は (一時ファイルのパス, バイト数, sha256 hex)。
+    """
+    fd, tmp_path = await run_in_threadpool(
+        tempfile.mkstemp, dir=UPLOAD_DIR, prefix=".upload-", suffix=".part"
+    )
+    size = 0
+    h = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_BYTES:
+                    raise HTTPException(400, f"ファイルサイズ上限 {MAX_BYTES//(1024*1024)}MB を超えています")
+                await run_in_threadpool(_write_chunk, out, h, chunk)
+        if size == 0:
+            raise HTTPException(400, "空のファイルです")
+    except BaseException:
+        _unlink_quiet(tmp_path)
+        raise
+    return tmp_path, size, h.hexdigest()
+
+def _unlink_quiet(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def _blob_rel_path(digest: str, ext: str) -> str:
+    return f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+def _store_blob(tmp_path: str, digest: str, ext: str, size: int) -> tuple[MediaBlob, bool]:
+    """
+    一時ファイルを MediaBlob として確定する（同期関数。スレッドプールから呼ぶ）。
+      - 同じ sha256 が既にあれば一時ファイルを捨てて既存を返す（重複排除）
+      - 無ければシャードディレクトリへ os.replace して行を作る
+    戻り値は (blob, 新規作成したか)。
+    """
+    ext = EXT_ALIASES.get(ext, ext)
+    with Session(engine) as s:
+        blob = s.exec(select(MediaBlob).where(MediaBlob.sha256 == digest)).first()
+        if blob and os.path.exists(os.path.join(UPLOAD_DIR, blob.rel_path)):
+            _unlink_quiet(tmp_path)
+            return blob, False
+
+        rel_path = blob.rel_path if blob else _blob_rel_path(digest, ext)
+        dest = os.path.join(UPLOAD_DIR, rel_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp_path, dest)
+        if blob:  # 行はあるのにファイルが消えていた → 置き直しただけ
+            return blob, True
+
+        blob = MediaBlob(sha256=digest, ext=ext, size=size, rel_path=rel_path)
+        s.add(blob)
+        try:
+            s.commit()
+        except IntegrityError:
+            # 同じ内容が同時にアップロードされた。ファイルは同一内容なので相手の行を使う
+            s.rollback()
+            blob = s.exec(select(MediaBlob).where(MediaBlob.sha256 == digest)).one()
+            return blob, False
+        s.refresh(blob)
+        return blob, True
+
+def _insert_photo(user_id: int, place_id: str, blob: MediaBlob) -> Photo:
+    with Session(engine) as s:
+        p = Photo(user_id=user_id, place_id=place_id, filename=blob.rel_path, url=f"/uploads/{blob.rel_path}")
+        s.add(p); s.flush()
+        s.add(PhotoBlob(photo_id=p.id, blob_id=blob.id))
+        s.commit(); s.refresh(p)
+        return p
+
+def _variants_by_photo(s: Session, photo_ids: list[int]) -> dict[int, dict]:
+    """
+    {photo_id: {"160": {"webp": url, "jpeg": url}, ...}} を作る。
+    MediaBlob を参照する写真は blob の縮小版、それ以前の写真は PhotoVariant から。
+    まだ縮小版ができていない写真は含まれない。
+    """
+    out: dict[int, dict] = {}
+    if not photo_ids:
+        return out
+    rows = s.exec(
+        select(PhotoBlob.photo_id, MediaBlob.variants_json)
+        .join(MediaBlob, MediaBlob.id == PhotoBlob.blob_id)
+        .where(PhotoBlob.photo_id.in_(photo_ids))
+    ).all()
+    for pid, vj in rows:
+        vm = variants_map(vj)
+        if vm:
+            out[pid] = vm
+
+    legacy = [pid for pid in photo_ids if pid not in out]
+    if legacy:
+        for v in s.exec(select(PhotoVariant).where(PhotoVariant.photo_id.in_(legacy))).all():
+            out.setdefault(v.photo_id, {}).setdefault(str(v.size), {})[v.fmt] = v.url
+    return out
+
+PHOTOS_PAGE_DEFAULT = 30
+PHOTOS_PAGE_MAX = 200
+COUNTS_MAX_PLACES = 500
+
+def _photo_cursor(p: Photo) -> str:
+    return f"{p.created_at.isoformat()}_{p.id}"
+
+def _parse_photo_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        ts, pid = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(ts), int(pid)
+    except ValueError:
+        raise HTTPException(400, "cursor が不正です")
 
 @router.get("/api/photos")
-def list_photos(place_id: str = Query(..., min_length=1)):
+def list_photos(
+    place_id: str = Query(..., min_length=1),
+    limit: int = Query(PHOTOS_PAGE_DEFAULT, ge=1, le=PHOTOS_PAGE_MAX),
+    cursor: Optional[str] = Query(None, description="前回レスポンスの next_cursor。これより古い写真を返す"),
+):
+    """
+    地点の写真を新しい順に limit 件ずつ返す。
+    (created_at, id) のキーセットで続きを取るので、写真が何千枚あっても OFFSET のように遅くならない。
+    """
+    stmt = select(Photo).where(Photo.place_id == place_id)
+    if cursor:
+        c_at, c_id = _parse_photo_cursor(cursor)
+        stmt = stmt.where(or_(Photo.created_at < c_at, and_(Photo.created_at == c_at, Photo.id < c_id)))
+    stmt = stmt.order_by(Photo.created_at.desc(), Photo.id.desc()).limit(limit + 1)
+
     with Session(engine) as s:
-        rows = s.exec(
-            select(Photo).where(Photo.place_id == place_id).order_by(Photo.created_at.desc())
-        ).all()
+        rows = s.exec(stmt).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        variants = _variants_by_photo(s, [p.id for p in rows])
     return {
         "count": len(rows),
+        "has_more": has_more,
+        "next_cursor": _photo_cursor(rows[-1]) if has_more else None,
         "items": [
-            {"id": p.id, "place_id": p.place_id, "url": p.url, "created_at": p.created_at.isoformat()}
+            {
+                "id": p.id, "place_id": p.place_id, "url": p.url, "created_at": p.created_at.isoformat(),
+                # 縮小版（生成前は空 → url を使う）
+                "variants": variants.get(p.id, {}),
+            }
             for p in rows
         ]
     }
 
+@router.get("/api/photos/counts")
+def photo_counts(place_ids: str = Query(..., min_length=1, description="カンマ区切りの place_id")):
+    """複数地点の写真枚数を 1 回の GROUP BY で返す。写真の無い地点は 0。"""
+    ids = list(dict.fromkeys(x.strip() for x in place_ids.split(",") if x.strip()))
+    if len(ids) > COUNTS_MAX_PLACES:
+        raise HTTPException(400, f"place_ids は {COUNTS_MAX_PLACES} 件までです")
+    counts = dict.fromkeys(ids, 0)
+    if ids:
+        with Session(engine) as s:
+            rows = s.exec(
+                select(Photo.place_id, func.count(Photo.id))
+                .where(Photo.place_id.in_(ids))
+                .group_by(Photo.place_id)
+            ).all()
+        counts.update({pid: n for pid, n in rows})
+    return {"ok": True, "counts": counts}
+
 @router.post("/api/photos")
-async def upload_photo(
+async def upload_photo(request: Request):
+    """
+    multipart（place_id, file）の写真アップロード。
+    File(...) で受けると本文を全部受信・一時保存してからハンドラが呼ばれるので、
+    フォームは自分で読み、その前に Content-Length で大きすぎるものを 413 で弾く。
+    """
+    user = get_current_user(request)
+    login_required(user)
+
+    try:
+        length = int(request.headers.get("content-length", ""))
+    except ValueError:
+        raise HTTPException(411, "Content-Length が必要です")
+    if length > MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(413, f"ファイルサイズ上限 {MAX_BYTES//(1024*1024)}MB を超えています")
+
+    form = await request.form(max_files=1, max_fields=8)
+    try:
+        place_id = form.get("place_id")
+        file = form.get("file")
+        if not isinstance(place_id, str) or not place_id:
+            raise HTTPException(422, "place_id を指定してください")
+        if not isinstance(file, StarletteUploadFile):
+            raise HTTPException(422, "file を指定してください")
+
+        name_lower = (file.filename or "").lower()
+        ext = os.path.splitext(name_lower)[1]
+        if ext not in ALLOWED_EXT:
+            raise HTTPException(400, f"対応拡張子: {', '.join(sorted(ALLOWED_EXT))}")
+
+        tmp_path, size, digest = await _spool_upload(file)
+    finally:
+        await form.close()
+    p = await _finish_photo(user.id, place_id, tmp_path, digest, ext, size)
+    return {"ok": True, "url": p.url, "id": p.id}
+
+async def _finish_photo(user_id: int, place_id: str, tmp_path: str, digest: str, ext: str, size: int) -> Photo:
+    """受信し終えた一時ファイルを blob として確定し、Photo を作る（通常／再開可能アップロード共通）"""
+    blob, created = await run_in_threadpool(_store_blob, tmp_path, digest, ext, size)
+    p = await run_in_threadpool(_insert_photo, user_id, place_id, blob)
+
+    # 縮小版はプロセスプールで作る（新しい blob のときだけ。レスポンスは待たない）
+    if created:
+        try:
+            _submit_blob_derivatives(blob.id, blob.rel_path)
+        except Exception as e:
+            print("[photos] derivative submit error:", repr(e))
+    return p
+
+def _submit_blob_derivatives(blob_id: int, rel_path: str) -> bool:
+    src = os.path.join(UPLOAD_DIR, rel_path)
+    return submit_derivatives(blob_id, src, os.path.dirname(src), "/uploads/" + os.path.dirname(rel_path))
+
+def resubmit_missing_derivatives(limit: int = DERIV_RESUBMIT_BATCH) -> int:
+    """
+    縮小版の無い blob（生成に失敗した・処理中に再起動した・Pillow を後から入れた）を作り直しに出す。
+    1 回に limit 件まで。出した件数を返す。
+    """
+    submitted = 0
+    with Session(engine) as s:
+        rows = s.exec(
+            select(MediaBlob.id, MediaBlob.rel_path)
+            .where(MediaBlob.variants_json.is_(None))
+            .order_by(MediaBlob.id)
+        ).all()
+    for blob_id, rel_path in rows:
+        if submitted >= limit:
+            break
+        if not can_submit(blob_id) or not os.path.exists(os.path.join(UPLOAD_DIR, rel_path)):
+            continue
+        if _submit_blob_derivatives(blob_id, rel_path):
+            submitted += 1
+    if submitted:
+        print(f"[photos] resubmitted derivatives for {submitted} blob(s)")
+    return submitted
+
+# ===== Resumable upload =====
+# 回線が切れても続きから送れるオフセット方式のアップロード。
+#   1) POST   /api/photos/uploads        place_id, filename, size → {upload_id, offset: 0, chunk_bytes}
+#   2) PATCH  /api/photos/uploads/{id}   ヘッダ Upload-Offset に送信開始位置、本文にバイト列
+#                                        → {offset, complete}。位置が食い違えば 409（offset 付き）
+#      最後のバイトを受けたら Photo を作り {complete: true, url, id} を返す
+#   3) GET    /api/photos/uploads/{id}   → 今どこまで受け取ったか（切断後の再開用）
+#   4) DELETE /api/photos/uploads/{id}   中止
+# 受信途中のデータは UPLOAD_DIR/.partial/<id>.part に追記するだけなので、メモリに溜めない。
+PARTIAL_DIR = os.path.join(UPLOAD_DIR, ".partial")
+RESUMABLE_CHUNK_BYTES = 1024 * 1024    # クライアントに勧める 1 回の PATCH の大きさ
+UPLOAD_MAX_PENDING = 5                 # 1ユーザーが同時に持てる未完了アップロード数
+UPLOAD_TTL = timedelta(hours=24)       # これより長く放置されたアップロードは GC で消す
+UPLOAD_GC_INTERVAL_SEC = 600
+
+_upload_locks: dict[str, asyncio.Lock] = {}
+_last_gc = 0.0
+
+def _partial_path(upload_id: str) -> str:
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+def _partial_size(upload_id: str) -> int:
+    try:
+        return os.path.getsize(_partial_path(upload_id))
+    except FileNotFoundError:
+        return 0
+
+def _upload_lock(upload_id: str) -> asyncio.Lock:
+    """
+    upload_id ごとのロック。存在と所有者を確かめて（_load_upload）から取ること
+    （でたらめな id のたびに作ると _upload_locks が増え続ける。GC は行のある id しか消さない）
+    """
+    lock = _upload_locks.get(upload_id)
+    if lock is None:
+        lock = _upload_locks[upload_id] = asyncio.Lock()
+    return lock
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def _upload_state(up: PhotoUpload, offset: int) -> dict:
+    return {
+        "ok": True,
+        "upload_id": up.id,
+        "offset": offset,
+        "size": up.size,
+        "complete": up.photo_id is not None,
+    }
+
+def _load_upload(upload_id: str, user_id: int) -> PhotoUpload:
+    with Session(engine) as s:
+        up = s.get(PhotoUpload, upload_id)
+    if not up or up.user_id != user_id:
+        raise HTTPException(404, "アップロードが見つかりません")
+    return up
+
+def _load_locked_upload(upload_id: str, user_id: int) -> PhotoUpload:
+    """ロックを取ったあとの読み直し。待っている間に消されていたらロックも片付ける"""
+    try:
+        return _load_upload(upload_id, user_id)
+    except HTTPException:
+        _upload_locks.pop(upload_id, None)
+        raise
+
+def _create_upload(user_id: int, place_id: str, ext: str, size: int) -> PhotoUpload:
+    with Session(engine) as s:
+        pending = s.exec(
+            select(PhotoUpload.id).where(PhotoUpload.user_id == user_id, PhotoUpload.photo_id == None)  # noqa: E711
+        ).all()
+        if len(pending) >= UPLOAD_MAX_PENDING:
+            raise HTTPException(429, "未完了のアップロードが多すぎます。少し待ってから試してください")
+        up = PhotoUpload(id=secrets.token_hex(16), user_id=user_id, place_id=place_id, ext=ext, size=size)
+        s.add(up)
+        s.commit(); s.refresh(up)
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    open(_partial_path(up.id), "wb").close()
+    return up
+
+def _touch_upload(upload_id: str, photo_id: Optional[int] = None):
+    with Session(engine) as s:
+        up = s.get(PhotoUpload, upload_id)
+        if up is None:
+            return
+        up.updated_at = datetime.utcnow()
+        if photo_id is not None:
+            up.photo_id = photo_id
+        s.add(up); s.commit()
+
+def _truncate(path: str, size: int):
+    with open(path, "r+b") as f:
+        f.truncate(size)
+
+async def _append_body(request: Request, upload_id: str, offset: int, remaining: int) -> int:
+    """
+    リクエスト本文を .part に追記して書けたバイト数を返す。
+      - 予告サイズを超える分が来たら追記前の長さに戻して 400
+      - 途中で切断されたら、そこまでに受け取った分は残す（次の PATCH で続きから）
+    """
+    path = _partial_path(upload_id)
+    written = 0
+    out = await run_in_threadpool(open, path, "ab")
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if written + len(chunk) > remaining:
+                out.close()
+                await run_in_threadpool(_truncate, path, offset)
+                raise HTTPException(400, "予告したサイズを超えています")
+            await run_in_threadpool(out.write, chunk)
+            written += len(chunk)
+    except ClientDisconnect:
+        pass
+    finally:
+        await run_in_threadpool(out.close)
+    return written
+
+def gc_stale_uploads() -> int:
+    """
+    UPLOAD_TTL より長く更新のないアップロード（完了済みの記録も含む）と、
+    DB に行の無い .part / 通常アップロードの一時ファイルの残骸を消す。消した件数を返す。
+    """
+    cutoff = datetime.utcnow() - UPLOAD_TTL
+    removed = 0
+    with Session(engine) as s:
+        for up in s.exec(select(PhotoUpload).where(PhotoUpload.updated_at < cutoff)).all():
+            _unlink_quiet(_partial_path(up.id))
+            _upload_locks.pop(up.id, None)
+            s.delete(up)
+            removed += 1
+        s.commit()
+        known = set(s.exec(select(PhotoUpload.id)).all())
+
+    cutoff_ts = cutoff.timestamp()
+    leftovers = []
+    if os.path.isdir(PARTIAL_DIR):
+        leftovers += [
+            os.path.join(PARTIAL_DIR, n) for n in os.listdir(PARTIAL_DIR)
+            if n.removesuffix(".part") not in known
+        ]
+    leftovers += [
+        os.path.join(UPLOAD_DIR, n) for n in os.listdir(UPLOAD_DIR)
+        if n.startswith(".upload-") and n.endswith(".part")
+    ]
+    for path in leftovers:
+        try:
+            if os.path.getmtime(path) < cutoff_ts:
+                os.unlink(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        print(f"[photos] removed {removed} stale upload(s)")
+    return removed
+
+async def _maybe_gc():
+    global _last_gc
+    now = time.monotonic()
+    if now - _last_gc < UPLOAD_GC_INTERVAL_SEC:
+        return
+    _last_gc = now
+    try:
+        await run_in_threadpool(gc_stale_uploads)
+        await run_in_threadpool(resubmit_missing_derivatives)
+    except Exception as e:
+        print("[photos] upload gc error:", repr(e))
+
+@router.post("/api/photos/uploads")
+async def create_photo_upload(
     request: Request,
     place_id: str = Form(...),
-    file: UploadFile = File(...),
+    filename: str = Form(...),
+    size: int = Form(...),
 ):
     user = get_current_user(request)
     login_required(user)
 
-    name_lower = (file.filename or "").lower()
-    ext = os.path.splitext(name_lower)[1]
+    ext = os.path.splitext(filename.lower())[1]
     if ext not in ALLOWED_EXT:
         raise HTTPException(400, f"対応拡張子: {', '.join(sorted(ALLOWED_EXT))}")
-
-    data = await file.read()
-    if len(data) == 0:
+    if size <= 0:
         raise HTTPException(400, "空のファイルです")
-    if len(data) > MAX_BYTES:
+    if size > MAX_BYTES:
         raise HTTPException(400, f"ファイルサイズ上限 {MAX_BYTES//(1024*1024)}MB を超えています")
 
-    uid = uuid.uuid4().hex[:12]
-    safe_id = "".join(ch for ch in place_id if ch.isalnum() or ch in ("-","_"))
-    filename = f"{safe_id}_{uid}{ext}"
-    path = os.path.join(UPLOAD_DIR, filename)
-    with open(path, "wb") as f:
-        f.write(data)
+    await _maybe_gc()
+    up = await run_in_threadpool(_create_upload, user.id, place_id, ext, size)
+    return {**_upload_state(up, 0), "chunk_bytes": RESUMABLE_CHUNK_BYTES}
+
+@router.get("/api/photos/uploads/{upload_id}")
+async def get_photo_upload(upload_id: str, request: Request):
+    user = get_current_user(request)
+    login_required(user)
+    up = await run_in_threadpool(_load_upload, upload_id, user.id)
+    offset = up.size if up.photo_id is not None else _partial_size(upload_id)
+    return _upload_state(up, offset)
+
+@router.patch("/api/photos/uploads/{upload_id}")
+async def append_photo_upload(upload_id: str, request: Request):
+    user = get_current_user(request)
+    login_required(user)
+    try:
+        offset = int(request.headers.get("upload-offset", ""))
+    except ValueError:
+        raise HTTPException(400, "Upload-Offset ヘッダが必要です")
 
-    url = f"/uploads/{filename}"
+    await run_in_threadpool(_load_upload, upload_id, user.id)
+    async with _upload_lock(upload_id):
+        up = await run_in_threadpool(_load_locked_upload, upload_id, user.id)
+        if up.photo_id is not None:
+            # 完了済み（最後のチャンクの応答が届かず再送された等）→ 同じ結果を返す
+            with Session(engine) as s:
+                p = s.get(Photo, up.photo_id)
+            return {**_upload_state(up, up.size), "url": p.url if p else None, "id": up.photo_id}
 
-    with Session(engine) as s:
-        p = Photo(user_id=user.id, place_id=place_id, filename=filename, url=url)
-        s.add(p); s.commit(); s.refresh(p)
+        current = _partial_size(upload_id)
+        if offset != current:
+            return JSONResponse(
+                {"ok": False, "detail": "Upload-Offset が一致しません", "offset": current, "size": up.size},
+                status_code=409,
+            )
 
-    return {"ok": True, "url": url, "id": p.id}
+        current += await _append_body(request, upload_id, current, up.size - current)
+        if current < up.size:
+            await run_in_threadpool(_touch_upload, upload_id)
+            return _upload_state(up, current)
+
+        # 全部そろった → Photo を作る（.part は blob に移動 or 重複なら削除される）
+        path = _partial_path(upload_id)
+        digest = await run_in_threadpool(_hash_file, path)
+        p = await _finish_photo(user.id, up.place_id, path, digest, up.ext, up.size)
+        await run_in_threadpool(_touch_upload, upload_id, p.id)
+        up.photo_id = p.id
+    _upload_locks.pop(upload_id, None)
+    return {**_upload_state(up, up.size), "url": p.url, "id": p.id}
+
+@router.delete("/api/photos/uploads/{upload_id}")
+async def cancel_photo_upload(upload_id: str, request: Request):
+    user = get_current_user(request)
+    login_required(user)
+    await run_in_threadpool(_load_upload, upload_id, user.id)
+    async with _upload_lock(upload_id):
+        up = await run_in_threadpool(_load_locked_upload, upload_id, user.id)
+        with Session(engine) as s:
+            row = s.get(PhotoUpload, up.id)
+            if row:
+                s.delete(row); s.commit()
+        if up.photo_id is None:
+            _unlink_quiet(_partial_path(upload_id))
+    _upload_locks.pop(upload_id, None)
+    return {"ok": True}
 
 # ===== Check-in =====
 from pydantic import BaseModel
@@ -1,10 +1,22 @@
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from typing import Optional, List
 
 from sqlmodel import SQLModel, Field, create_engine, Session, select, Relationship
+from sqlalchemy import UniqueConstraint, Index, func, event, inspect, text
+
+from config import LOCAL_UTC_OFFSET_HOURS
 
 # SQLite エンジン
 engine = create_engine("sqlite:///./nonoji.db", echo=False)
+
+@event.listens_for(engine, "connect")
+def _sqlite_wal(dbapi_conn, _record):
+    # WAL: 読み取りが長く続いても（ストリーミングのエクスポート等）書き込みを止めない。
+    # 既定のロールバックジャーナルだと読み取り中は SHARED ロックが残り、チェックイン等が database is locked になる
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.close()
+
 # ===== Models =====
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -25,17 +37,96 @@ class User(SQLModel, table=True):
     king_cleared_at: Optional[datetime] = None    
     app_feedbacks: List["AppFeedback"] = Relationship(back_populates="user")
     
+class Place(SQLModel, table=True):
+    """
+    施設ディメンション。Stamp は施設の文字列を持たず、この id（place_ref）で参照する。
+    カタログ CSV から places.sync_places が同期し、カタログに無い地点はチェックイン時に追加される。
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    place_id: str = Field(index=True, unique=True)        # カタログ／クライアントの施設ID（Comment 等と同じ）
+    name: str = ""
+    kind: str = Field(default="地点", index=True)          # 公園/公共施設/地点 等
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    source: Optional[str] = Field(default=None, max_length=16)   # "local" / "nagano"（None はチェックインで追加）
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class Stamp(SQLModel, table=True):
+    __table_args__ = (
+        # 時間帯フィルタ（local_hour IN (...)）+ 期間（checked_at）をインデックスで引く用
+        Index("ix_stamp_local_hour_checked_at", "local_hour", "checked_at"),
+        # チェックインのクールダウン判定用
+        Index("ix_stamp_user_place_checked_at", "user_id", "place_ref", "checked_at"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(index=True)
-    place_id: str = Field(index=True)
-    place_name: str
-    kind: str
+    place_ref: int = Field(foreign_key="place.id", index=True)   # Place.id（施設名・種別は Place 側）
     lat: float
     lon: float
     checked_at: datetime = Field(default_factory=datetime.utcnow)
+    # ★ 現地時間（日本時間）での日付・時・曜日（月=0）。挿入時に checked_at から入る（_stamp_local_time）
+    local_date: Optional[date] = Field(default=None, index=True)
+    local_hour: Optional[int] = Field(default=None)
+    local_weekday: Optional[int] = Field(default=None)
+    # ★ チェックインした時点の User.age_group（未設定・ゲストは "unknown"）。
+    #   あとで年代を変えても過去のチェックインの年代は変わらない（ロールアップと食い違わない）
+    age_group: Optional[str] = Field(default=None, max_length=16)
+
+LOCAL_OFFSET = timedelta(hours=LOCAL_UTC_OFFSET_HOURS)
+
+def local_parts(ts: datetime):
+    """UTC（naive）の時刻 → 現地時間の (日付, 時, 曜日)"""
+    lt = ts + LOCAL_OFFSET
+    return lt.date(), lt.hour, lt.weekday()
+
+@event.listens_for(Stamp, "before_insert")
+def _stamp_local_time(mapper, connection, target):
+    if target.checked_at is None:
+        target.checked_at = datetime.utcnow()
+    target.local_date, target.local_hour, target.local_weekday = local_parts(target.checked_at)
+    target.age_group = target.age_group or "unknown"
+
+class CheckinHourly(SQLModel, table=True):
+    """
+    Stamp の 1 時間ごとの集計（analytics 用ロールアップ）。rollups.refresh_rollups が
+    RollupWatermark より後の Stamp だけを足し込んで作る。hour は checked_at と同じ UTC の「時」の頭。
+    施設名・種別は Place を place_ref で引く。
+    """
+    __table_args__ = (
+        UniqueConstraint("hour", "place_ref", "age_group"),
+        Index("ix_checkinhourly_local_hour_hour", "local_hour", "hour"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    hour: datetime = Field(index=True)
+    local_date: Optional[date] = Field(default=None, index=True)   # hour を現地時間にしたもの
+    local_hour: Optional[int] = Field(default=None)
+    local_weekday: Optional[int] = Field(default=None)
+    place_ref: int = Field(index=True)
+    age_group: str = Field(default="unknown", max_length=16)   # Stamp.age_group（チェックイン時点の年代）
+    count: int = 0
+    first_at: datetime                                        # その時間内で最初／最後のチェックイン
+    last_at: datetime
+
+class RollupWatermark(SQLModel, table=True):
+    """ロールアップに取り込み済みの Stamp.id（name ごと）"""
+    name: str = Field(primary_key=True, max_length=32)
+    last_id: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class UserPlace(SQLModel, table=True):
+    """
+    ユーザーごとのチェックイン済み施設（重複なし）。
+    id は単調増加なので /api/checkins/places の差分同期カーソルに使う。
+    """
+    __table_args__ = (UniqueConstraint("user_id", "place_id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    place_id: str = Field(max_length=128)
+    first_checked_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Photo(SQLModel, table=True):
+    # 地点ごとの新しい順ページング（created_at, id のキーセット）用
+    __table_args__ = (Index("ix_photo_place_created_id", "place_id", "created_at", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(index=True)
     place_id: str = Field(index=True)
@@ -43,6 +134,52 @@ class Photo(SQLModel, table=True):
     url: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class PhotoVariant(SQLModel, table=True):
+    """
+    Photo の縮小版（MediaBlob 導入前にアップロードされた写真用）。
+    size は長辺ピクセル、fmt は "webp" / "jpeg"。
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    photo_id: int = Field(index=True)
+    size: int
+    fmt: str = Field(max_length=8)
+    url: str
+    width: int
+    height: int
+
+class MediaBlob(SQLModel, table=True):
+    """
+    アップロード実体（SHA-256 で一意）。UPLOAD_DIR/blobs/ab/cd/<sha256><ext> に置く。
+    同じ内容のアップロードはこの 1 行（1 ファイル）を共有する。
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sha256: str = Field(index=True, unique=True, max_length=64)
+    ext: str = Field(max_length=8)
+    size: int
+    rel_path: str                                   # UPLOAD_DIR からの相対パス
+    variants_json: Optional[str] = None             # 縮小版一覧（thumbnails.py が書く JSON）
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class PhotoBlob(SQLModel, table=True):
+    """Photo → MediaBlob の参照"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    photo_id: int = Field(index=True, unique=True)
+    blob_id: int = Field(index=True)
+
+class PhotoUpload(SQLModel, table=True):
+    """
+    再開可能アップロードのセッション（完了・放置されたものは gc_stale_uploads が消す）。
+    受信済みバイト数は UPLOAD_DIR/.partial/<id>.part のファイルサイズそのもの。
+    """
+    id: str = Field(primary_key=True, max_length=32)  # 推測されにくいランダム ID
+    user_id: int = Field(index=True)
+    place_id: str
+    ext: str = Field(max_length=8)
+    size: int                                        # 予告された総バイト数
+    photo_id: Optional[int] = None                   # 完了後に作られた Photo（最後のチャンクの再送に同じ結果を返す）
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)  # 最後にチャンクを受けた時刻（GC 用）
+
 class OAuthAccount(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     provider: str = Field(index=True)   # "google" / "line"
@@ -52,6 +189,141 @@ class OAuthAccount(SQLModel, table=True):
 
 def on_startup():
     SQLModel.metadata.create_all(engine)
+    migrate_stamp_place_ref()
+    ensure_columns()
+    ensure_indexes()
+    backfill_local_time()
+    backfill_stamp_age_group()
+    ensure_views()
+    backfill_user_places()
+
+def migrate_stamp_place_ref():
+    """
+    旧スキーマ（stamp に place_id / place_name / kind の文字列を持つ）からの移行。
+    施設を Place に登録し、stamp を place_ref（整数）の列構成で作り直す
+    （SQLite はインデックス付きの列を落とせないので、作り直してコピー）。
+    ロールアップは派生データなので捨てて作り直す（次の refresh_rollups で全履歴から）。
+    """
+    insp = inspect(engine)
+    stamp_cols = {c["name"] for c in insp.get_columns("stamp")}
+    hourly_old = "place_id" in {c["name"] for c in insp.get_columns("checkinhourly")}
+    if "place_name" not in stamp_cols and not hourly_old:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("DROP VIEW IF EXISTS stamp_flat"))
+        if "place_name" in stamp_cols:
+            conn.execute(text(
+                "INSERT OR IGNORE INTO place (place_id, name, kind, lat, lon, updated_at)"
+                " SELECT place_id, max(place_name), max(kind), max(lat), max(lon), CURRENT_TIMESTAMP"
+                " FROM stamp GROUP BY place_id"
+            ))
+            for idx in insp.get_indexes("stamp"):
+                conn.execute(text(f'DROP INDEX IF EXISTS "{idx["name"]}"'))
+            conn.execute(text("ALTER TABLE stamp RENAME TO stamp_old"))
+            Stamp.__table__.create(conn)
+            local = "s.local_date, s.local_hour, s.local_weekday" if "local_hour" in stamp_cols else "NULL, NULL, NULL"
+            n = conn.execute(text(
+                "INSERT INTO stamp (id, user_id, place_ref, lat, lon, checked_at, local_date, local_hour, local_weekday)"
+                f" SELECT s.id, s.user_id, p.id, s.lat, s.lon, s.checked_at, {local}"
+                " FROM stamp_old s JOIN place p ON p.place_id = s.place_id"
+            )).rowcount
+            conn.execute(text("DROP TABLE stamp_old"))
+            print(f"[models] migrated {n} stamps to place_ref")
+        conn.execute(text("DROP TABLE IF EXISTS checkinhourly"))
+        conn.execute(text("DELETE FROM rollupwatermark"))
+        CheckinHourly.__table__.create(conn)
+    # 作り直しで空いたページを返す
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+
+def ensure_views():
+    """
+    旧 stamp と同じ列（place_id / place_name / kind 付き）で読める互換ビュー stamp_flat。
+    DB を直接読むエクスポート・外部ツール向け。
+    """
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE VIEW IF NOT EXISTS stamp_flat AS"
+            " SELECT s.id, s.user_id, p.place_id, p.name AS place_name, p.kind,"
+            " s.lat, s.lon, s.checked_at, s.local_date, s.local_hour, s.local_weekday"
+            " FROM stamp s JOIN place p ON p.id = s.place_ref"
+        ))
+
+def ensure_columns():
+    """
+    create_all は既存テーブルに後から足した列を作らないので、
+    モデルにあってテーブルに無い列を ALTER TABLE ADD COLUMN で足す（NULL 可の列だけ）。
+    """
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in have or not column.nullable:
+                    continue
+                ctype = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {ctype}'))
+                print(f"[models] added column {table.name}.{column.name}")
+
+def backfill_local_time():
+    """local_date / local_hour / local_weekday が空の行（列追加前のデータ）を checked_at / hour から埋める"""
+    shift = f"{LOCAL_UTC_OFFSET_HOURS:+d} hours"
+    with engine.begin() as conn:
+        for table, ts in (("stamp", "checked_at"), ("checkinhourly", "hour")):
+            conn.execute(text(
+                f"UPDATE {table} SET"
+                f" local_date = date({ts}, :shift),"
+                f" local_hour = CAST(strftime('%H', {ts}, :shift) AS INTEGER),"
+                f" local_weekday = (CAST(strftime('%w', {ts}, :shift) AS INTEGER) + 6) % 7"
+                f" WHERE local_hour IS NULL"
+            ), {"shift": shift})
+
+def backfill_stamp_age_group():
+    """
+    age_group が空の Stamp（列追加前のデータ）を今の User.age_group で埋める。
+    それまでのロールアップは「取り込んだ時点の」User.age_group で数えていたので、捨てて作り直させる。
+    """
+    with engine.begin() as conn:
+        n = conn.execute(text(
+            'UPDATE stamp SET age_group = COALESCE('
+            '(SELECT "user".age_group FROM "user" WHERE "user".id = stamp.user_id), \'unknown\')'
+            ' WHERE age_group IS NULL'
+        )).rowcount
+        if n:
+            conn.execute(text("DELETE FROM checkinhourly"))
+            conn.execute(text("DELETE FROM rollupwatermark"))
+            print(f"[models] backfilled age_group on {n} stamps; rollups will be rebuilt")
+
+def ensure_indexes():
+    """
+    create_all は既存テーブルに後から足したインデックスを作らないので、
+    モデルに定義されたインデックスを（無ければ）ここで作る。
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        for idx in table.indexes:
+            idx.create(engine, checkfirst=True)
+
+def backfill_user_places():
+    """
+    UserPlace が空で Stamp がある場合だけ、既存チェックイン履歴から一括作成する。
+    （テーブル追加前のデータ向け。2回目以降の起動では何もしない）
+    """
+    with Session(engine) as s:
+        if s.exec(select(func.count(UserPlace.id))).one():
+            return
+        rows = s.exec(
+            select(Stamp.user_id, Place.place_id, func.min(Stamp.checked_at))
+            .join(Place, Place.id == Stamp.place_ref)
+            .group_by(Stamp.user_id, Place.place_id)
+            .order_by(func.min(Stamp.checked_at))
+        ).all()
+        for uid, pid, first in rows:
+            if pid is None:
+                continue
+            s.add(UserPlace(user_id=uid, place_id=str(pid), first_checked_at=first))
+        s.commit()
 
 # ▼ models.py 追記（末尾あたりに）
 class Character(SQLModel, table=True):
@@ -71,11 +343,13 @@ class UserCharacter(SQLModel, table=True):
     obtained_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Comment(SQLModel, table=True):
+    # スレッド表示: 地点のトップレベルコメントを新しい順にキーセットで取る用
+    __table_args__ = (Index("ix_comment_place_parent_created_id", "place_id", "parent_id", "created_at", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(index=True)
     place_id: str = Field(index=True, max_length=128)  # 施設ID（既存の place_id と合わせる）
     content: str = Field(max_length=500)
-    parent_id: Optional[int] = Field(default=None, foreign_key="comment.id")
+    parent_id: Optional[int] = Field(default=None, foreign_key="comment.id", index=True)  # 返信ツリーをたどる用
     created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     
 class UserQuestion(SQLModel, table=True):
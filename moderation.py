@@ -0,0 +1,216 @@
+# moderation.py — NG ワードフィルタ（コメント・クイズチャット用）
+#
+# NG ワードは NG_WORDS_PATH（既定 data/ng_words.txt, 1行1語, # 以降はコメント）から読み、
+# Aho-Corasick オートマトンにまとめて、メッセージを 1 回なめるだけで全 NG ワードを探す
+# （語数が増えても 1 メッセージあたりの時間はほぼ文字数だけで決まる）。
+#
+# 照合の前に正規化する:
+#   - NFKC（全角英数→半角、半角カナ→全角、濁点の合成など）
+#   - 英字は小文字、カタカナはひらがなに寄せる（「シネ」「ｼﾈ」「しね」を同じに扱う）
+#   - 空白や「・」などの区切り記号は読み飛ばす（「し ね」「し・ね」もヒット）
+# ヒット位置は元の文字列の位置に戻せるので、伏せ字（mask）にも使える。
+#
+# ファイルの更新時刻を RELOAD_CHECK_SEC ごとに見て、変わっていれば作り直す（再起動不要）。
+import os
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import List, Optional, Tuple
+
+from config import NG_WORDS_PATH
+
+RELOAD_CHECK_SEC = 5.0
+MASK_CHAR = "＊"
+# 読み飛ばす文字（単語の間に挟んで回避されやすいもの）
+SKIP_CHARS = set(" \t\r\n　・･.,、。_-*~〜!！?？/／|｜")
+
+_KATA_START, _KATA_END = ord("ァ"), ord("ヶ")
+
+
+def _fold_char(ch: str) -> str:
+    """正規化済みの 1 文字を照合用に寄せる（小文字化・カタカナ→ひらがな）"""
+    o = ord(ch)
+    if _KATA_START <= o <= _KATA_END:
+        return chr(o - 0x60)
+    return ch.lower()
+
+
+def normalize(text: str) -> Tuple[str, List[int]]:
+    """
+    照合用の文字列と、その各文字が元の text の何文字目から来たかの対応表を返す。
+    1文字が複数文字になる（㍻→平成）・濁点が前の文字に合成される（ｶﾞ→ガ）場合も対応表でたどれる。
+    """
+    out: List[str] = []
+    src: List[int] = []
+    for i, ch in enumerate(text):
+        for n in unicodedata.normalize("NFKC", ch):
+            if n in SKIP_CHARS:
+                continue
+            if unicodedata.combining(n) and out:
+                # 半角の濁点・半濁点は直前の文字と合成する（か＋゛→が）
+                composed = unicodedata.normalize("NFC", out[-1] + n)
+                if len(composed) == 1:
+                    out[-1] = _fold_char(composed)
+                    continue
+            out.append(_fold_char(n))
+            src.append(i)
+    return "".join(out), src
+
+
+class AhoCorasick:
+    """複数パターンの同時照合。build は O(総文字数)、search は O(テキスト長 + ヒット数)"""
+
+    def __init__(self, patterns: List[str]):
+        self._goto: List[dict] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]   # ノードで終わるパターンの長さ
+        for p in patterns:
+            self._add(p)
+        self._build()
+
+    def _add(self, pattern: str):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        if len(pattern) not in self._out[node]:
+            self._out[node].append(len(pattern))
+
+    def _build(self):
+        # 幅優先で失敗リンクを張り、失敗先のヒットも引き継ぐ
+        q = deque([0])
+        while q:
+            node = q.popleft()
+            for ch, nxt in self._goto[node].items():
+                q.append(nxt)
+                if node == 0:
+                    self._fail[nxt] = 0
+                else:
+                    f = self._fail[node]
+                    while f and ch not in self._goto[f]:
+                        f = self._fail[f]
+                    self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text: str) -> List[Tuple[int, int]]:
+        """ヒットした (開始, 終了) の一覧（text 上の位置, 終了は含まない）"""
+        hits = []
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length in out[node]:
+                hits.append((i - length + 1, i + 1))
+        return hits
+
+    def __len__(self):
+        return len(self._goto)
+
+
+def load_words(path: str) -> List[str]:
+    words = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                w = line.split("#", 1)[0].strip()
+                if w:
+                    norm, _ = normalize(w)
+                    if norm:
+                        words.append(norm)
+    except FileNotFoundError:
+        pass
+    return sorted(set(words))
+
+
+class ContentFilter:
+    def __init__(self, path: str):
+        self.path = path
+        self._automaton: Optional[AhoCorasick] = None
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.words = 0
+        self.reloads = 0
+        # 1 メッセージあたりの照合時間
+        self.checked = 0
+        self.flagged = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def _current(self) -> AhoCorasick:
+        now = time.monotonic()
+        if self._automaton is not None and now < self._next_check:
+            return self._automaton
+        with self._lock:
+            if self._automaton is not None and now < self._next_check:
+                return self._automaton
+            self._next_check = now + RELOAD_CHECK_SEC
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if self._automaton is None or mtime != self._mtime:
+                words = load_words(self.path)
+                self._automaton = AhoCorasick(words)
+                self._mtime = mtime
+                self.words = len(words)
+                self.reloads += 1
+                print(f"[moderation] loaded {len(words)} NG words from {self.path}")
+            return self._automaton
+
+    def find(self, text: str) -> List[Tuple[int, int]]:
+        """NG ワードに当たった元の text 上の (開始, 終了) 一覧"""
+        ac = self._current()
+        t0 = time.perf_counter_ns()
+        norm, src = normalize(text)
+        # 終了位置は「次の照合文字の元位置」まで広げる（合成された濁点なども含めて伏せる）
+        spans = [
+            (src[s], max(src[e - 1] + 1, src[e] if e < len(src) else len(text)))
+            for s, e in ac.search(norm)
+        ]
+        dt = time.perf_counter_ns() - t0
+        self.checked += 1
+        self.total_ns += dt
+        if dt > self.max_ns:
+            self.max_ns = dt
+        if spans:
+            self.flagged += 1
+        return spans
+
+    def contains(self, text: str) -> bool:
+        return bool(self.find(text))
+
+    def mask(self, text: str) -> str:
+        """NG ワードの部分を伏せ字にした文字列"""
+        spans = self.find(text)
+        if not spans:
+            return text
+        chars = list(text)
+        for s, e in spans:
+            for i in range(s, e):
+                if chars[i] not in SKIP_CHARS:
+                    chars[i] = MASK_CHAR
+        return "".join(chars)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "words": self.words,
+            "reloads": self.reloads,
+            "checked": self.checked,
+            "flagged": self.flagged,
+            "avg_us": round(self.total_ns / self.checked / 1000, 1) if self.checked else None,
+            "max_us": round(self.max_ns / 1000, 1),
+        }
+
+
+CONTENT_FILTER = ContentFilter(NG_WORDS_PATH)
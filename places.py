@@ -0,0 +1,110 @@
+# places.py — 施設ディメンション（Place）の同期と、place_id（文字列）→ Place.id の引き当て
+#
+# Stamp は施設を Place.id（place_ref）で参照する。
+#   - sync_places(): 起動時にカタログ CSV（data_csv と同じもの）の名称・種別・座標を Place に反映
+#   - place_refs(): チェックイン時に place_id → Place.id。カタログに無い地点はその場で Place に追加
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from config import NAGANO_FAC_CSV, NAGANO_PARK_CSV
+from models import engine, Place
+
+UPSERT_CHUNK = 500
+
+
+def _catalog_rows() -> list:
+    # 遅延 import（data_csv は numpy などを読むので起動時の import 順に依存させない）
+    from data_csv import _load_main_csv, _load_nagano_csv
+
+    rows: Dict[str, dict] = {}
+    # 後に入れたものが勝つ: 長野の CSV → メインの CSV
+    sources = [
+        ("nagano", lambda: _load_nagano_csv(NAGANO_FAC_CSV, "公共施設")),
+        ("nagano", lambda: _load_nagano_csv(NAGANO_PARK_CSV, "公園")),
+        ("local", _load_main_csv),
+    ]
+    for source, load in sources:
+        try:
+            items = load()
+        except Exception as e:   # CSV が無い環境でも起動は止めない
+            print(f"[places] catalog load error ({source}):", repr(e))
+            continue
+        for x in items:
+            rows[str(x["id"])] = {
+                "place_id": str(x["id"]),
+                "name": x.get("name") or "",
+                "kind": x.get("kind") or "地点",
+                "lat": x.get("lat"),
+                "lon": x.get("lon"),
+                "source": source,
+            }
+    return list(rows.values())
+
+
+def sync_places() -> int:
+    """カタログの施設を Place に追加・更新する（変わっていない行は書かない）。書いた行数を返す"""
+    rows = _catalog_rows()
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    for r in rows:
+        r["updated_at"] = now
+    table = Place.__table__
+    stmt = sqlite_insert(table)
+    ex = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["place_id"],
+        set_={"name": ex.name, "kind": ex.kind, "lat": ex.lat, "lon": ex.lon,
+              "source": ex.source, "updated_at": ex.updated_at},
+        where=or_(
+            table.c.name != ex.name, table.c.kind != ex.kind,
+            table.c.lat.is_distinct_from(ex.lat), table.c.lon.is_distinct_from(ex.lon),
+            table.c.source.is_distinct_from(ex.source),
+        ),
+    )
+    written = 0
+    with Session(engine) as s:
+        for i in range(0, len(rows), UPSERT_CHUNK):
+            written += s.execute(stmt, rows[i:i + UPSERT_CHUNK]).rowcount
+        s.commit()
+    print(f"[places] synced catalog: {len(rows)} places, {written} written")
+    return written
+
+
+def place_refs(session: Session, places: Dict[str, Tuple[str, Optional[str], float, float]]) -> Dict[str, int]:
+    """
+    {place_id: (name, kind, lat, lon)} → {place_id: Place.id}。
+    Place に無いものは渡された名称・種別で追加する（commit は呼び出し側）。
+    """
+    ids = list(places)
+    refs = _lookup(session, ids)
+    missing = [pid for pid in ids if pid not in refs]
+    if missing:
+        now = datetime.utcnow()
+        session.execute(
+            sqlite_insert(Place.__table__).on_conflict_do_nothing(),
+            [
+                {"place_id": pid, "name": places[pid][0] or "", "kind": places[pid][1] or "地点",
+                 "lat": places[pid][2], "lon": places[pid][3], "updated_at": now}
+                for pid in missing
+            ],
+        )
+        refs.update(_lookup(session, missing))
+    return refs
+
+
+def place_ref(session: Session, place_id: str, name: str, kind: Optional[str], lat: float, lon: float) -> int:
+    return place_refs(session, {place_id: (name, kind, lat, lon)})[place_id]
+
+
+def place_refs_of_kind(kind: str):
+    """種別 → Place.id のサブクエリ（集計側は整数の place_ref で絞る）"""
+    return select(Place.id).where(Place.kind == kind)
+
+
+def _lookup(session: Session, place_ids: Iterable[str]) -> Dict[str, int]:
+    return dict(session.exec(select(Place.place_id, Place.id).where(Place.place_id.in_(list(place_ids)))).all())
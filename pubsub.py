@@ -0,0 +1,96 @@
+# pubsub.py — チャンネル（place_id など）ごとのプロセス内 pub/sub（SSE 配信用）
+#
+#   HUB = Hub("comments")
+#   async with HUB.subscribe(place_id) as q:      # 購読（SSE のハンドラ側）
+#       frame = await q.get()                     # エンコード済みの SSE フレーム（bytes）
+#   HUB.publish(place_id, "comment", {...})       # 配信（sync の API ハンドラからも呼べる）
+#
+#   - 1 回の publish で JSON → SSE フレームへのエンコードは 1 回だけ。各購読者には同じ bytes を渡す
+#   - 購読者が居ないチャンネルは辞書から消す（アイドルのチャンネルが溜まらない）
+#   - 受け取りが追いつかない購読者（キューが一杯）は切断する（None を送る）
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set
+
+QUEUE_MAX = 100          # 購読者ごとに溜められるフレーム数
+MAX_SUBSCRIBERS = 5000   # プロセス全体の同時購読数
+
+
+def sse_frame(event: str, data) -> bytes:
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class Hub:
+    def __init__(self, name: str):
+        self.name = name
+        self._channels: Dict[str, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers = 0
+        self.published = 0
+        self.dropped = 0
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        if self.subscribers >= MAX_SUBSCRIBERS:
+            raise OverflowError(f"{self.name}: too many subscribers")
+        self._loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        self._channels.setdefault(channel, set()).add(q)
+        self.subscribers += 1
+        try:
+            yield q
+        finally:
+            subs = self._channels.get(channel)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._channels[channel]
+            self.subscribers -= 1
+
+    def _fanout(self, channel: str, frame: bytes):
+        # イベントループ上で呼ぶ
+        subs = self._channels.get(channel)
+        if not subs:
+            return
+        for q in list(subs):
+            try:
+                q.put_nowait(frame)
+            except asyncio.QueueFull:
+                # 遅い購読者は切る（クライアントは EventSource の再接続で取り直す）
+                subs.discard(q)
+                self.dropped += 1
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(None)
+        if not subs:
+            self._channels.pop(channel, None)
+        self.published += 1
+
+    def publish(self, channel: str, event: str, data):
+        """
+        channel の購読者全員に配信する。スレッドプール（sync の def エンドポイント）からでもよい。
+        購読者が居なければエンコードもしない。
+        """
+        loop = self._loop
+        if loop is None or channel not in self._channels:
+            return
+        frame = sse_frame(event, data)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._fanout(channel, frame)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(self._fanout, channel, frame)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "channels": len(self._channels),
+            "subscribers": self.subscribers,
+            "published": self.published,
+            "dropped": self.dropped,
+        }
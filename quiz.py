@@ -10,6 +10,7 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Request, HTTPExce
 from fastapi.responses import HTMLResponse
 from starlette.websockets import WebSocketState
 from fastapi.templating import Jinja2Templates
+from assets import install_template_helpers
 import glob,time,os
 from pathlib import Path
 from auth import get_current_user, login_required
@@ -20,16 +21,23 @@ from sqlmodel import Session, select
 from models import engine, Character, UserCharacter
 from datetime import datetime  # ★ 追加
 from models import User, FacilityStat, CityStat 
+from assets import stamp_key_url, stamp_atlas
+from ratelimit import RateLimiter
+from moderation import CONTENT_FILTER
 
 STAMP_COOLDOWN_SEC     = 1   # 同一ユーザーの連打を抑制
 STAMP_MAX_PER_ROUND    = 100     # 1ラウンドに送れる上限
+# WebSocket メッセージのレート制限（ユーザーごとのトークンバケット）
+CHAT_LIMIT  = RateLimiter("quiz_chat", rate=1, burst=5)    # 5 連続まで、以降 1 秒に 1 件
+BUZZ_LIMIT  = RateLimiter("quiz_buzz", rate=2, burst=3)
+STAMP_LIMIT = RateLimiter("quiz_stamp", rate=1 / STAMP_COOLDOWN_SEC, burst=3)
 BASE_DIR = Path(__file__).resolve().parent  # quiz.pyの場所
 # staticがプロジェクト直下なら parent を調整してください
 # STAMP_DIR = str((BASE_DIR.parent / "static" / "stamp").resolve())
 # STAMP_ALLOW_EXTS       = {".png", ".webp", ".gif"}        # 許可拡張子
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+templates = install_template_helpers(Jinja2Templates(directory="templates"))
 
 NEEDED_PLAYERS = 4         # 目標人数（ここまでCPUで補充）
 CPU_CORRECT_PROB = 0.25    # CPUの正解確率
@@ -1344,7 +1352,14 @@ async def api_quiz_stamps(request: Request):
                     names.append(base)
 
         names.sort()
-        return {"ok": True, "stamps": names}
+        # urls: 縮小版（build_assets.py）の URL。未ビルドなら /static/stamp/{key}
+        # atlas: ピッカー用に全スタンプを 1 枚にまとめた画像と、使えるスタンプのコマ位置（未ビルドなら null）
+        return {
+            "ok": True,
+            "stamps": names,
+            "urls": {n: stamp_key_url(n) for n in names},
+            "atlas": stamp_atlas(names),
+        }
     except Exception as e:
         return {"ok": False, "stamps": [], "error": str(e)}
 
@@ -1478,12 +1493,21 @@ async def ws_quiz(websocket: WebSocket, code: str):
             elif t == "chat":
                 msg = str(data.get("msg", "")).strip()[:200]
                 if msg:
+                    if CHAT_LIMIT.hit(user_id):
+                        await websocket.send_json({"type": "error", "msg": "チャットの送信が速すぎます。"})
+                        continue
+                    msg = CONTENT_FILTER.mask(msg)  # NG ワードは伏せ字にして流す
                     await room.broadcast({"type": "chat", "user_id": user_id, "name": name, "msg": msg})
 
             elif t == "buzz":
+                if BUZZ_LIMIT.hit(user_id):
+                    continue  # 連打は黙って捨てる
                 await room.broadcast({"type": "buzz", "user_id": user_id, "name": name})
 # WebSocket ハンドラ内の message 分岐に「stamp」を追加
             elif t == "stamp":
+                # 連打は DB（使えるスタンプの確認）に行く前に捨てる
+                if STAMP_LIMIT.hit(user_id):
+                    continue
                 key = str(data.get("key") or "").strip()
                 base = os.path.basename(key)
                 ext = os.path.splitext(base)[1].lower()
@@ -1527,7 +1551,8 @@ async def ws_quiz(websocket: WebSocket, code: str):
                     "type": "stamp",
                     "user_id": user_id,
                     "name": name,
-                    "key": base,   # クライアントは /static/stamp/{key} で取得
+                    "key": base,
+                    "url": stamp_key_url(base),   # 無い古いクライアントは /static/stamp/{key}
                 })
 
             else:
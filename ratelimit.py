@@ -0,0 +1,162 @@
+# ratelimit.py — トークンバケット方式のレート制限
+#
+#   COMMENT_LIMIT = RateLimiter("comment", rate=0.1, burst=1)   # 10秒に1回
+#   enforce(COMMENT_LIMIT, user.id, "連続投稿は少し時間をおいてください")   # 超えたら 429
+#
+# 既定ではプロセス内のメモリにバケットを持つ（DB へのクエリ無し）。
+# uvicorn を複数ワーカーで動かすときは RATE_LIMIT_REDIS_URL を設定すると
+# Redis 上の共有バケットを使う（redis パッケージが必要。無ければメモリ版のまま）。
+import math
+import threading
+import time
+from typing import Hashable
+
+from fastapi import HTTPException
+
+from config import RATE_LIMIT_REDIS_URL
+
+try:
+    import redis
+except ImportError:  # redis 無しならメモリ版だけ
+    redis = None
+
+CLEANUP_INTERVAL_SEC = 60.0
+
+
+class MemoryBackend:
+    """
+    key → (残りトークン, 最終更新時刻, 満タンに戻る時刻)。
+    満タンに戻ったバケットは「無いのと同じ」なので定期的に消す（メモリが増え続けない）。
+    """
+
+    def __init__(self):
+        self._buckets: dict = {}
+        self._lock = threading.Lock()
+        self._next_cleanup = time.monotonic() + CLEANUP_INTERVAL_SEC
+
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            if tokens >= cost:
+                tokens = min(burst, tokens - cost)   # cost < 0 は払い戻し
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if now >= self._next_cleanup:
+                self._cleanup(now)
+        return wait
+
+    def _cleanup(self, now: float):
+        # ロック内で呼ぶ
+        full = [k for k, (_, _, full_at) in self._buckets.items() if full_at <= now]
+        for k in full:
+            del self._buckets[k]
+        self._next_cleanup = now + CLEANUP_INTERVAL_SEC
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBackend:
+    """複数ワーカーで共有するバケット。判定は Lua スクリプトで 1 往復・原子的に行う"""
+
+    _SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't'))
+local ts = tonumber(redis.call('HGET', KEYS[1], 'ts'))
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+if tokens == nil then tokens = burst; ts = now end
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= cost then tokens = math.min(burst, tokens - cost) else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        return float(self._script(keys=[f"rl:{key}"], args=[rate, burst, cost, time.time()]))
+
+
+def _make_backend():
+    if RATE_LIMIT_REDIS_URL and redis is not None:
+        try:
+            backend = RedisBackend(RATE_LIMIT_REDIS_URL)
+            backend._client.ping()
+            print("[ratelimit] using redis backend")
+            return backend
+        except Exception as e:
+            print("[ratelimit] redis unavailable, falling back to memory:", repr(e))
+    elif RATE_LIMIT_REDIS_URL:
+        print("[ratelimit] RATE_LIMIT_REDIS_URL is set but redis is not installed; using memory")
+    return MemoryBackend()
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = _make_backend()
+    return _backend
+
+
+class RateLimiter:
+    """
+    rate: 1秒あたりに回復するトークン数 / burst: バケットの容量（連続で許す回数）。
+    hit() は許可なら 0、超過なら「あと何秒待てばよいか」を返す。
+    """
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+
+    def hit(self, key: Hashable, cost: float = 1.0) -> float:
+        try:
+            wait = get_backend().take(f"{self.name}:{key}", self.rate, self.burst, cost)
+        except Exception as e:
+            # 共有バックエンドの障害でサービスを止めない（制限なしで通す）
+            print(f"[ratelimit] {self.name} backend error:", repr(e))
+            wait = 0.0
+        if wait > 0:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def refund(self, key: Hashable, cost: float = 1.0):
+        """hit() で取ったトークンを返す（成功した操作は数えない、という使い方）"""
+        try:
+            get_backend().take(f"{self.name}:{key}", self.rate, self.burst, -cost)
+        except Exception as e:
+            print(f"[ratelimit] {self.name} backend error:", repr(e))
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "rate": self.rate,
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+def enforce(limiter: RateLimiter, key: Hashable, detail: str, cost: float = 1.0):
+    """超過していたら Retry-After 付きの 429 を投げる"""
+    wait = limiter.hit(key, cost)
+    if wait > 0:
+        raise HTTPException(429, detail, headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+def client_ip(request) -> str:
+    return request.client.host if request.client else "unknown"
@@ -3,15 +3,17 @@ from datetime import datetime
 from typing import Optional, List, Dict
 
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
+from assets import install_template_helpers
 from sqlmodel import Session, select
 
 from models import engine, RecognitionStat
+from exports import iter_rows, csv_response, columnar_response
 from auth import get_current_user, login_required
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+templates = install_template_helpers(Jinja2Templates(directory="templates"))
 
 
 # === 共通: DB セッション ===
@@ -121,33 +123,23 @@ def recognition_summary(
     }
 
 
-# === 3) CSV ダウンロード (施設 + 市) ===
-@router.get("/api/recognition/export.csv")
-def recognition_export_csv(
-    request: Request,
-    session: Session = Depends(get_session),
-    min_total: int = 3,
-):
-    _require_data_role(request)
+# === 3) CSV / Parquet / Arrow ダウンロード (施設 + 市) ===
+EXPORT_HEADER = ["type", "place_id", "place_name", "city", "correct", "total", "rate"]
+EXPORT_COLUMNS = [
+    ("type", "dict"), ("place_id", "str"), ("place_name", "str"), ("city", "dict"),
+    ("correct", "int"), ("total", "int"), ("rate", "float"),
+]
 
-    rows: List[RecognitionStat] = session.exec(
-        select(RecognitionStat)
-    ).all()
 
-    # 施設行
-    facility_lines = ["type,place_id,place_name,city,correct,total,rate"]
+def export_rows(min_total: int):
+    """施設行を DB から少しずつ読みながら返し、最後に市ごとの合計行を返す（rate は %）"""
+    # 回答 0 件・最低回答数未満の施設は出さない（市の集計にも入れない）
+    stmt = select(RecognitionStat).where(RecognitionStat.total_count >= max(min_total, 1))
     city_map: Dict[str, Dict[str, int]] = {}
-
-    for st in rows:
-        if st.total_count <= 0:
-            continue
-        if st.total_count < min_total:
-            continue
+    for (st,) in iter_rows(stmt):
         rate = (st.correct_count / st.total_count) * 100.0
-        facility_lines.append(
-            f'facility,"{st.place_id}","{st.place_name}","{st.city}",'
-            f'{st.correct_count},{st.total_count},{rate:.2f}'
-        )
+        yield ["facility", st.place_id, st.place_name, st.city or "",
+               st.correct_count, st.total_count, rate]
 
         c = st.city or "不明"
         if c not in city_map:
@@ -162,20 +154,32 @@ def recognition_export_csv(
         if v["total"] < min_total:
             continue
         rate = (v["correct"] / v["total"]) * 100.0
-        facility_lines.append(
-            f'city,,"","{city}",{v["correct"]},{v["total"]},{rate:.2f}'
-        )
+        yield ["city", "", "", city, v["correct"], v["total"], rate]
+
 
-    csv_body = "\n".join(facility_lines)
+def _export_stem() -> str:
+    return f"recognition_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
 
-    # ★★★ ここで UTF-8 BOM を付与 ★★★
-    bom = "\ufeff"
-    csv_with_bom = bom + csv_body
 
-    filename = f"recognition_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
+@router.get("/api/recognition/export.csv")
+def recognition_export_csv(
+    request: Request,
+    min_total: int = 3,
+):
+    _require_data_role(request)
+    return csv_response(
+        _export_stem() + ".csv",
+        EXPORT_HEADER,
+        export_rows(min_total),
+        lambda r: r[:6] + [f"{r[6]:.2f}"],
+    )
+
 
-    return StreamingResponse(
-        iter([csv_with_bom]),
-        media_type="text/csv; charset=utf-8",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-    )
\ No newline at end of file
+@router.get("/api/recognition/export.{fmt}")
+def recognition_export_columnar(
+    fmt: str,
+    request: Request,
+    min_total: int = 3,
+):
+    _require_data_role(request)
+    return columnar_response(fmt, _export_stem(), EXPORT_COLUMNS, export_rows(min_total))
@@ -0,0 +1,184 @@
+# rollups.py — チェックイン集計用のロールアップ（CheckinHourly）の更新と読み出し
+#
+# CheckinHourly には (時, place_ref, age_group) ごとの件数・最初/最後の時刻が入る
+# （age_group は Stamp に入っているチェックイン時点の年代。あとから User 側を変えても変わらない）
+# （施設名・種別は Place 側。集計は整数の place_ref で行い、最後に Place を引く）。
+# Stamp は追記だけ（消さない・書き換えない）なので、RollupWatermark に「どの Stamp.id まで
+# 取り込んだか」を持っておき、refresh_rollups() でそれより後の行だけを GROUP BY して足し込む。
+#   - 起動時に 1 回（初回は既存の全履歴を REFRESH_BATCH 件ずつ取り込む）
+#   - 集計 API の先頭で毎回（前回から増えた分だけなので軽い）
+#
+# 集計 API は checkin_facts() を使う。期間のうち「まるごと入る時間」はロールアップから、
+# 端の半端な時間だけ Stamp から数えるので、時間単位に丸めずに元と同じ結果になる。
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
+
+from sqlalchemy import literal, or_, union_all, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, func, select
+
+from models import engine, Stamp, CheckinHourly, RollupWatermark, local_parts
+
+HOURLY = "checkin_hourly"
+REFRESH_BATCH = 50000   # 1 トランザクションで取り込む Stamp.id の幅
+UPSERT_CHUNK = 500
+
+_refresh_lock = threading.Lock()
+
+
+def _upsert_hourly(s: Session, rows: list):
+    table = CheckinHourly.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["hour", "place_ref", "age_group"],
+        set_={
+            "count": table.c.count + stmt.excluded.count,
+            "first_at": func.min(table.c.first_at, stmt.excluded.first_at),
+            "last_at": func.max(table.c.last_at, stmt.excluded.last_at),
+        },
+    )
+    for i in range(0, len(rows), UPSERT_CHUNK):
+        s.execute(stmt, rows[i:i + UPSERT_CHUNK])
+
+
+def _aggregate(s: Session, lo: int, hi: int) -> list:
+    """Stamp.id が (lo, hi] の行を (時, place_ref, age_group) ごとにまとめる"""
+    hour_key = func.strftime("%Y-%m-%d %H:00:00", Stamp.checked_at)
+    age = func.coalesce(Stamp.age_group, "unknown")
+    q = (
+        select(
+            hour_key, Stamp.place_ref, age, func.count(Stamp.id),
+            func.min(Stamp.checked_at), func.max(Stamp.checked_at),
+        )
+        .where(Stamp.id > lo, Stamp.id <= hi)
+        .group_by(hour_key, Stamp.place_ref, age)
+    )
+    rows = []
+    for h, ref, ag, n, first, last in s.exec(q).all():
+        hour = datetime.fromisoformat(h)
+        local_date, local_hour, local_weekday = local_parts(hour)
+        rows.append({
+            "hour": hour, "place_ref": ref, "age_group": ag, "count": n,
+            "first_at": first, "last_at": last,
+            "local_date": local_date, "local_hour": local_hour, "local_weekday": local_weekday,
+        })
+    return rows
+
+
+def refresh_rollups() -> int:
+    """ウォーターマークより後の Stamp をロールアップに足し込む。取り込んだ Stamp の件数を返す"""
+    added = 0
+    with _refresh_lock, Session(engine) as s:
+        s.execute(
+            sqlite_insert(RollupWatermark.__table__)
+            .values(name=HOURLY, last_id=0, updated_at=datetime.utcnow())
+            .on_conflict_do_nothing()
+        )
+        s.commit()
+        while True:
+            last_id = s.exec(select(RollupWatermark.last_id).where(RollupWatermark.name == HOURLY)).one()
+            max_id = s.exec(select(func.max(Stamp.id))).one() or 0
+            if max_id <= last_id:
+                break
+            hi = min(max_id, last_id + REFRESH_BATCH)
+            rows = _aggregate(s, last_id, hi)
+            _upsert_hourly(s, rows)
+            # 別プロセスが先に同じ範囲を取り込んでいたら二重に数えないよう捨てる
+            res = s.execute(
+                update(RollupWatermark)
+                .where(RollupWatermark.name == HOURLY, RollupWatermark.last_id == last_id)
+                .values(last_id=hi, updated_at=datetime.utcnow())
+            )
+            if res.rowcount != 1:
+                s.rollback()
+                continue
+            s.commit()
+            added += sum(r["count"] for r in rows)
+    return added
+
+
+def rollup_watermark(s: Session) -> int:
+    """ロールアップに取り込み済みの Stamp.id（チェックインが増えると進む。キャッシュのキー用）"""
+    return s.exec(select(RollupWatermark.last_id).where(RollupWatermark.name == HOURLY)).first() or 0
+
+
+def _floor_hour(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(dt: datetime) -> datetime:
+    h = _floor_hour(dt)
+    return h if h == dt else h + timedelta(hours=1)
+
+
+def local_hours(hr) -> Optional[list]:
+    """(a, b) の時間帯 → 含まれる現地時間の「時」の一覧（a > b は日付を跨ぐ。例: 23-5 → 23,0..4）"""
+    if not hr:
+        return None
+    a, b = hr
+    return list(range(a, b)) if a <= b else list(range(a, 24)) + list(range(0, b))
+
+
+def checkin_facts(
+    dt_from: Optional[datetime],
+    dt_to: Optional[datetime],
+    to_inclusive: bool = False,
+    hours: Optional[Sequence[int]] = None,
+):
+    """
+    期間内のチェックインを 1 つのサブクエリにまとめて返す。列:
+      ts（UTC の時刻）, local_date, local_hour（現地時間）, place_ref（Place.id）,
+      age_group, n（件数）, first_at, last_at
+    ロールアップの行（n = その時間の件数）と、期間の端の時間の Stamp の行（n = 1）の UNION ALL。
+    hours を渡すと local_hour IN (...) で各部分を絞る（(local_hour, 時刻) のインデックスが効く）。
+    呼ぶ側は sum(n) / min(first_at) / max(last_at) で集計する。
+    """
+    H = CheckinHourly
+    h_lo = _ceil_hour(dt_from) if dt_from else None
+    h_hi = _floor_hour(dt_to) if dt_to else None
+    if h_lo and h_hi and h_lo > h_hi:
+        h_lo = h_hi = None      # 1 時間に満たない期間は全部 Stamp から
+
+    parts = []
+    edges = []
+    if not (dt_from and dt_to and h_lo is None):
+        q = select(
+            H.hour.label("ts"), H.local_date, H.local_hour,
+            H.place_ref, H.age_group,
+            H.count.label("n"), H.first_at, H.last_at,
+        )
+        if hours is not None:
+            q = q.where(H.local_hour.in_(hours))
+        if h_lo:
+            q = q.where(H.hour >= h_lo)
+        if h_hi:
+            q = q.where(H.hour < h_hi)
+        parts.append(q)
+        if dt_from and dt_from < h_lo:
+            edges.append((dt_from, h_lo, False))
+        if dt_to and (h_hi < dt_to or to_inclusive):
+            edges.append((h_hi, dt_to, to_inclusive))
+    else:
+        edges.append((dt_from, dt_to, to_inclusive))
+
+    if edges:
+        conds = [
+            (Stamp.checked_at >= a) & ((Stamp.checked_at <= b) if inclusive else (Stamp.checked_at < b))
+            for a, b, inclusive in edges
+        ]
+        q = (
+            select(
+                Stamp.checked_at.label("ts"), Stamp.local_date, Stamp.local_hour,
+                Stamp.place_ref,
+                func.coalesce(Stamp.age_group, "unknown").label("age_group"),
+                literal(1).label("n"),
+                Stamp.checked_at.label("first_at"), Stamp.checked_at.label("last_at"),
+            )
+            .where(or_(*conds))
+        )
+        if hours is not None:
+            q = q.where(Stamp.local_hour.in_(hours))
+        parts.append(q)
+    q = parts[0] if len(parts) == 1 else union_all(*parts)
+    return q.subquery("facts")
@@ -1,6 +1,5 @@
 # stamps.py — シングル画像（256x256）表示版：重複レコード抑止＋毎回モーダル(awarded=True)＋自動アップデート
 from datetime import datetime
-from math import radians, sin, cos, atan2
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Request
@@ -9,6 +8,8 @@ from sqlmodel import Session, select
 
 from config import ARRIVAL_RADIUS_M
 from models import engine, User, Stamp, Character, UserCharacter
+from places import place_ref, place_refs
+from assets import sprite_url
 import random
 from auth import get_current_user as _auth_get_current_user, login_required
 
@@ -38,15 +39,9 @@ def get_current_user(request: Request):
     return user
 
 # ---------------------------
-# 距離（メートル）
+# 距離（メートル）: geo.py に集約
 # ---------------------------
-def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    R = 6371000.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    c = 2 * atan2(a ** 0.5, (1 - a) ** 0.5)
-    return R * c
+from geo import haversine_m, haversine_pairs
 
 
 # ---------------------------
@@ -72,7 +67,7 @@ class CheckinIn(BaseModel):
 # ---------------------------
 # チェックイン（シングル画像返却 / 30分クールダウン）
 # ---------------------------
-from datetime import datetime, timedelta  # 先頭の import 群にありますが念のため
+from datetime import datetime, timedelta, timezone  # 先頭の import 群にありますが念のため
 
 COOLDOWN_MINUTES = 30
 
@@ -238,7 +233,7 @@ def list_all_characters(request: Request, session: Session = Depends(get_session
             items.append({
                 "code": getattr(ch, "code", "unknown"),
                 "name": getattr(ch, "name", "キャラクター"),
-                "image": sprite,
+                "image": sprite_url(sprite),
                 "frames": frames,
                 "w": w,
                 "h": h,
@@ -250,7 +245,7 @@ def list_all_characters(request: Request, session: Session = Depends(get_session
         for it in CHAR_CATALOG:
             items.append({
                 "code": it["code"], "name": it["name"],
-                "image": it["sprite"], "frames": 1,
+                "image": sprite_url(it["sprite"]), "frames": 1,
                 "w": it.get("w",256), "h": it.get("h",256),
                 "owned": False
             })
@@ -266,27 +261,58 @@ def list_all_characters(request: Request, session: Session = Depends(get_session
 
 
 
-from models import UserCharacter, Stamp
+from models import UserCharacter, Stamp, UserPlace
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from typing import List
+from fastapi import Query
+
+PLACES_PAGE_MAX = 5000
+
+def _remember_user_place(session: Session, user_id: int, place_id: str, checked_at: datetime):
+    """
+    UserPlace に (user_id, place_id) が無ければ追加する（commit は呼び出し側）。
+    同じ施設へのチェックインが同時に来ても一意制約で落ちないよう、INSERT ... ON CONFLICT DO NOTHING で入れる。
+    """
+    session.execute(
+        sqlite_insert(UserPlace.__table__)
+        .values(user_id=user_id, place_id=place_id, first_checked_at=checked_at)
+        .on_conflict_do_nothing(index_elements=["user_id", "place_id"])
+    )
 
 @router.get("/checkins/places")
 def get_checked_places(
+    since: int = Query(0, ge=0, description="前回レスポンスの cursor。これより新しい place_id だけ返す"),
+    limit: int = Query(PLACES_PAGE_MAX, ge=1, le=PLACES_PAGE_MAX),
     u = Depends(get_current_user),
     s: Session = Depends(get_session),
 ):
+    """
+    チェックイン済み place_id を UserPlace から差分で返す。
+      - since=0 なら全件（limit 件ずつ）
+      - has_more=True のときは cursor を since にして続きを取得
+    """
     # ログイン必須（ゲストは 401 にする）
     login_required(u, allow_guest=False)
 
-    q = select(Stamp.place_id).where(Stamp.user_id == u.id)
-    place_ids: List[str] = [row[0] for row in s.exec(q).all() if row[0] is not None]
+    rows = s.exec(
+        select(UserPlace.id, UserPlace.place_id)
+        .where(UserPlace.user_id == u.id, UserPlace.id > since)
+        .order_by(UserPlace.id)
+        .limit(limit + 1)
+    ).all()
 
-    # 重複除去
-    unique_ids = sorted(set(map(str, place_ids)))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    place_ids: List[str] = [str(pid) for _, pid in rows]
+    cursor = rows[-1][0] if rows else since
 
     return {
         "ok": True,
-        "place_ids": unique_ids,
-        "count": len(unique_ids),
+        "user_id": u.id,
+        "place_ids": place_ids,
+        "count": len(place_ids),
+        "cursor": cursor,
+        "has_more": has_more,
     }
     
 @router.post("/checkin")
@@ -317,11 +343,12 @@ def checkin(req: CheckinIn, request: Request, session: Session = Depends(get_ses
     now_utc = datetime.utcnow()
     cutoff = now_utc - timedelta(minutes=COOLDOWN_MINUTES)
 
+    ref = place_ref(session, req.place_id, req.place_name, req.kind, req.lat, req.lon)
     last = session.exec(
         select(Stamp)
         .where(
             Stamp.user_id == user.id,
-            Stamp.place_id == req.place_id,
+            Stamp.place_ref == ref,
             Stamp.checked_at >= cutoff,
         )
         .order_by(Stamp.checked_at.desc())
@@ -346,41 +373,21 @@ def checkin(req: CheckinIn, request: Request, session: Session = Depends(get_ses
     # 3) チェックイン履歴レコードを追加
     stamp_row = Stamp(
         user_id=user.id,
-        place_id=req.place_id,
-        place_name=req.place_name,
-        kind=req.kind or "地点",
+        place_ref=ref,
         lat=req.lat,
         lon=req.lon,
+        age_group=user.age_group,
     )
     session.add(stamp_row)
+    _remember_user_place(session, user.id, req.place_id, stamp_row.checked_at)
     session.commit()
     session.refresh(stamp_row)
 
     # 4) ランダムにスタンプ（Characterレコード）を1つ選び、必要なら付与
-    all_chars = session.exec(
-        select(Character).where(Character.code.in_(ALLOWED_CHAR_CODES))
-    ).all()
-
-    award_char = None
-    is_new = False
-
-
-    if all_chars:
-        # 既に持っているもの
-        user_chars = session.exec(
-            select(UserCharacter).where(UserCharacter.user_id == user.id)
-        ).all()
-        owned_ids = {uc.character_id for uc in user_chars}
-
-        # まだ持っていないスタンプを優先
-        not_owned = [c for c in all_chars if c.id not in owned_ids]
-        pool = not_owned if not_owned else all_chars
-
-        award_char = random.choice(pool)
-        if award_char.id not in owned_ids:
-            session.add(UserCharacter(user_id=user.id, character_id=award_char.id))
-            session.commit()
-            is_new = True
+    all_chars, owned_ids = _load_award_pool(session, user.id)
+    award_char, is_new = _pick_award(session, user.id, all_chars, owned_ids)
+    if is_new:
+        session.commit()
 
     # 5) レスポンス（JSは js.awarded && js.character でモーダル表示）
     resp = {
@@ -392,16 +399,183 @@ def checkin(req: CheckinIn, request: Request, session: Session = Depends(get_ses
     }
 
     if award_char:
-        sprite = getattr(award_char, "sprite_path", "/static/stamp/default.png")
-        resp["character"] = {  # JS 側のキー名はそのまま character を使う
-            "code": award_char.code,
-            "name": award_char.name,   # → スタンプ名
-            "sprite": sprite,
-            "image": sprite,
-            "frames": getattr(award_char, "frames", 1),
-            "w": getattr(award_char, "frame_w", 256),
-            "h": getattr(award_char, "frame_h", 256),
-            "is_new": is_new,          # 新規取得かどうか（使いたければフロントで）
-        }
+        resp["character"] = _character_payload(award_char, is_new)
 
     return resp
+
+
+# ---------------------------
+# スタンプ付与ヘルパ（単発/一括チェックイン共通）
+# ---------------------------
+def _load_award_pool(session: Session, user_id: int):
+    all_chars = session.exec(
+        select(Character).where(Character.code.in_(ALLOWED_CHAR_CODES))
+    ).all()
+    owned_ids = set(session.exec(
+        select(UserCharacter.character_id).where(UserCharacter.user_id == user_id)
+    ).all())
+    return all_chars, owned_ids
+
+
+def _pick_award(session: Session, user_id: int, all_chars, owned_ids: set):
+    """
+    まだ持っていないスタンプを優先してランダムに1つ選ぶ。
+    新規なら UserCharacter を add し owned_ids も更新する（commit は呼び出し側）。
+    """
+    if not all_chars:
+        return None, False
+
+    not_owned = [c for c in all_chars if c.id not in owned_ids]
+    pool = not_owned if not_owned else all_chars
+
+    award_char = random.choice(pool)
+    if award_char.id in owned_ids:
+        return award_char, False
+    session.add(UserCharacter(user_id=user_id, character_id=award_char.id))
+    owned_ids.add(award_char.id)
+    return award_char, True
+
+
+def _character_payload(award_char: Character, is_new: bool) -> dict:
+    sprite = sprite_url(getattr(award_char, "sprite_path", "/static/stamp/default.png"))
+    return {  # JS 側のキー名はそのまま character を使う
+        "code": award_char.code,
+        "name": award_char.name,   # → スタンプ名
+        "sprite": sprite,
+        "image": sprite,
+        "frames": getattr(award_char, "frames", 1),
+        "w": getattr(award_char, "frame_w", 256),
+        "h": getattr(award_char, "frame_h", 256),
+        "is_new": is_new,          # 新規取得かどうか（使いたければフロントで）
+    }
+
+
+# ---------------------------
+# オフライン一括チェックイン
+# ---------------------------
+BATCH_MAX_ITEMS = 50
+BATCH_MAX_AGE_DAYS = 7          # これより古い client_ts は受け付けない
+BATCH_CLOCK_SKEW_SEC = 300      # 端末時計の進みはこの秒数まで許容
+
+
+class BatchCheckinItem(CheckinIn):
+    client_id: Optional[str] = None   # 端末側キューの識別子（結果の突き合わせ用）
+    client_ts: datetime               # 端末でチェックインした時刻（ISO8601）
+
+
+class BatchCheckinIn(BaseModel):
+    items: List[BatchCheckinItem]
+
+
+def _to_naive_utc(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+@router.post("/checkin/batch")
+def checkin_batch(body: BatchCheckinIn, request: Request, session: Session = Depends(get_session)):
+    """
+    電波の悪い場所で端末に溜めたチェックインをまとめて登録する。
+      - 各アイテムは /api/checkin と同じ距離・30分クールダウンで検証
+      - クールダウンは client_ts 基準（同じバッチ内の前のアイテムも考慮）
+      - 受理したものは 1 トランザクションでまとめて INSERT
+      - results はリクエストと同じ順番で返す
+    """
+    user = get_current_user(request)
+
+    if not body.items:
+        return {"ok": True, "accepted": 0, "results": []}
+    if len(body.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一度に送れるのは {BATCH_MAX_ITEMS} 件までです")
+
+    try:
+        ensure_char_catalog_safe(session)
+    except Exception as e:
+        print("[checkin_batch] seed error:", repr(e))
+
+    try:
+        ensure_min_stamps_for_user(session, user.id, min_count=5)
+    except Exception as e:
+        print("[checkin_batch] ensure_min_stamps_for_user error:", repr(e))
+
+    now_utc = datetime.utcnow()
+    oldest = now_utc - timedelta(days=BATCH_MAX_AGE_DAYS)
+    newest = now_utc + timedelta(seconds=BATCH_CLOCK_SKEW_SEC)
+    cooldown = timedelta(minutes=COOLDOWN_MINUTES)
+
+    results: List[Optional[dict]] = [None] * len(body.items)
+    pending = []  # (index, item, ts, dist)
+
+    # 1) 時刻・距離チェック（DB 不要）。距離は全件まとめて計算
+    dists = haversine_pairs(
+        [it.user_lat for it in body.items], [it.user_lon for it in body.items],
+        [it.lat for it in body.items], [it.lon for it in body.items],
+    )
+    for i, it in enumerate(body.items):
+        base = {"index": i, "client_id": it.client_id, "place_id": it.place_id}
+        ts = _to_naive_utc(it.client_ts)
+        if ts < oldest or ts > newest:
+            results[i] = {**base, "ok": False, "status": "invalid_time",
+                          "message": f"チェックイン時刻が不正です（{BATCH_MAX_AGE_DAYS}日以内のみ）"}
+            continue
+        ts = min(ts, now_utc)
+        dist = float(dists[i])
+        if dist > ARRIVAL_RADIUS_M:
+            results[i] = {**base, "ok": False, "status": "too_far", "distance_m": round(dist, 1),
+                          "message": f"チェックインできる距離にいません（{int(dist)}m / 必要 {int(ARRIVAL_RADIUS_M)}m 以内）"}
+            continue
+        pending.append((i, it, ts, dist))
+
+    # 2) クールダウン判定用に、関係する施設の既存チェックイン時刻を 1 クエリで取得
+    seen: dict[str, List[datetime]] = {}
+    refs: dict[str, int] = {}
+    if pending:
+        refs = place_refs(session, {
+            it.place_id: (it.place_name, it.kind, it.lat, it.lon) for _, it, _, _ in reversed(pending)
+        })
+        pid_of = {ref: pid for pid, ref in refs.items()}
+        min_ts = min(ts for _, _, ts, _ in pending) - cooldown
+        max_ts = max(ts for _, _, ts, _ in pending) + cooldown
+        for ref, at in session.exec(
+            select(Stamp.place_ref, Stamp.checked_at).where(
+                Stamp.user_id == user.id,
+                Stamp.place_ref.in_(list(refs.values())),
+                Stamp.checked_at >= min_ts,
+                Stamp.checked_at <= max_ts,
+            )
+        ).all():
+            seen.setdefault(pid_of[ref], []).append(at)
+
+    # 3) 古い順に受理して INSERT（commit は最後に 1 回）
+    all_chars, owned_ids = _load_award_pool(session, user.id)
+    accepted = 0
+    for i, it, ts, dist in sorted(pending, key=lambda x: x[2]):
+        base = {"index": i, "client_id": it.client_id, "place_id": it.place_id, "distance_m": round(dist, 1)}
+        if any(abs(ts - at) < cooldown for at in seen.get(it.place_id, [])):
+            results[i] = {**base, "ok": True, "status": "repeat", "awarded": False,
+                          "message": f"{COOLDOWN_MINUTES}分以内にチェックイン済みです"}
+            continue
+
+        session.add(Stamp(
+            user_id=user.id,
+            place_ref=refs[it.place_id],
+            lat=it.lat,
+            lon=it.lon,
+            checked_at=ts,
+            age_group=user.age_group,
+        ))
+        _remember_user_place(session, user.id, it.place_id, ts)
+        seen.setdefault(it.place_id, []).append(ts)
+        accepted += 1
+
+        award_char, is_new = _pick_award(session, user.id, all_chars, owned_ids)
+        res = {**base, "ok": True, "status": "checked_in", "awarded": bool(award_char),
+               "checked_at": ts.isoformat() + "Z"}
+        if award_char:
+            res["character"] = _character_payload(award_char, is_new)
+        results[i] = res
+
+    session.commit()
+
+    return {"ok": True, "accepted": accepted, "results": results}
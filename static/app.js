@@ -271,9 +271,10 @@ function popHtml(r, kind) {
     kind
   )})'>チェックイン</button>`;
 
+  const nComments = commentCounts.get(String(id)) || 0;
   const btnPh = `<button class="btn" style="margin-left:8px" onclick="openPhotoPanel('${esc(
     id
-  )}','${esc(name)}')">みんなのコメント・写真</button>`;
+  )}','${esc(name)}')">みんなのコメント・写真${nComments ? `（${nComments}）` : ""}</button>`;
 
   return `<div style="min-width:260px">
     <div style="font-weight:700">${esc(name)}</div>
@@ -305,20 +306,64 @@ async function fetchPlaces(kind) {
 }
 
 // ログイン中ユーザーのチェックイン済み place_id 一覧
+// localStorage にキャッシュし、サーバーからは cursor 以降の差分だけ受け取る
+const CHECKED_CACHE_KEY = "nonoji_checked_places_v1";
+
+function readCheckedCache() {
+  try {
+    return JSON.parse(localStorage.getItem(CHECKED_CACHE_KEY) || "null");
+  } catch (e) {
+    return null;
+  }
+}
+
+function writeCheckedCache(userId, cursor) {
+  try {
+    localStorage.setItem(
+      CHECKED_CACHE_KEY,
+      JSON.stringify({ user_id: userId, cursor, place_ids: [...checkedPlaces] })
+    );
+  } catch (e) {
+    // 容量超過などは無視（次回は全件取得になるだけ）
+  }
+}
+
 async function loadCheckedPlaces() {
+  const cache = readCheckedCache();
+  let cursor = 0;
+  let userId = null;
+  if (cache && Array.isArray(cache.place_ids)) {
+    checkedPlaces = new Set(cache.place_ids.map(String));
+    cursor = cache.cursor || 0;
+    userId = cache.user_id;
+  }
+
   try {
-    const r = await fetch("/api/checkins/places", {
-      credentials: "include",
-    });
-    if (!r.ok) {
-      console.warn("checkins/places 取得失敗 status=", r.status);
-      return;
-    }
-    const js = await r.json();
-    if (js.ok && Array.isArray(js.place_ids)) {
-      checkedPlaces = new Set(js.place_ids.map(String));
-      console.log("checkedPlaces loaded:", checkedPlaces);
+    for (;;) {
+      const r = await fetch(`/api/checkins/places?since=${cursor}`, {
+        credentials: "include",
+      });
+      if (!r.ok) {
+        console.warn("checkins/places 取得失敗 status=", r.status);
+        return;
+      }
+      const js = await r.json();
+      if (!js.ok || !Array.isArray(js.place_ids)) return;
+
+      // 別ユーザーのキャッシュだったら捨てて最初から
+      if (userId !== null && js.user_id !== userId) {
+        checkedPlaces = new Set();
+        cursor = 0;
+        userId = js.user_id;
+        continue;
+      }
+      userId = js.user_id;
+      js.place_ids.forEach((id) => checkedPlaces.add(String(id)));
+      cursor = js.cursor;
+      if (!js.has_more) break;
     }
+    writeCheckedCache(userId, cursor);
+    console.log("checkedPlaces loaded:", checkedPlaces.size);
   } catch (e) {
     console.warn("checkins/places 読み込みエラー", e);
   }
@@ -328,6 +373,7 @@ async function loadCheckedPlaces() {
 
 function addMarkers(records, kind, group) {
   group.clearLayers();
+  const ids = [];
   records.forEach((r) => {
     if (typeof r.lat !== "number" || typeof r.lon !== "number") return;
     const rid = r.id ?? r["ID"] ?? `${kind}-${r.lat}-${r.lon}`;
@@ -337,10 +383,38 @@ function addMarkers(records, kind, group) {
       : pinSVGIcon();
 
     const m = L.marker([r.lat, r.lon], { icon });
-    m.bindPopup(popHtml(r, kind));
+    // 開くたびに作る（コメント件数が後から届いても反映されるように）
+    m.bindPopup(() => popHtml(r, kind));
     group.addLayer(m);
     markerIndex.set(String(rid), m);
+    ids.push(String(rid));
   });
+  loadCommentCounts(ids);
+}
+
+// マーカーのコメント件数（ポップアップのボタンに表示）。POST でまとめて取る
+const commentCounts = new Map();
+const COMMENT_COUNTS_BATCH = 5000;
+
+async function loadCommentCounts(placeIds) {
+  for (let i = 0; i < placeIds.length; i += COMMENT_COUNTS_BATCH) {
+    try {
+      const r = await fetch("/api/comments/counts", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ place_ids: placeIds.slice(i, i + COMMENT_COUNTS_BATCH) }),
+      });
+      if (!r.ok) return;
+      const js = await r.json();
+      Object.entries(js.counts || {}).forEach(([pid, c]) => {
+        if (c.count) commentCounts.set(pid, c.count);
+        else commentCounts.delete(pid);
+      });
+    } catch (e) {
+      console.warn("comments/counts 読み込みエラー", e);
+      return;
+    }
+  }
 }
 
 // ------ 位置情報（現在地自動取得） ------
@@ -591,7 +665,9 @@ async function checkin(id, lat, lon, name, kind) {
       .json()
       .catch(async () => ({ detail: await r.text().catch(() => null) }));
   } catch (e) {
-    return toast("サーバに接続できませんでした", false);
+    // 圏外など：端末に溜めておき、オンライン復帰時に一括送信する
+    queueOfflineCheckin(body);
+    return toast("オフラインのため、チェックインを保存しました（接続後に送信）");
   }
 
   if (r.status === 401) return toast("ログインが必要です", false);
@@ -625,6 +701,80 @@ async function checkin(id, lat, lon, name, kind) {
   }
 }
 
+// ------ オフライン・チェックインのキュー ------
+const CHECKIN_QUEUE_KEY = "nonoji_checkin_queue_v1";
+const CHECKIN_BATCH_MAX = 50; // サーバ側 BATCH_MAX_ITEMS と合わせる
+
+function readCheckinQueue() {
+  try {
+    return JSON.parse(localStorage.getItem(CHECKIN_QUEUE_KEY) || "[]");
+  } catch (e) {
+    return [];
+  }
+}
+
+function writeCheckinQueue(items) {
+  try {
+    localStorage.setItem(CHECKIN_QUEUE_KEY, JSON.stringify(items));
+  } catch (e) {
+    // 保存できなければ諦める
+  }
+}
+
+function queueOfflineCheckin(body) {
+  const q = readCheckinQueue();
+  q.push({
+    ...body,
+    client_id: `${Date.now()}-${Math.random().toString(36).slice(2, 8)}`,
+    client_ts: new Date().toISOString(),
+  });
+  writeCheckinQueue(q);
+}
+
+let flushingCheckins = false;
+
+async function flushCheckinQueue() {
+  if (flushingCheckins) return;
+  const queued = readCheckinQueue();
+  if (!queued.length) return;
+  flushingCheckins = true;
+  try {
+    const items = queued.slice(0, CHECKIN_BATCH_MAX);
+    const r = await fetch("/api/checkin/batch", {
+      method: "POST",
+      credentials: "include",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ items }),
+    });
+    if (!r.ok) return;
+    const js = await r.json();
+
+    // 返ってきた分はキューから外す（成功/失敗とも再送しない）
+    const done = new Set(items.map((it) => it.client_id));
+    writeCheckinQueue(readCheckinQueue().filter((it) => !done.has(it.client_id)));
+
+    let lastChar = null;
+    (js.results || []).forEach((res) => {
+      if (res.status !== "checked_in") return;
+      const idStr = String(res.place_id);
+      checkedPlaces.add(idStr);
+      const mk = markerIndex.get(idStr);
+      if (mk) mk.setIcon(checkedPinSVGIcon());
+      if (res.character) lastChar = res.character;
+    });
+    if (js.accepted) {
+      toast(`保存していたチェックイン ${js.accepted} 件を送信しました`);
+    }
+    if (lastChar) openGotModal(lastChar);
+  } catch (e) {
+    // まだオフライン：次の online イベントで再試行
+  } finally {
+    flushingCheckins = false;
+  }
+}
+
+window.addEventListener("online", flushCheckinQueue);
+
 window.checkin = checkin;
 window.openPhotoPanel = openPhotoPanel;
 
@@ -710,30 +860,56 @@ function openPhotoPanel(placeId, placeName) {
   document.getElementById("photoPanel").classList.add("open");
   loadPhotos(placeId);
   refreshComments();
+  openCommentStream(placeId);
 }
 function closePhotoPanel() {
   document.getElementById("photoPanel").classList.remove("open");
   document.getElementById("photoList").innerHTML = "";
+  closeCommentStream();
 }
 
-async function loadPhotos(placeId) {
-  const r = await fetch(`/api/photos?place_id=${encodeURIComponent(placeId)}`);
+// 新しい順に 1 ページずつ読み、続きがあれば「もっと見る」で次のページを足す
+async function loadPhotos(placeId, cursor) {
+  let url = `/api/photos?place_id=${encodeURIComponent(placeId)}`;
+  if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+  const r = await fetch(url);
   if (!r.ok) {
     toast("写真の取得に失敗", false);
     return;
   }
   const js = await r.json();
   const list = document.getElementById("photoList");
-  if (js.count === 0) {
+  list.querySelector(".photo-more")?.remove();
+  if (!cursor && js.count === 0) {
     list.innerHTML =
       '<div style="padding:12px;color:#475569;">まだ写真がありません。最初の一枚を投稿しませんか？</div>';
-  } else {
-    list.innerHTML = js.items.map((it) => `<img src="${it.url}" alt="">`).join(
-      ""
-    );
+    return;
+  }
+  const html = js.items.map(photoImgHtml).join("");
+  if (cursor) list.insertAdjacentHTML("beforeend", html);
+  else list.innerHTML = html;
+  if (js.has_more) {
+    const btn = document.createElement("button");
+    btn.type = "button";
+    btn.className = "photo-more";
+    btn.textContent = "もっと見る";
+    btn.onclick = () => {
+      btn.disabled = true;
+      loadPhotos(placeId, js.next_cursor);
+    };
+    list.appendChild(btn);
   }
 }
 
+// 縮小版（variants）があれば WebP/JPEG の 480px を使い、元画像はタップで開く
+function photoImgHtml(it) {
+  const v = (it.variants || {})["480"];
+  if (!v) return `<img src="${it.url}" alt="" loading="lazy">`;
+  const webp = v.webp ? `<source srcset="${v.webp}" type="image/webp">` : "";
+  const fallback = v.jpeg || it.url;
+  return `<a href="${it.url}" target="_blank" rel="noopener"><picture>${webp}<img src="${fallback}" alt="" loading="lazy"></picture></a>`;
+}
+
 async function submitPhoto(ev) {
   ev.preventDefault();
   const me = window.__USER__ || null;
@@ -747,13 +923,11 @@ async function submitPhoto(ev) {
     toast("ファイルを選択してください", false);
     return false;
   }
-  const fd = new FormData();
-  fd.append("place_id", placeId);
-  fd.append("file", fileEl.files[0]);
-  const r = await fetch("/api/photos", { method: "POST", body: fd });
-  const js = await r.json().catch(() => null);
-  if (!r.ok) {
-    toast(js?.detail || "アップロード失敗", false);
+  let js;
+  try {
+    js = await uploadPhotoResumable(placeId, fileEl.files[0]);
+  } catch (e) {
+    toast(e.message || "アップロード失敗", false);
     return false;
   }
   toast("アップロード完了！");
@@ -763,79 +937,287 @@ async function submitPhoto(ev) {
 }
 window.submitPhoto = submitPhoto;
 
-// コメント
-async function refreshComments() {
+// ------ 再開可能アップロード ------
+// 1MB ずつ PATCH で送り、回線が切れたら GET で受信済み位置を聞いて続きから送り直す。
+// ページを閉じても、同じ写真を選び直せば localStorage の upload_id で続きから再開する。
+const PHOTO_UPLOAD_KEY = "nonoji_photo_uploads_v1";
+const PHOTO_UPLOAD_RETRIES = 5;
+
+function photoUploadFingerprint(placeId, file) {
+  return [placeId, file.name, file.size, file.lastModified].join("|");
+}
+function readPhotoUploads() {
+  try {
+    return JSON.parse(localStorage.getItem(PHOTO_UPLOAD_KEY) || "{}");
+  } catch (_) {
+    return {};
+  }
+}
+function writePhotoUpload(fp, uploadId) {
+  const all = readPhotoUploads();
+  if (uploadId) all[fp] = uploadId;
+  else delete all[fp];
+  try {
+    localStorage.setItem(PHOTO_UPLOAD_KEY, JSON.stringify(all));
+  } catch (_) {}
+}
+
+async function photoUploadOffset(uploadId) {
+  const r = await fetch(`/api/photos/uploads/${uploadId}`);
+  if (!r.ok) return null;
+  return r.json();
+}
+
+async function uploadPhotoResumable(placeId, file) {
+  const fp = photoUploadFingerprint(placeId, file);
+  let chunk = 1024 * 1024;
+  let uploadId = readPhotoUploads()[fp] || null;
+  let state = uploadId ? await photoUploadOffset(uploadId).catch(() => null) : null;
+
+  if (!state) {
+    const fd = new FormData();
+    fd.append("place_id", placeId);
+    fd.append("filename", file.name);
+    fd.append("size", String(file.size));
+    const r = await fetch("/api/photos/uploads", { method: "POST", body: fd });
+    const js = await r.json().catch(() => null);
+    if (!r.ok) throw new Error(js?.detail || "アップロード失敗");
+    state = js;
+    uploadId = js.upload_id;
+    chunk = js.chunk_bytes || chunk;
+    writePhotoUpload(fp, uploadId);
+  }
+
+  let offset = state.offset;
+  let fails = 0;
+  while (!state.complete) {
+    try {
+      const r = await fetch(`/api/photos/uploads/${uploadId}`, {
+        method: "PATCH",
+        headers: { "Upload-Offset": String(offset) },
+        body: file.slice(offset, offset + chunk),
+      });
+      const js = await r.json().catch(() => null);
+      if (r.status === 409 && js) {
+        offset = js.offset; // サーバーが持っている位置に合わせる
+        continue;
+      }
+      if (!r.ok) {
+        if (r.status === 404) writePhotoUpload(fp, null);
+        throw Object.assign(new Error(js?.detail || "アップロード失敗"), { fatal: r.status < 500 });
+      }
+      state = js;
+      offset = js.offset;
+      fails = 0;
+    } catch (e) {
+      if (e.fatal || ++fails > PHOTO_UPLOAD_RETRIES) throw e;
+      await new Promise((res) => setTimeout(res, 1000 * 2 ** (fails - 1)));
+      const st = await photoUploadOffset(uploadId).catch(() => null);
+      if (st) {
+        state = st;
+        offset = st.offset;
+      }
+    }
+  }
+  writePhotoUpload(fp, null);
+  return state;
+}
+
+// コメント（トップレベルを新しい順にページング。返信はツリーで一緒に届く）
+let commentReplyTo = null; // { id, name }
+
+async function refreshComments(cursor) {
   const placeId = document.getElementById("photoPlaceId").value;
   if (!placeId) return;
+  if (!cursor) setCommentReplyTo(null);
   try {
-    const r = await fetch(
-      `/api/comments?place_id=${encodeURIComponent(placeId)}`
-    );
+    let url = `/api/comments/threads?place_id=${encodeURIComponent(placeId)}`;
+    if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+    const r = await fetch(url);
     const js = await r.json();
     if (!js.ok) throw new Error("failed");
-    renderComments(js.items || []);
+    renderComments(js.items || [], { append: !!cursor, nextCursor: js.has_more ? js.next_cursor : null });
     const cc = document.getElementById("commentCount");
-    if (cc) cc.textContent = `${js.count}件`;
+    if (cc) cc.textContent = `${js.total}件`;
+    commentCounts.set(placeId, js.total);
   } catch (e) {
     console.error(e);
     toast("コメントの取得に失敗", false);
   }
 }
 
-function renderComments(items) {
+function commentAuthorName(it) {
+  // ★ 表示名の決定
+  if (it.user_name) return it.user_name;
+  if (it.user && it.user.display_name) return it.user.display_name;
+  if (it.user && it.user.email) {
+    const em = String(it.user.email);
+    return em.includes("@") ? em.split("@")[0] : em;
+  }
+  return "匿名ユーザー";
+}
+
+function commentHtml(it, depth) {
+  const when = new Date(it.created_at).toLocaleString();
+  const who = commentAuthorName(it);
+  const id = it.id;
+
+  // ★ 削除権限チェック（本人のみ）
+  const currentId =
+    window.__USER__ && window.__USER__.id != null
+      ? Number(window.__USER__.id)
+      : null;
+  const authorId =
+    it.user && it.user.id != null ? Number(it.user.id) : null;
+  const canDelete = currentId != null && authorId != null && currentId === authorId;
+  const replies = (it.replies || []).map((c) => commentHtml(c, depth + 1)).join("");
+  // 深い返信は字下げを 3 段までにする（スマホで横幅が潰れないように）
+  const indent = Math.min(depth, 3) * 14;
+
+  return `
+      <div data-comment-id="${id}" data-depth="${depth}" style="border:1px solid #e5e7eb;border-radius:8px;padding:8px;margin-left:${indent}px;">
+        <div style="font-size:12px;color:#64748b;display:flex;justify-content:space-between;gap:8px;">
+          <span>${esc(who)} ・ ${esc(when)}</span>
+          <span style="display:flex;gap:4px;">
+            <button class="btn" style="padding:2px 8px;" data-reply-id="${id}" data-reply-name="${esc(who)}">返信</button>
+            ${
+              canDelete
+                ? `<button class="btn" style="padding:2px 8px;" onclick="deleteComment(${id})">削除</button>`
+                : ""
+            }
+          </span>
+        </div>
+        <div style="margin-top:4px;white-space:pre-wrap;">${esc(
+          it.content
+        )}</div>
+      </div>${replies}`;
+}
+
+function renderComments(items, opts = {}) {
   const box = document.getElementById("commentList");
   if (!box) return;
-  if (!items.length) {
+  box.querySelector(".comment-more")?.remove();
+  if (!opts.append && !items.length) {
     box.innerHTML = `<div style="color:#64748b;">まだコメントはありません。</div>`;
     return;
   }
 
-  box.innerHTML = items
-    .map((it) => {
-      const when = new Date(it.created_at).toLocaleString();
-
-      // ★ 表示名の決定
-      let who = "匿名ユーザー";
-      if (it.user_name) {
-        who = it.user_name;
-      } else if (it.user && it.user.display_name) {
-        who = it.user.display_name;
-      } else if (it.user && it.user.email) {
-        const em = String(it.user.email);
-        who = em.includes("@") ? em.split("@")[0] : em;
-      }
+  const html = items.map((it) => commentHtml(it, 0)).join("");
+  if (opts.append) box.insertAdjacentHTML("beforeend", html);
+  else box.innerHTML = html;
+
+  bindReplyButtons(box);
+  if (opts.nextCursor) {
+    const more = document.createElement("button");
+    more.type = "button";
+    more.className = "btn comment-more";
+    more.textContent = "もっと見る";
+    more.onclick = () => {
+      more.disabled = true;
+      refreshComments(opts.nextCursor);
+    };
+    box.appendChild(more);
+  }
+}
 
-      const id = it.id;
+function bindReplyButtons(box) {
+  box.querySelectorAll("[data-reply-id]").forEach((btn) => {
+    btn.onclick = () =>
+      setCommentReplyTo({ id: Number(btn.dataset.replyId), name: btn.dataset.replyName });
+  });
+}
 
-      // ★ 削除権限チェック（本人のみ）
-      const currentId =
-        window.__USER__ && window.__USER__.id != null
-          ? Number(window.__USER__.id)
-          : null;
-      const authorId =
-        it.user && it.user.id != null ? Number(it.user.id) : null;
-      const canDelete = currentId != null && authorId != null && currentId === authorId;
+// ------ コメントのライブ更新（SSE） ------
+// パネルを開いている間だけ購読し、他の人の投稿・削除をその場で反映する。
+// 返信はツリーの並び（親の直後に深い順）なので、親の部分木の末尾に差し込む。
+let commentStream = null;
+
+function openCommentStream(placeId) {
+  closeCommentStream();
+  if (!window.EventSource) return;
+  const es = new EventSource(`/api/comments/stream?place_id=${encodeURIComponent(placeId)}`);
+  es.addEventListener("comment", (ev) => onLiveComment(placeId, JSON.parse(ev.data)));
+  es.addEventListener("delete", (ev) => onLiveDelete(placeId, JSON.parse(ev.data)));
+  commentStream = es;
+}
+function closeCommentStream() {
+  if (commentStream) {
+    commentStream.close();
+    commentStream = null;
+  }
+}
 
-      return `
-      <div style="border:1px solid #e5e7eb;border-radius:8px;padding:8px;">
-        <div style="font-size:12px;color:#64748b;display:flex;justify-content:space-between;gap:8px;">
-          <span>${esc(who)} ・ ${esc(when)}</span>
-          ${
-            canDelete
-              ? `<button class="btn" style="padding:2px 8px;" onclick="deleteComment(${id})">削除</button>`
-              : ""
-          }
-        </div>
-        <div style="margin-top:4px;white-space:pre-wrap;">${esc(
-          it.content
-        )}</div>
-      </div>`;
-    })
-    .join("");
+// el の部分木（後ろに続く、より深いコメント）の最後の要素
+function commentSubtreeEnd(el) {
+  const depth = Number(el.dataset.depth);
+  let last = el;
+  while (last.nextElementSibling && Number(last.nextElementSibling.dataset.depth) > depth) {
+    last = last.nextElementSibling;
+  }
+  return last;
 }
 
+function setCommentTotal(placeId, diff) {
+  const n = Math.max(0, (commentCounts.get(placeId) || 0) + diff);
+  commentCounts.set(placeId, n);
+  const cc = document.getElementById("commentCount");
+  if (cc) cc.textContent = `${n}件`;
+}
 
+function onLiveComment(placeId, it) {
+  const box = document.getElementById("commentList");
+  if (!box || document.getElementById("photoPlaceId").value !== placeId) return;
+  if (box.querySelector(`[data-comment-id="${it.id}"]`)) return; // 自分の投稿で読み直し済み
+  if (it.parent_id == null) {
+    if (!box.querySelector("[data-comment-id]")) box.innerHTML = "";
+    box.insertAdjacentHTML("afterbegin", commentHtml(it, 0));
+  } else {
+    const parent = box.querySelector(`[data-comment-id="${it.parent_id}"]`);
+    if (!parent) return; // 親がまだ読み込んでいないページにある
+    commentSubtreeEnd(parent).insertAdjacentHTML(
+      "afterend",
+      commentHtml(it, Number(parent.dataset.depth) + 1)
+    );
+  }
+  bindReplyButtons(box);
+  setCommentTotal(placeId, 1);
+}
 
+function onLiveDelete(placeId, { id }) {
+  const box = document.getElementById("commentList");
+  const el = box?.querySelector(`[data-comment-id="${id}"]`);
+  if (!el) return;
+  // 返信も一緒に消す（サーバー側でも親の無い返信は表示されない）
+  const end = commentSubtreeEnd(el);
+  const nodes = [el];
+  for (let cur = el; cur !== end; ) {
+    cur = cur.nextElementSibling;
+    nodes.push(cur);
+  }
+  nodes.forEach((n) => n.remove());
+  setCommentTotal(placeId, -1);
+}
+
+// 返信先の表示（フォームの上に「○○さんへの返信 ×」）
+function setCommentReplyTo(target) {
+  commentReplyTo = target;
+  const form = document.getElementById("commentForm");
+  if (!form) return;
+  let bar = document.getElementById("commentReplyBar");
+  if (!target) {
+    bar?.remove();
+    return;
+  }
+  if (!bar) {
+    bar = document.createElement("div");
+    bar.id = "commentReplyBar";
+    bar.style.cssText = "font-size:12px;color:#475569;display:flex;gap:6px;align-items:center;";
+    form.prepend(bar);
+  }
+  bar.innerHTML = `<span>${esc(target.name)} さんへの返信</span><button type="button" class="btn" style="padding:0 6px;">×</button>`;
+  bar.querySelector("button").onclick = () => setCommentReplyTo(null);
+  document.getElementById("commentText")?.focus();
+}
 
 async function submitComment(ev) {
   ev.preventDefault();
@@ -860,7 +1242,7 @@ async function submitComment(ev) {
     const r = await fetch("/api/comments", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ place_id: placeId, content }),
+      body: JSON.stringify({ place_id: placeId, content, parent_id: commentReplyTo?.id ?? null }),
     });
     const js = await r.json().catch(() => null);
     if (!r.ok || !js?.ok) {
@@ -922,8 +1304,8 @@ function renderCharsModalAll(data) {
 
   grid.innerHTML = data.items
     .map((it) => {
-      const url =
-        new URL(it.image, location.origin).href + `?v=${Date.now()}`;
+      // build_assets.py の縮小版は URL に内容ハッシュが入るので ?v= は不要
+      const url = new URL(it.image, location.origin).href;
       return `
       <div class="card ${it.owned ? "owned" : "locked"}">
         <img src="${url}" alt="${esc(it.name)}" width="${
@@ -947,6 +1329,39 @@ let heatmapLayer,
   kindChart;
 let heatCfg = { radius: 20, maxOpacity: 0.6, maxValue: 10 };
 let heatDataCache = [];
+// ヒートマップはサーバー側でマス目にまとめた点（mode=grid）を、表示中のズーム・範囲で取り直す
+let heatParams = "";
+let heatMoveTimer = null;
+let heatTileLayer = null;
+
+function heatMode() {
+  return document.getElementById("dashHeatMode")?.value || "grid";
+}
+
+// サーバーで描いた PNG タイル（点データはブラウザに持たない）
+function showHeatTiles() {
+  setHeatData([]);
+  const params = new URLSearchParams(heatParams);
+  params.set("radius", String(Math.min(40, heatCfg.radius)));
+  const url = `/api/stats/heatmap/tiles/{z}/{x}/{y}.png?${params.toString()}`;
+  if (heatTileLayer) {
+    heatTileLayer.setUrl(url);
+    heatTileLayer.setOpacity(heatCfg.maxOpacity);
+  } else {
+    heatTileLayer = L.tileLayer(url, {
+      opacity: heatCfg.maxOpacity,
+      maxZoom: 19,
+      minZoom: 4,
+    }).addTo(heatmapMap);
+  }
+}
+
+function hideHeatTiles() {
+  if (heatTileLayer) {
+    heatmapMap.removeLayer(heatTileLayer);
+    heatTileLayer = null;
+  }
+}
 
 function buildHeatmapOverlay() {
   if (heatmapLayer) {
@@ -997,6 +1412,14 @@ function openDash() {
     }).addTo(heatmapMap);
 
     buildHeatmapOverlay();
+
+    heatmapMap.on("moveend", () => {
+      if (heatMode() !== "grid") return;
+      clearTimeout(heatMoveTimer);
+      heatMoveTimer = setTimeout(() => {
+        loadHeatmap(false).catch((e) => console.error(e));
+      }, 250);
+    });
   }
 
   const rSpan = document.getElementById("heatRadiusVal");
@@ -1022,6 +1445,44 @@ function toLocalInput(d) {
   )}T${pad(d.getHours())}:${pad(d.getMinutes())}`;
 }
 
+async function loadHeatmap(fit) {
+  if (!heatmapMap) return;
+  const params = new URLSearchParams(heatParams);
+  params.set("mode", "grid");
+  params.set("zoom", String(heatmapMap.getZoom()));
+  if (!fit) {
+    // 表示範囲だけ（fit するときは全体を取って範囲を決める）
+    const b = heatmapMap.getBounds();
+    params.set(
+      "bbox",
+      [b.getSouth(), b.getWest(), b.getNorth(), b.getEast()]
+        .map((v) => Math.max(-180, Math.min(180, v)).toFixed(4))
+        .join(",")
+    );
+  }
+  const h = await fetch(`/api/stats/heatmap?${params.toString()}`).then((r) =>
+    r.json()
+  );
+  if (!h.ok) return;
+  const data = h.points.map((p) => ({
+    lat: p[0],
+    lng: p[1],
+    value: p[2] || 1,
+  }));
+  setHeatData(data);
+  if (fit && data.length) {
+    const bounds = L.latLngBounds(data.map((d) => [d.lat, d.lng]));
+
+    const ISHIKAWA_BOUNDS = L.latLngBounds([36.0, 135.5], [37.8, 137.6]);
+
+    if (!ISHIKAWA_BOUNDS.contains(bounds)) {
+      heatmapMap.setView([36.77, 136.9], 8);
+    } else {
+      heatmapMap.fitBounds(bounds.pad(0.2));
+    }
+  }
+}
+
 function setHeatData(points) {
   heatDataCache = points || [];
   if (heatmapLayer) {
@@ -1044,33 +1505,14 @@ async function loadDashboard() {
   const geoLink = document.getElementById("geojsonLink");
   if (geoLink) geoLink.href = `/api/export/checkins.geojson?${params.toString()}`;
 
+  heatParams = params.toString();
+
   try {
-    const h = await fetch(
-      `/api/stats/heatmap?${params.toString()}`
-    ).then((r) => r.json());
-    if (h.ok) {
-      const data = h.points.map((p) => ({
-        lat: p[0],
-        lng: p[1],
-        value: p[2] || 1,
-      }));
-      setHeatData(data);
-      if (data.length) {
-        const bounds = L.latLngBounds(
-          data.map((d) => [d.lat, d.lng])
-        );
-
-        const ISHIKAWA_BOUNDS = L.latLngBounds(
-          [36.0, 135.5],
-          [37.8, 137.6]
-        );
-
-        if (!ISHIKAWA_BOUNDS.contains(bounds)) {
-          heatmapMap.setView([36.77, 136.9], 8);
-        } else {
-          heatmapMap.fitBounds(bounds.pad(0.2));
-        }
-      }
+    if (heatMode() === "tiles") {
+      showHeatTiles();
+    } else {
+      hideHeatTiles();
+      await loadHeatmap(true);
     }
 
     const t = await fetch(
@@ -1141,6 +1583,7 @@ function applyHeatConfig() {
   if (mSpan) mSpan.textContent = m;
 
   if (heatmapMap) buildHeatmapOverlay();
+  if (heatTileLayer) showHeatTiles();
 }
 window.applyHeatConfig = applyHeatConfig;
 
@@ -1210,6 +1653,7 @@ async function init() {
   try {
     // 1) チェックイン済み一覧をロード
     await loadCheckedPlaces();
+    flushCheckinQueue();
 
     // 2) 公園・公共施設をロードしてマーカー追加
     const [parks, facilities] = await Promise.all([
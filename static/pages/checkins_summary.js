@@ -0,0 +1,246 @@
+    let facChart = null;
+    let ageFacChart = null;
+
+    function toLocalInput(d){
+      const pad = n => String(n).padStart(2,'0');
+      return d.getFullYear()+'-'+pad(d.getMonth()+1)+'-'+pad(d.getDate())
+        +'T'+pad(d.getHours())+':'+pad(d.getMinutes());
+    }
+
+    function buildQueryParams(){
+      const from = document.getElementById('dateFrom').value;
+      const to   = document.getElementById('dateTo').value;
+      const kind = document.getElementById('kind').value;
+      const age  = document.getElementById('ageGroup').value;  // ★追加
+
+      const params = new URLSearchParams();
+      if (from) params.set('date_from', new Date(from).toISOString());
+      if (to)   params.set('date_to',   new Date(to).toISOString());
+      if (kind) params.set('kind', kind);
+      if (age)  params.set('age_group', age);  // ★追加
+      return params;
+    }
+
+    async function loadSummary(){
+      const params = buildQueryParams();
+      const url = '/api/checkins/summary/data?' + params.toString();
+      const csvUrl = '/api/export/checkins_summary.csv?' + params.toString();
+      document.getElementById('csvLink').href = csvUrl;
+
+      const res = await fetch(url);
+      const js  = await res.json();
+
+      if (!res.ok || !js.ok){
+        alert(js.detail || '集計の取得に失敗しました');
+        return;
+      }
+
+      // サマリ指標
+      document.getElementById('statTotal').textContent      = js.total_count ?? 0;
+      document.getElementById('statFacilities').textContent = js.facility_count ?? js.items.length;
+      document.getElementById('statDays').textContent       = js.day_span ?? '-';
+
+      // テーブル
+      const tbody = document.getElementById('facTableBody');
+      if (!js.items.length){
+        tbody.innerHTML = '<tr><td colspan="5" class="text-muted">該当データがありません</td></tr>';
+      }else{
+        tbody.innerHTML = js.items.map(it => {
+          const first = it.first_ts ? new Date(it.first_ts).toLocaleString() : '-';
+          const last  = it.last_ts  ? new Date(it.last_ts).toLocaleString()  : '-';
+          return `
+            <tr>
+              <td>${escapeHtml(it.place_name || '(名称不明)')}</td>
+              <td>${escapeHtml(it.kind || '')}</td>
+              <td class="text-end">${it.count}</td>
+              <td><small class="text-muted">${first}</small></td>
+              <td><small class="text-muted">${last}</small></td>
+            </tr>`;
+        }).join('');
+      }
+
+      // グラフ（上位10件）
+      const top = js.items.slice(0, 10);
+      const labels = top.map(it => it.place_name || '(名称不明)');
+      const values = top.map(it => it.count);
+      drawFacChart(labels, values);
+      await loadAgeSummary();
+    }
+
+    function drawFacChart(labels, values){
+      const ctx = document.getElementById('facChart');
+      if (!ctx) return;
+      if (facChart) facChart.destroy();
+      facChart = new Chart(ctx, {
+        type: 'bar',
+        data: {
+          labels,
+          datasets: [{
+            label: 'チェックイン数',
+            data: values
+          }]
+        },
+        options: {
+          responsive:true,
+          maintainAspectRatio:false,
+          scales:{
+            x: { ticks: { maxRotation: 30, minRotation: 0 } },
+            y: { beginAtZero:true }
+          }
+        }
+      });
+    }
+
+    function escapeHtml(s){
+      return String(s ?? '').replace(/[&<>"']/g, m => ({
+        '&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'
+      }[m]));
+    }
+
+    async function loadAgeSummary(){
+      const params = buildQueryParams();
+      const age = document.getElementById('ageGroup').value;
+      const noteEl = document.getElementById('ageChartNote');
+      const tbody = document.getElementById('ageFacTableBody');
+      const csvLink = document.getElementById('ageCsvLink');
+
+      if (!age) {
+        // 年代が未選択のときは案内表示だけ
+        noteEl.textContent = "上のフィルタで「年代」を選ぶと、このグラフが表示されます。";
+        tbody.innerHTML = '<tr><td colspan="4" class="text-muted">年代を選択すると表示されます</td></tr>';
+        csvLink.href = "#";
+        if (ageFacChart) {
+          ageFacChart.destroy();
+          ageFacChart = null;
+        }
+        return;
+      }
+
+      const url = '/api/checkins/by-age?' + params.toString();
+      const csvUrl = '/api/export/checkins_by_age.csv?' + params.toString();
+      csvLink.href = csvUrl;
+
+      const res = await fetch(url);
+      const js = await res.json();
+
+      if (!res.ok || !js.ok){
+        alert(js.detail || '年代別集計の取得に失敗しました');
+        return;
+      }
+
+      noteEl.textContent = `年代: ${
+        age === 'child' ? '子ども' : age === 'adult' ? 'おとな' : '高齢者'
+      } の上位施設（チェックイン数順）`;
+
+      if (!js.items.length){
+        tbody.innerHTML = '<tr><td colspan="4" class="text-muted">該当データがありません</td></tr>';
+        if (ageFacChart) {
+          ageFacChart.destroy();
+          ageFacChart = null;
+        }
+        return;
+      }
+
+      // テーブル
+      tbody.innerHTML = js.items.slice(0, 20).map(it => `
+        <tr>
+          <td>${escapeHtml(it.place_name || '(名称不明)')}</td>
+          <td>${escapeHtml(it.kind || '')}</td>
+          <td>${
+            it.age_group === 'child' ? '子ども' :
+            it.age_group === 'adult' ? 'おとな' :
+            it.age_group === 'senior' ? '高齢者' : '不明'
+          }</td>
+          <td class="text-end">${it.count}</td>
+        </tr>
+      `).join('');
+
+      // 上位10件でグラフ
+      const top = js.items.slice(0, 10);
+      const labels = top.map(it => it.place_name || '(名称不明)');
+      const values = top.map(it => it.count);
+      drawAgeFacChart(labels, values);
+    }
+
+    function drawAgeFacChart(labels, values){
+      const ctx = document.getElementById('ageFacChart');
+      if (!ctx) return;
+      if (ageFacChart) ageFacChart.destroy();
+      ageFacChart = new Chart(ctx, {
+        type: 'bar',
+        data: {
+          labels,
+          datasets: [{
+            label: 'チェックイン数（選択した年代）',
+            data: values
+          }]
+        },
+        options: {
+          responsive:true,
+          maintainAspectRatio:false,
+          scales:{
+            x: { ticks: { maxRotation: 30, minRotation: 0 } },
+            y: { beginAtZero:true }
+          }
+        }
+      });
+    }
+
+    // 初期化：直近30日をセットしてからロード
+    (function init(){
+      const now  = new Date();
+      const from = new Date(now.getTime() - 30*24*60*60*1000);
+      document.getElementById('dateFrom').value = toLocalInput(from);
+      document.getElementById('dateTo').value   = toLocalInput(now);
+      loadSummary();
+    })();
+
+    (function () {
+      const audio = document.getElementById("bgmAudio");
+      const btn   = document.getElementById("bgmToggleBtn");
+      if (!audio || !btn) return;
+
+      /* ▼ 音量を50%に設定 ▼ */
+      audio.volume = 0.5;
+
+      const STORAGE_KEY = "ifp_bgm_enabled";
+
+      let enabled = localStorage.getItem(STORAGE_KEY);
+      enabled = (enabled === null) ? true : (enabled === "true");
+
+      const updateButtonText = () => {
+        btn.textContent = enabled ? "🎵 BGM ON" : "🔇 BGM OFF";
+      };
+
+      const playIfAllowed = async () => {
+        if (!enabled) {
+          try { audio.pause(); } catch(e) {}
+          return;
+        }
+        try {
+          await audio.play();
+        } catch (e) {
+          console.log("BGM autoplay blocked:", e);
+        }
+      };
+
+      updateButtonText();
+
+      // 初回クリックで再生開始（ブラウザ制限対策）
+      const onFirstInteract = () => {
+        document.removeEventListener("click", onFirstInteract);
+        playIfAllowed();
+      };
+      document.addEventListener("click", onFirstInteract);
+
+      btn.addEventListener("click", async () => {
+        enabled = !enabled;
+        localStorage.setItem(STORAGE_KEY, String(enabled));
+        updateButtonText();
+        if (enabled) {
+          await playIfAllowed();
+        } else {
+          audio.pause();
+        }
+      });
+    })();
@@ -0,0 +1,389 @@
+    (function () {
+      const audio = document.getElementById("bgmAudio");
+      const btn   = document.getElementById("bgmToggleBtn");
+      if (!audio || !btn) return;
+
+      audio.volume = 0.5;
+      const STORAGE_KEY = "ifp_bgm_enabled";
+
+      let enabled = localStorage.getItem(STORAGE_KEY);
+      enabled = (enabled === null) ? true : (enabled === "true");
+
+      const updateButtonText = () => {
+        btn.textContent = enabled ? "🎵 BGM ON" : "🔇 BGM OFF";
+      };
+
+      const playIfAllowed = async () => {
+        if (!enabled) {
+          try { audio.pause(); } catch(e) {}
+          return;
+        }
+        try {
+          await audio.play();
+        } catch (e) {
+          console.log("BGM autoplay blocked:", e);
+        }
+      };
+
+      updateButtonText();
+
+      const onFirstInteract = () => {
+        document.removeEventListener("click", onFirstInteract);
+        playIfAllowed();
+      };
+      document.addEventListener("click", onFirstInteract);
+
+      btn.addEventListener("click", async () => {
+        enabled = !enabled;
+        localStorage.setItem(STORAGE_KEY, String(enabled));
+        updateButtonText();
+        if (enabled) {
+          await playIfAllowed();
+        } else {
+          audio.pause();
+        }
+      });
+    })();
+
+// HOME チュートリアル制御
+
+    (function() {
+      const STORAGE_KEY = "ifp_home_tutorial_hide";
+
+      const backdrop   = document.getElementById("homeTutorialBackdrop");
+      const helpBtn    = document.getElementById("homeHelpBtn");
+      if (!backdrop) return;
+
+      const pages      = Array.from(backdrop.querySelectorAll(".home-tutorial-page"));
+      const prevBtn    = document.getElementById("homeTutorialPrevBtn");
+      const nextBtn    = document.getElementById("homeTutorialNextBtn");
+      const closeBtn   = document.getElementById("homeTutorialCloseBtn");
+      const stepLabel  = document.getElementById("homeTutorialStepLabel");
+      const dontShowCb = document.getElementById("homeTutorialDontShow");
+
+      if (!pages.length || !prevBtn || !nextBtn || !closeBtn || !stepLabel) return;
+
+      const total = pages.length;
+      let currentPage = 1;
+
+      const applyPage = () => {
+        pages.forEach((p) => {
+          const pageNo = Number(p.dataset.page || "0");
+          p.classList.toggle("active", pageNo === currentPage);
+        });
+        stepLabel.textContent = `${currentPage} / ${total}`;
+
+        prevBtn.disabled = currentPage === 1;
+        nextBtn.style.display  = currentPage < total ? "inline-block" : "none";
+        closeBtn.style.display = currentPage === total ? "inline-block" : "none";
+      };
+
+      const openTutorial = (page = 1) => {
+        currentPage = Math.min(Math.max(1, page), total);
+        applyPage();
+        backdrop.style.display = "flex";
+      };
+
+      const closeTutorial = () => {
+        backdrop.style.display = "none";
+        if (dontShowCb && dontShowCb.checked) {
+          try {
+            localStorage.setItem(STORAGE_KEY, "true");
+          } catch(e) {}
+        }
+      };
+
+      prevBtn.addEventListener("click", () => {
+        if (currentPage > 1) {
+          currentPage -= 1;
+          applyPage();
+        }
+      });
+
+      nextBtn.addEventListener("click", () => {
+        if (currentPage < total) {
+          currentPage += 1;
+          applyPage();
+        }
+      });
+
+      closeBtn.addEventListener("click", () => {
+        closeTutorial();
+      });
+
+      backdrop.addEventListener("click", (ev) => {
+        if (ev.target === backdrop) {
+          closeTutorial();
+        }
+      });
+
+      document.addEventListener("keydown", (ev) => {
+        if (ev.key === "Escape" && backdrop.style.display !== "none") {
+          closeTutorial();
+        }
+      });
+
+      if (helpBtn) {
+        helpBtn.addEventListener("click", () => {
+          openTutorial(1);
+        });
+      }
+
+      try {
+        const hide = localStorage.getItem(STORAGE_KEY) === "true";
+        if (!hide) {
+          openTutorial(1);
+        }
+      } catch(e) {
+        openTutorial(1);
+      }
+    })();
+
+// 殿堂入りエリアのデータ読み込み＋スライダー制御
+
+    (function() {
+      async function loadHallOfFame() {
+        const topEl = document.getElementById("hofTopPlayers");
+        const kingEl = document.getElementById("hofKingClear");
+        if (!topEl || !kingEl) return;
+
+        try {
+          const r1 = await fetch("/api/home/top_quiz_players");
+          const d1 = await r1.json();
+          const items1 = Array.isArray(d1.items) ? d1.items : [];
+
+          if (items1.length === 0) {
+            topEl.innerHTML = '<li class="hof-empty">まだ集計中です… クイズに参加してみよう！</li>';
+          } else {
+            topEl.innerHTML = items1.map((p, idx) => {
+              const rank = idx + 1;
+              const rankPill = (rank <= 3)
+                ? `<span class="hof-rank-pill">${rank}</span>`
+                : `<span class="hof-rank-pill" style="opacity:.65;">${rank}</span>`;
+              return `
+                <li>
+                  <span class="hof-name">${rankPill}<span>${p.display_name}</span></span>
+                  <span class="hof-meta">${p.count} プレイ</span>
+                </li>
+              `;
+            }).join("");
+          }
+
+          const r2 = await fetch("/api/home/king_clearers");
+          const d2 = await r2.json();
+          const items2 = Array.isArray(d2.items) ? d2.items : [];
+
+          if (items2.length === 0) {
+            kingEl.innerHTML = '<li class="hof-empty">まだキングを倒したプレイヤーはいません。</li>';
+          } else {
+            kingEl.innerHTML = items2.map((p, idx) => {
+              const rank = idx + 1;
+              const rankPill = `<span class="hof-rank-pill">${rank}</span>`;
+              return `
+                <li>
+                  <span class="hof-name">${rankPill}<span>${p.display_name}</span></span>
+                  <span class="hof-meta">King撃破</span>
+                </li>
+              `;
+            }).join("");
+          }
+
+        } catch (e) {
+          console.error("hall-of-fame load error:", e);
+        }
+      }
+
+      function initHallOfFameCarousel() {
+        const root = document.querySelector(".hall-of-fame");
+        if (!root) return;
+
+        const track = root.querySelector(".hof-track");
+        const slides = root.querySelectorAll(".hof-slide");
+        const indicators = root.querySelectorAll(".hof-indicator");
+
+        if (!track || slides.length === 0) return;
+
+        let currentIndex = 0;
+        const total = slides.length;
+        let timerId = null;
+        const INTERVAL_MS = 6000;
+
+        const apply = () => {
+          track.style.transform = `translateX(-${currentIndex * 100}%)`;
+          indicators.forEach((btn, idx) => {
+            btn.classList.toggle("active", idx === currentIndex);
+          });
+        };
+
+        const startAuto = () => {
+          stopAuto();
+          timerId = setInterval(() => {
+            currentIndex = (currentIndex + 1) % total;
+            apply();
+          }, INTERVAL_MS);
+        };
+
+        const stopAuto = () => {
+          if (timerId) {
+            clearInterval(timerId);
+            timerId = null;
+          }
+        };
+
+        indicators.forEach((btn) => {
+          btn.addEventListener("click", () => {
+            const idx = Number(btn.dataset.index || "0");
+            currentIndex = Math.min(Math.max(idx, 0), total - 1);
+            apply();
+            startAuto();
+          });
+        });
+
+        root.addEventListener("mouseenter", stopAuto);
+        root.addEventListener("mouseleave", startAuto);
+
+        apply();
+        startAuto();
+      }
+
+      document.addEventListener("DOMContentLoaded", () => {
+        loadHallOfFame();
+        initHallOfFameCarousel();
+      });
+    })();
+
+// アプリ全体フィードバック送信 JS
+
+    (function() {
+      const openBtn   = document.getElementById("appFeedbackBtn");
+      const modalEl   = document.getElementById("appFeedbackModal");
+      const form      = document.getElementById("appFeedbackForm");
+      const ratingSel = document.getElementById("appFeedbackRating");
+      const commentEl = document.getElementById("appFeedbackComment");
+      const msgEl     = document.getElementById("appFeedbackMsg");
+      const submitBtn = document.getElementById("appFeedbackSubmit");
+
+      if (!openBtn || !modalEl || !form || !ratingSel || !commentEl || !msgEl || !submitBtn) return;
+      if (typeof bootstrap === "undefined") return;
+
+      const modal = new bootstrap.Modal(modalEl);
+
+      openBtn.addEventListener("click", () => {
+        form.reset();
+        msgEl.textContent = "";
+        msgEl.style.color = "#6b7280";
+        submitBtn.disabled = false;
+        submitBtn.textContent = "送信する";
+        modal.show();
+      });
+
+      form.addEventListener("submit", async (ev) => {
+        ev.preventDefault();
+
+        const rating = Number(ratingSel.value || "0");
+        const comment = (commentEl.value || "").trim();
+
+        if (!rating || !comment) {
+          msgEl.textContent = "評価とご意見を入力してください。";
+          msgEl.style.color = "#b91c1c";
+          return;
+        }
+
+        submitBtn.disabled = true;
+        const originalText = submitBtn.textContent;
+        submitBtn.textContent = "送信中…";
+        msgEl.textContent = "";
+        msgEl.style.color = "#6b7280";
+
+        try {
+          const res = await fetch("/api/feedback/app", {
+            method: "POST",
+            headers: {
+              "Content-Type": "application/json"
+            },
+            body: JSON.stringify({ rating, comment })
+          });
+
+          const data = await res.json().catch(() => ({}));
+
+          if (!res.ok || !data.ok) {
+            const msg = data.detail || data.message || `送信に失敗しました。（HTTP ${res.status}）`;
+            msgEl.textContent = msg;
+            msgEl.style.color = "#b91c1c";
+          } else {
+            msgEl.textContent = "ご意見ありがとうございます！";
+            msgEl.style.color = "#166534";
+            setTimeout(() => { modal.hide(); }, 800);
+          }
+        } catch (e) {
+          console.error(e);
+          msgEl.textContent = "通信エラーが発生しました。ネットワークを確認してください。";
+          msgEl.style.color = "#b91c1c";
+        } finally {
+          submitBtn.disabled = false;
+          submitBtn.textContent = originalText;
+        }
+      });
+    })();
+
+// 管理者権限カードの JS
+
+    (function() {
+      const form = document.getElementById("roleForm");
+      const emailInput = document.getElementById("roleEmail");
+      const roleSelect = document.getElementById("roleValue");
+      const resultEl = document.getElementById("roleResult");
+      const submitBtn = document.getElementById("roleSubmitBtn");
+
+      if (!form || !emailInput || !roleSelect || !resultEl || !submitBtn) {
+        return;
+      }
+
+      form.addEventListener("submit", async (ev) => {
+        ev.preventDefault();
+
+        const email = emailInput.value.trim();
+        const role = roleSelect.value.trim();
+
+        if (!email || !role) {
+          resultEl.textContent = "メールアドレスとロールを入力してください。";
+          resultEl.style.color = "#b91c1c";
+          return;
+        }
+
+        submitBtn.disabled = true;
+        const originalText = submitBtn.textContent;
+        submitBtn.textContent = "更新中…";
+        resultEl.textContent = "";
+        resultEl.style.color = "#6b7280";
+
+        try {
+          const res = await fetch("/admin/set_role", {
+            method: "POST",
+            headers: {
+              "Content-Type": "application/json"
+            },
+            body: JSON.stringify({ email, role })
+          });
+
+          const data = await res.json().catch(() => ({}));
+
+          if (!res.ok || !data.ok) {
+            const msg = data.detail || data.message || `更新に失敗しました。（HTTP ${res.status}）`;
+            resultEl.textContent = msg;
+            resultEl.style.color = "#b91c1c";
+          } else {
+            resultEl.textContent = data.message || "権限を更新しました。";
+            resultEl.style.color = "#166534";
+            roleSelect.value = data.new_role || role;
+          }
+        } catch (e) {
+          console.error(e);
+          resultEl.textContent = "通信エラーが発生しました。ネットワークを確認してください。";
+          resultEl.style.color = "#b91c1c";
+        } finally {
+          submitBtn.disabled = false;
+          submitBtn.textContent = originalText;
+        }
+      });
+    })();
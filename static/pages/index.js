@@ -0,0 +1,120 @@
+    (function () {
+      const audio = document.getElementById("bgmAudio");
+      const btn   = document.getElementById("bgmToggleBtn");
+      if (!audio || !btn) return;
+
+      audio.volume = 0.5;
+      const STORAGE_KEY = "ifp_bgm_enabled";
+
+      let enabled = localStorage.getItem(STORAGE_KEY);
+      enabled = (enabled === null) ? true : (enabled === "true");
+
+      const updateButtonText = () => {
+        btn.textContent = enabled ? "🎵 BGM ON" : "🔇 BGM OFF";
+      };
+
+      const playIfAllowed = async () => {
+        if (!enabled) {
+          try { audio.pause(); } catch(e) {}
+          return;
+        }
+        try {
+          await audio.play();
+        } catch (e) {
+          console.log("BGM autoplay blocked:", e);
+        }
+      };
+
+      updateButtonText();
+
+      const onFirstInteract = () => {
+        document.removeEventListener("click", onFirstInteract);
+        playIfAllowed();
+      };
+      document.addEventListener("click", onFirstInteract);
+
+      btn.addEventListener("click", async () => {
+        enabled = !enabled;
+        localStorage.setItem(STORAGE_KEY, String(enabled));
+        updateButtonText();
+        if (enabled) {
+          await playIfAllowed();
+        } else {
+          audio.pause();
+        }
+      });
+    })();
+
+// 「マップ・スタンプをゲット」遊び方モーダル制御
+
+    function openHowto() {
+      const m = document.getElementById("howtoModal");
+      if (m) m.style.display = "flex";
+    }
+    function closeHowto() {
+      const m = document.getElementById("howtoModal");
+      if (m) m.style.display = "none";
+    }
+    document.addEventListener("click", (e) => {
+      const m = document.getElementById("howtoModal");
+      if (!m || m.style.display !== "flex") return;
+      if (e.target === m) {
+        m.style.display = "none";
+      }
+    });
+
+    // --- マップ・スタンプ説明 初回だけ強制表示 ---
+    (function () {
+      const KEY = "ifp_map_tutorial_seen";
+      const seen = localStorage.getItem(KEY);
+
+      if (!seen) {
+        const modal = document.getElementById("howtoModal");
+        if (modal) modal.style.display = "flex";
+        localStorage.setItem(KEY, "true");
+      }
+    })();
+
+// 🎁 プレゼントを「開く」アニメを走らせる関数
+
+    function triggerGiftOpen() {
+      const gift = document.querySelector(".gift");
+      const imgEl = document.getElementById("gotImg");
+      const subtitle = document.getElementById("gotSubtitle");
+      const frame = document.getElementById("gotStampFrame");
+
+      if (!gift || !imgEl || !frame) return;
+
+      // STEP1: 箱メイン
+      if (subtitle) {
+        subtitle.textContent =
+          "プレゼントボックスを開封中… そのまま待つとスタンプがあらわれます。";
+      }
+
+      // 毎回リセット
+      gift.classList.remove("open", "hide");
+      frame.classList.remove("stamp-frame-show");
+      imgEl.classList.remove("stamp-show");
+      imgEl.style.opacity = "0";
+      imgEl.style.transform = "scale(0.7) translateY(8px)";
+
+      // リフローしてから open 開始
+      void gift.offsetWidth;
+      gift.classList.add("open");
+
+      // 0.9秒後：箱を消して同じ位置にスタンプ表示
+      setTimeout(() => {
+        gift.classList.add("hide");
+
+        // スタンプ枠＆画像を表示
+        frame.classList.add("stamp-frame-show");
+        imgEl.classList.add("stamp-show");
+        imgEl.style.opacity = "1";
+        imgEl.style.transform = "scale(1) translateY(0)";
+
+        if (subtitle) {
+          subtitle.textContent =
+            "チェックインありがとう！新しいスタンプをゲットしました。";
+        }
+      }, 900);
+    }
@@ -0,0 +1,94 @@
+    (function() {
+      const maxHp = 100;
+      let playerHp = maxHp;
+      let bossHp   = maxHp;
+
+      const playerBar = document.getElementById('playerHpFill');
+      const bossBar   = document.getElementById('bossHpFill');
+
+      function renderHp() {
+        if (playerBar) playerBar.style.width = playerHp + '%';
+        if (bossBar)   bossBar.style.width   = bossHp   + '%';
+      }
+
+      // 初期化（チャレンジモード時のみ意味があるが、DOMにバーがあれば動く）
+      function initBossBattleHp() {
+        playerHp = maxHp;
+        bossHp   = maxHp;
+        renderHp();
+      }
+
+      // ユーザが「相手より早く正解」したとき: ボスHPを1/10減らす
+      // それ以外（負けor不正解）のとき: 自分だけ1/10減らす
+      function applyBossBattleRound(userFasterAndCorrect) {
+        if (!playerBar || !bossBar) return; // 通常モードでは何もしない
+
+        if (userFasterAndCorrect) {
+          bossHp = Math.max(0, bossHp - 10);
+        } else {
+          playerHp = Math.max(0, playerHp - 10);
+        }
+        renderHp();
+      }
+
+      window.initBossBattleHp     = initBossBattleHp;
+      window.applyBossBattleRound = applyBossBattleRound;
+
+      document.addEventListener('DOMContentLoaded', function() {
+        initBossBattleHp();
+      });
+    })();
+
+// クイズ画面用BGM制御（待機画面 / チャレンジ選択のみ）
+
+    (function () {
+      const audio = document.getElementById("bgmAudio");
+      const btn   = document.getElementById("bgmToggleBtn");
+      if (!audio || !btn) return;  // play画面など、BGMが無いモードでは何もしない
+
+      // 音量を50%に設定
+      audio.volume = 0.5;
+
+      // quiz専用のキー（他ページのBGMとは独立）
+      const STORAGE_KEY = "ifp_quiz_bgm_enabled";
+
+      let enabled = localStorage.getItem(STORAGE_KEY);
+      enabled = (enabled === null) ? true : (enabled === "true");
+
+      const updateButtonText = () => {
+        btn.textContent = enabled ? "🎵 BGM ON" : "🔇 BGM OFF";
+      };
+
+      const playIfAllowed = async () => {
+        if (!enabled) {
+          try { audio.pause(); } catch(e) {}
+          return;
+        }
+        try {
+          await audio.play();
+        } catch (e) {
+          console.log("Quiz BGM autoplay blocked:", e);
+        }
+      };
+
+      updateButtonText();
+
+      // 初回ユーザー操作で再生開始（ブラウザの自動再生制限対策）
+      const onFirstInteract = () => {
+        document.removeEventListener("click", onFirstInteract);
+        playIfAllowed();
+      };
+      document.addEventListener("click", onFirstInteract);
+
+      // ボタンON/OFF
+      btn.addEventListener("click", async () => {
+        enabled = !enabled;
+        localStorage.setItem(STORAGE_KEY, String(enabled));
+        updateButtonText();
+        if (enabled) {
+          await playIfAllowed();
+        } else {
+          audio.pause();
+        }
+      });
+    })();
@@ -413,7 +413,21 @@
     };
 
     // ========= スタンプUI =========
-    const stamp = { list: [] };  // ★ クールタイム関連は削除（サーバ側で制御）
+    const stamp = { list: [], urls: {}, atlas: null };  // ★ クールタイム関連は削除（サーバ側で制御）
+    const stampSrc = (key, url) =>
+      url || stamp.urls[key] || `/static/stamp/${encodeURIComponent(key)}`;
+
+    // アトラスがあれば 1 枚の画像の一部を背景として表示（リクエスト 1 回で全スタンプ）
+    const stampPickerFace = (name) => {
+      const a = stamp.atlas;
+      const cell = a && a.cells && a.cells[name];
+      if (!cell) return `<img src="${stampSrc(name)}" alt="">`;
+      const px = a.cols > 1 ? (cell.col / (a.cols - 1)) * 100 : 0;
+      const py = a.rows > 1 ? (cell.row / (a.rows - 1)) * 100 : 0;
+      return `<span class="stamp-atlas" style="background-image:url('${a.url}');` +
+        `background-size:${a.cols * 100}% ${a.rows * 100}%;` +
+        `background-position:${px}% ${py}%"></span>`;
+    };
 
     const renderStampGrid = () => {
       // 優先：右下パネル、なければ従来サイドバー
@@ -427,7 +441,7 @@
         const btn = document.createElement("button");
         btn.className = "stamp-btn";
         btn.title = name;
-        btn.innerHTML = `<img src="/static/stamp/${encodeURIComponent(name)}" alt="">`;
+        btn.innerHTML = stampPickerFace(name);
         btn.addEventListener("click", () => {
           if (ws.readyState === WebSocket.OPEN) {
             ws.send(JSON.stringify({ type: "stamp", key: name }));
@@ -445,15 +459,17 @@
         const js = await r.json();
         if (js && js.ok && Array.isArray(js.stamps)) {
           stamp.list = js.stamps;
+          stamp.urls = js.urls || {};
+          stamp.atlas = js.atlas || null;
           renderStampGrid();
         }
       } catch (e) { /* ignore */ }
     };
 
     // ★ 自分のスタンプ：右下パネルの上に大きくポップ
-    const playStampFxSelf = (key) => {
+    const playStampFxSelf = (key, url) => {
       const img = document.createElement("img");
-      img.src = `/static/stamp/${encodeURIComponent(key)}`;
+      img.src = stampSrc(key, url);
       img.className = "stamp-fx";
       img.alt = "自分のスタンプ";
 
@@ -483,7 +499,7 @@
     };
 
     // ★ 他人のスタンプ：その人のスコア名の右横に小さくポップ
-    const playStampFxOther = (key, whoName, whoId) => {
+    const playStampFxOther = (key, whoName, whoId, url) => {
       // （もしスマホで重ければ、ここを無効化することも可能）
       if (IS_MOBILE) {
         // モバイル負荷を減らしたければ return; にしてもOK
@@ -508,7 +524,7 @@
       const r = nameEl.getBoundingClientRect();
 
       const img = document.createElement("img");
-      img.src = `/static/stamp/${encodeURIComponent(key)}`;
+      img.src = stampSrc(key, url);
       img.className = "stamp-fx";
       img.alt = `${whoName || "プレイヤー"}のスタンプ`;
 
@@ -715,9 +731,9 @@
         if (m.type === "stamp") {
           const isMe = (m.user_id != null && m.user_id === user.id) || (m.name === MY_NAME);
           if (isMe) {
-            playStampFxSelf(m.key);
+            playStampFxSelf(m.key, m.url);
           } else {
-            playStampFxOther(m.key, m.name, m.user_id);
+            playStampFxOther(m.key, m.name, m.user_id, m.url);
           }
         }
 
@@ -0,0 +1,77 @@
+# static_files.py — キャッシュ制御付きの StaticFiles
+from mimetypes import guess_type
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.staticfiles import StaticFiles
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Accept-Encoding に応じて探す圧縮済みファイル（優先順）
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+def accept_encoding_q(accept: str) -> dict:
+    """Accept-Encoding → {符号化名（小文字）: q}。例: "gzip, br;q=0" → {"gzip": 1.0, "br": 0.0}"""
+    out = {}
+    for part in accept.split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        out[token] = q
+    return out
+
+
+def _q(qs: dict, encoding: str) -> float:
+    """その符号化の q（書かれていなければ * の q、どちらも無ければ 0 = 受け付けない）"""
+    return qs.get(encoding, qs.get("*", 0.0))
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    中身が URL（ハッシュ）で決まるファイル用。ブラウザに 1 年キャッシュさせ、再検証もさせない。
+    例: /uploads/blobs/ab/cd/<sha256>.jpg, /static/build/static/app.<hash>.js
+
+    build_assets.py が作った app.<hash>.js.br / .gz があれば、Accept-Encoding に合わせてそちらを返す。
+    Range 付きリクエスト（音声のシーク等）は常に元ファイルを返す（Range は FileResponse が処理）。
+    """
+
+    async def get_response(self, path: str, scope):
+        headers = Headers(scope=scope)
+        if "range" in headers:
+            return await super().get_response(path, scope)
+
+        qs = accept_encoding_q(headers.get("accept-encoding", ""))
+        varies = False
+        for encoding, suffix in sorted(PRECOMPRESSED, key=lambda e: -_q(qs, e[0])):
+            full, stat = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat is None:
+                continue
+            varies = True
+            if _q(qs, encoding) <= 0:
+                continue
+            resp = self.file_response(full, stat, scope)
+            resp.headers["Content-Encoding"] = encoding
+            resp.headers["Content-Type"] = guess_type(path)[0] or "application/octet-stream"
+            resp.headers["Vary"] = "Accept-Encoding"
+            return resp
+        resp = await super().get_response(path, scope)
+        if varies:
+            # 圧縮版があるファイルの無圧縮版も 1 年キャッシュされるので、共有キャッシュに取り違えさせない
+            resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+    def file_response(self, *args, **kwargs):
+        resp = super().file_response(*args, **kwargs)
+        if resp.status_code in (200, 206, 304):
+            resp.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return resp
@@ -0,0 +1,151 @@
+# thumbnails.py — アップロード写真の縮小版（WebP/JPEG）をバックグラウンドで作る
+#
+# media.upload_photo が新しい MediaBlob を保存したあとに submit_derivatives() を呼ぶ。
+# 実際のリサイズはプロセスプールで行い、終わったら MediaBlob.variants_json に登録する。
+# 失敗した・処理中に再起動したなどで variants_json が空のままの blob は、
+# media.resubmit_missing_derivatives() が起動時と定期 GC のときに拾い直す（1 プロセスで DERIV_MAX_ATTEMPTS 回まで）。
+# Pillow が入っていない環境では何もしない（元画像だけが使われる）。
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 無し
+    Image = None
+    ImageOps = None
+
+DERIV_SIZES = (160, 480, 1280)          # 長辺ピクセル
+DERIV_FORMATS = {"webp": ".webp", "jpeg": ".jpg"}
+DERIV_QUALITY = {"webp": 80, "jpeg": 82}
+DERIV_WORKERS = int(os.getenv("THUMB_WORKERS", "2") or "2")
+DERIV_MAX_ATTEMPTS = 3                  # 壊れた画像などで何度も失敗する blob は諦める
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending: set = set()                   # プールに投げて結果待ちの blob_id
+_attempts: dict = {}                    # blob_id → 失敗した回数
+
+
+# ---------------------------
+# ワーカー側（別プロセスで実行。DB には触らない）
+# ---------------------------
+def build_derivatives(src_path: str, out_dir: str, stem: str) -> List[dict]:
+    """
+    src_path を DERIV_SIZES × DERIV_FORMATS に縮小して out_dir に書き出す。
+      - EXIF の Orientation に従って回転してから縮小
+      - EXIF/ICC などのメタデータは書き出さない（位置情報を残さない）
+    戻り値: [{"size", "fmt", "filename", "width", "height"}, ...]
+    """
+    out: List[dict] = []
+    with Image.open(src_path) as im:
+        im.seek(0)  # アニメ GIF 等は先頭フレームだけ
+        im = ImageOps.exif_transpose(im)
+        im = im.convert("RGB")
+        im.info.clear()
+
+        for size in DERIV_SIZES:
+            frame = im.copy()
+            frame.thumbnail((size, size), Image.LANCZOS)
+            for fmt, ext in DERIV_FORMATS.items():
+                filename = f"{stem}_w{size}{ext}"
+                tmp = os.path.join(out_dir, f".{filename}.part")
+                frame.save(tmp, format=fmt.upper(), quality=DERIV_QUALITY[fmt], optimize=True)
+                os.replace(tmp, os.path.join(out_dir, filename))
+                out.append({
+                    "size": size,
+                    "fmt": fmt,
+                    "filename": filename,
+                    "width": frame.width,
+                    "height": frame.height,
+                })
+    return out
+
+
+# ---------------------------
+# 親プロセス側
+# ---------------------------
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=DERIV_WORKERS)
+    return _pool
+
+
+def _on_done(blob_id: int, url_prefix: str, fut):
+    _pending.discard(blob_id)
+    try:
+        made = fut.result()
+    except Exception as e:
+        _attempts[blob_id] = _attempts.get(blob_id, 0) + 1
+        print(f"[thumbnails] blob {blob_id} failed (attempt {_attempts[blob_id]}):", repr(e))
+        return
+    _attempts.pop(blob_id, None)
+
+    from sqlmodel import Session
+    from models import engine, MediaBlob
+
+    variants = [
+        {
+            "size": v["size"],
+            "fmt": v["fmt"],
+            "url": f"{url_prefix}/{v['filename']}",
+            "width": v["width"],
+            "height": v["height"],
+        }
+        for v in made
+    ]
+    with Session(engine) as s:
+        blob = s.get(MediaBlob, blob_id)
+        if blob is None:
+            return
+        blob.variants_json = json.dumps(variants)
+        s.add(blob)
+        s.commit()
+
+
+def submit_derivatives(blob_id: int, src_path: str, out_dir: str, url_prefix: str) -> bool:
+    """
+    縮小版の生成をプロセスプールに投げてすぐ戻る。Pillow が無い・投げなかったときは False。
+    縮小版は src_path と同じ名前 + _w<size> で out_dir に置かれる。
+    """
+    if not can_submit(blob_id):
+        return False
+    _pending.add(blob_id)
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    try:
+        fut = _get_pool().submit(build_derivatives, src_path, out_dir, stem)
+    except Exception:
+        _pending.discard(blob_id)
+        raise
+    fut.add_done_callback(lambda f: _on_done(blob_id, url_prefix, f))
+    return True
+
+
+def can_submit(blob_id: int) -> bool:
+    """Pillow があり、処理中でも失敗しすぎでもない blob なら True"""
+    return (
+        Image is not None
+        and blob_id not in _pending
+        and _attempts.get(blob_id, 0) < DERIV_MAX_ATTEMPTS
+    )
+
+
+def variants_map(variants_json: Optional[str]) -> dict:
+    """variants_json → {"160": {"webp": url, "jpeg": url}, ...}"""
+    out: dict = {}
+    if not variants_json:
+        return out
+    try:
+        for v in json.loads(variants_json):
+            out.setdefault(str(v["size"]), {})[v["fmt"]] = v["url"]
+    except (ValueError, KeyError, TypeError):
+        return {}
+    return out
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None